@@ -1,11 +1,19 @@
-from fastapi import APIRouter, HTTPException
-from typing import Dict, Any
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from typing import Dict, Any, AsyncIterator, Iterable, List, Optional
+import asyncio
+import csv
+import io
+import json
 import logging
 import re
 from datetime import datetime
+from app.config.settings import settings
 from app.services.change_chain_service import change_chain_service
 from app.services.checklist_service import checklist_service
 from app.services.user_story_creator_service import user_story_creator_service
+from app.services.preview_session_store import preview_session_store
+from app.models.request_models import parse_work_item_ids
 
 logger = logging.getLogger(__name__)
 
@@ -44,7 +52,7 @@ async def change_chain_chat(request: Dict[str, str]) -> Dict[str, Any]:
         
         if is_confirmation:
             logger.info("✅ Обрабатываем подтверждение пользователя для User Stories")
-            result = await handle_user_confirmation_advanced(message)
+            result = await handle_user_confirmation_advanced(message, request.get("preview_token"))
             logger.info(f"🔍 Результат подтверждения: {result}")
             return result
         
@@ -81,48 +89,162 @@ async def change_chain_chat(request: Dict[str, str]) -> Dict[str, Any]:
             "message": f"Ошибка при создании цепочки изменений: {str(e)}"
         }
 
-async def handle_user_confirmation_advanced(message: str) -> Dict[str, Any]:
+def parse_source_backlog_ids(values: Iterable[Any]) -> List[int]:
+    """ID тикетов из ячеек CSV ("123", "#123"); нечисловые значения (заголовки CSV) пропускаются"""
+    ids = []
+    for value in values:
+        text = str(value).strip().lstrip('#')
+        if text.isdigit() and int(text) > 0:
+            ids.append(int(text))
+    return list(dict.fromkeys(ids))
+
+# Пакетные потоки: строка-heartbeat, если за это время не готов ни один результат
+BULK_HEARTBEAT_INTERVAL = 15.0
+BULK_HEARTBEAT_LINE = json.dumps({"heartbeat": True}) + "\n"
+BULK_STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+async def _with_heartbeat(items: AsyncIterator[Any], interval: float = BULK_HEARTBEAT_INTERVAL) -> AsyncIterator[Optional[Any]]:
+    """Элементы потока; None - за interval секунд новых элементов не было (прокси не закроет соединение)"""
+    iterator = items.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield None
+                continue
+            completed, pending = pending, None
+            try:
+                item = completed.result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+@router.post("/change-chain-bulk")
+async def change_chain_bulk(request: Request, project: str = "Houston") -> StreamingResponse:
+    """
+    Bulk creation of change chains for many source tickets
+    
+    Body: JSON {"project": "Houston", "sourceBacklogIds": [123, 456], "requestId": "..."}
+    or CSV (Content-Type: text/csv) with ticket IDs in any column; the project is taken from ?project=.
+    sourceBacklogIds must be a list of positive integers (otherwise 400).
+    Results are streamed as JSON lines as each chain completes: the first line is {"started": ...},
+    {"heartbeat": true} lines keep the connection open while no chain is ready, the last line is a summary.
+    """
+    content_type = request.headers.get("content-type", "")
+    request_id = None
+    
+    if "csv" in content_type or "text/plain" in content_type:
+        text = (await request.body()).decode("utf-8-sig")
+        source_ids = parse_source_backlog_ids(cell for row in csv.reader(io.StringIO(text)) for cell in row)
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Expected JSON or CSV body")
+        if not isinstance(body, dict):
+            raise HTTPException(status_code=400, detail='Expected JSON object {"sourceBacklogIds": [...]}')
+        project = body.get("project") or project
+        if not isinstance(project, str):
+            raise HTTPException(status_code=400, detail="project must be a string")
+        request_id = body.get("requestId")
+        try:
+            source_ids = parse_work_item_ids(body.get("sourceBacklogIds", []), "sourceBacklogIds")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if body.get("csv"):
+            source_ids = parse_source_backlog_ids(
+                source_ids + [cell for row in csv.reader(io.StringIO(body["csv"])) for cell in row]
+            )
+    
+    if not source_ids:
+        raise HTTPException(status_code=400, detail="sourceBacklogIds is required")
+    if len(source_ids) > settings.CHANGE_CHAIN_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many tickets: {len(source_ids)} (max {settings.CHANGE_CHAIN_BULK_MAX_ITEMS})"
+        )
+    if not re.match(r'^[a-zA-Z0-9_-]+$', project):
+        raise HTTPException(status_code=400, detail="Название проекта содержит недопустимые символы")
+    
+    # Проверка подключения - один раз на весь пакет
+    tfs_connected = await change_chain_service.tfs_service.test_connection()
+    if not tfs_connected:
+        raise HTTPException(status_code=503, detail="TFS service is not available")
+    
+    request_id = request_id or f"REQ-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    logger.info(f"Bulk change chain request {request_id}: {len(source_ids)} tickets, project {project}")
+    
+    async def _stream():
+        created, failed = 0, 0
+        yield json.dumps({"started": {"total": len(source_ids), "requestId": request_id}}, ensure_ascii=False) + "\n"
+        async for item in _with_heartbeat(change_chain_service.create_change_chains_bulk(project, source_ids, request_id)):
+            if item is None:
+                yield BULK_HEARTBEAT_LINE
+                continue
+            if item["success"]:
+                created += 1
+            else:
+                failed += 1
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+        summary = {"total": len(source_ids), "created": created, "failed": failed, "requestId": request_id}
+        logger.info(f"✅ Bulk change chain request {request_id} completed: {summary}")
+        yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(_stream(), media_type="application/x-ndjson", headers=BULK_STREAM_HEADERS)
+
+async def handle_user_confirmation_advanced(message: str, preview_token: str = None) -> Dict[str, Any]:
     """
     Обрабатывает подтверждение пользователя для создания User Stories (для advanced endpoints)
+    
+    preview_token - токен из ответа preview (data.preview_token): подтверждается только
+    предпросмотр этого пользователя, а не последний по времени
     """
     try:
         logger.info(f"🎯 Обработка подтверждения пользователя: {message}")
         
+        # Ищем запрос на создание User Stories по токену предпросмотра и сразу забираем его
+        # из очереди (до первого await): повторное подтверждение его уже не найдет
+        pending_request_id = next(
+            (request_id for request_id, data in pending_user_story_requests.items()
+             if preview_token and data.get("preview_token") == preview_token),
+            None
+        )
+        if pending_request_id is None:
+            return {
+                "success": False,
+                "message": "Нет активных запросов на создание User Stories. Сначала выполните запрос на создание."
+            }
+        request_data = pending_user_story_requests.pop(pending_request_id)
+        
         # Определяем, подтвердил ли пользователь
         confirmation_text = message.lower().strip()
         is_confirmed = confirmation_text in ["да", "создать", "yes", "create", "подтвердить", "подтверждаю", "а", "д"]
         
         if not is_confirmed:
+            preview_session_store.discard(preview_token)
             return {
                 "success": False,
                 "message": "Создание User Stories отменено пользователем"
             }
         
-        # Ищем последний запрос на создание User Stories
-        if not pending_user_story_requests:
-            return {
-                "success": False,
-                "message": "Нет активных запросов на создание User Stories. Сначала выполните запрос на создание."
-            }
-        
-        # Берем последний запрос (самый свежий)
-        latest_request_id = max(pending_user_story_requests.keys(), 
-                              key=lambda x: pending_user_story_requests[x]["created_at"])
-        request_data = pending_user_story_requests[latest_request_id]
         
-        logger.info(f"🔍 Найден последний запрос: {latest_request_id}")
+        logger.info(f"🔍 Найден запрос: {pending_request_id}")
         logger.info(f"🔗 URL Confluence: {request_data['confluence_url']}")
         
         # Создаем User Stories с подтверждением
         creation_result = await user_story_creator_service.create_user_stories_from_confluence(
             confluence_url=request_data["confluence_url"],
-            user_confirmation="Да"
+            user_confirmation="Да",
+            preview_token=request_data.get("preview_token")
         )
         
         if creation_result["success"]:
-            # Удаляем запрос из очереди
-            del pending_user_story_requests[latest_request_id]
-            
             # Формируем детальное сообщение с кликабельными ссылками
             created_stories = creation_result["created_stories"]
             parent_ticket = creation_result.get("parent_ticket", "")
@@ -194,14 +316,16 @@ async def checklist_chat(request: Dict[str, str]) -> Dict[str, Any]:
         if not work_item_id:
             raise HTTPException(status_code=400, detail="Не удалось найти ID рабочего элемента в запросе")
         
-        # Create checklist
-        checklist = await checklist_service.create_checklist(work_item_id)
+        # Create checklist (повторные запросы без изменений в элементах - из кэша)
+        result = await checklist_service.get_checklist(work_item_id)
         
         return {
             "success": True,
             "message": f"Чек-лист БДК ЗЗЛ для элемента #{work_item_id}",
             "work_item_id": work_item_id,
-            "checklist": checklist
+            "checklist": result["checklist"],
+            "cache_hit": result["cache_hit"],
+            "cache_age": result["cache_age"]
         }
         
     except Exception as e:
@@ -212,6 +336,96 @@ async def checklist_chat(request: Dict[str, str]) -> Dict[str, Any]:
             "message": f"Ошибка при создании чек-листа: {str(e)}"
         }
 
+CHECKLIST_CSV_COLUMNS = ["work_item_id", "title", "success", "test_plans", "integration_tests", "bugs", "error"]
+
+@router.post("/checklist-bulk")
+async def checklist_bulk(request: Request, format: str = "jsonl") -> StreamingResponse:
+    """
+    Checklists for many work items at once (e.g. a whole sprint)
+    
+    Body: JSON {"workItemIds": [123, 456]} or CSV (Content-Type: text/csv) with IDs in any column.
+    The traversal and the test plan / integration test / bug searches run once for all items.
+    workItemIds must be a list of positive integers (otherwise 400).
+    ?format=jsonl (default) streams a {"started": ...} line, one JSON line per item ({"heartbeat": true} lines
+    while the shared searches run) and a summary line; ?format=csv returns a CSV export (header sent first).
+    """
+    if format not in ("jsonl", "csv"):
+        raise HTTPException(status_code=400, detail="format must be jsonl or csv")
+    
+    content_type = request.headers.get("content-type", "")
+    if "csv" in content_type or "text/plain" in content_type:
+        text = (await request.body()).decode("utf-8-sig")
+        work_item_ids = parse_source_backlog_ids(cell for row in csv.reader(io.StringIO(text)) for cell in row)
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Expected JSON or CSV body")
+        if not isinstance(body, dict):
+            raise HTTPException(status_code=400, detail='Expected JSON object {"workItemIds": [...]}')
+        try:
+            work_item_ids = parse_work_item_ids(body.get("workItemIds", []), "workItemIds")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    if not work_item_ids:
+        raise HTTPException(status_code=400, detail="workItemIds is required")
+    if len(work_item_ids) > settings.CHECKLIST_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many work items: {len(work_item_ids)} (max {settings.CHECKLIST_BULK_MAX_ITEMS})"
+        )
+    
+    tfs_connected = await checklist_service.tfs_service.test_connection()
+    if not tfs_connected:
+        raise HTTPException(status_code=503, detail="TFS service is not available")
+    
+    logger.info(f"Bulk checklist request: {len(work_item_ids)} work items, format {format}")
+    
+    async def _jsonl():
+        created, failed = 0, 0
+        yield json.dumps({"started": {"total": len(work_item_ids)}}, ensure_ascii=False) + "\n"
+        async for item in _with_heartbeat(checklist_service.create_checklists_bulk(work_item_ids)):
+            if item is None:
+                yield BULK_HEARTBEAT_LINE
+                continue
+            if item["success"]:
+                created += 1
+            else:
+                failed += 1
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+        summary = {"total": len(work_item_ids), "created": created, "failed": failed}
+        logger.info(f"✅ Bulk checklist request completed: {summary}")
+        yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+    
+    async def _csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CHECKLIST_CSV_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        # Заголовок отправляется сразу: первый ответ не ждет общего обхода и поисков
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        async for item in checklist_service.create_checklists_bulk(work_item_ids):
+            writer.writerow({
+                **item,
+                "test_plans": "\n".join(item.get("test_plans", [])),
+                "integration_tests": "\n".join(item.get("integration_tests", [])),
+                "bugs": "\n".join(item.get("bugs", [])),
+            })
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if format == "csv":
+        filename = f"checklists-{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv"
+        return StreamingResponse(
+            _csv(),
+            media_type="text/csv; charset=utf-8",
+            headers={**BULK_STREAM_HEADERS, "Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    return StreamingResponse(_jsonl(), media_type="application/x-ndjson", headers=BULK_STREAM_HEADERS)
+
 def _parse_checklist_request(message: str) -> int:
     """
     Parse work item ID from checklist request
@@ -476,10 +690,12 @@ async def handle_user_story_creation_request_advanced(message: str) -> Dict[str,
                     }
                 
                 # Сохраняем состояние для последующего подтверждения
-                request_id = f"us_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                # Токен в ключе: предпросмотры разных пользователей в одну секунду не перезаписывают друг друга
+                request_id = f"us_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{(creation_result.get('preview_token') or '')[:8]}"
                 pending_user_story_requests[request_id] = {
                     "confluence_url": confluence_url,
                     "preview_data": preview_data,
+                    "preview_token": creation_result.get("preview_token"),
                     "created_at": datetime.now()
                 }
                 
@@ -491,7 +707,8 @@ async def handle_user_story_creation_request_advanced(message: str) -> Dict[str,
                     "data": {
                         "confluence_url": confluence_url,
                         "preview": preview_data,
-                        "request_id": request_id
+                        "request_id": request_id,
+                        "preview_token": creation_result.get("preview_token")
                     }
                 }
                 logger.info(f"✅ Ответ сформирован успешно: success={result['success']}, needs_confirmation={result['needs_confirmation']}")
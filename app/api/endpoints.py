@@ -1,5 +1,9 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from typing import Dict, Any, Optional
+from contextvars import ContextVar
+import asyncio
+import json
 import time
 import traceback
 import logging
@@ -13,7 +17,17 @@ from app.models.confluence_models import ConfluencePageRequest, ConfluencePageRe
 from app.services.openai_service import OpenAIService
 from app.services.confluence_service import ConfluenceService
 from app.services.tfs_service import TFSService
+from app.services.work_item_cache import work_item_cache
+from app.services.confluence_page_cache import confluence_page_cache
+from app.services.work_item_mirror import work_item_mirror
+from app.services.link_graph import link_graph
+from app.services.checklist_result_cache import checklist_result_cache
+from app.services.singleflight import singleflight_stats
+from app.services.job_manager import job_manager
+from app.services.wiql_service import wiql_service
+from app.services.tfs_health import tfs_health
 from app.services.user_story_creator_service import user_story_creator_service
+from app.services.preview_session_store import preview_session_store
 from app.config.settings import settings
 from app.core.startup import get_connection_status, get_system_info, global_services
 from app.core.logging_config import log_api_request, log_user_action, log_tfs_operation, log_confluence_operation
@@ -21,11 +35,68 @@ from app.core.logging_config import log_api_request, log_user_action, log_tfs_op
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Очередь событий шагов для потоковой обработки запроса (задается в /process-request/stream)
+_step_events: ContextVar[Optional[asyncio.Queue]] = ContextVar("process_request_step_events", default=None)
+
 # Инициализируем сервисы
 openai_service = OpenAIService()
 confluence_service = ConfluenceService()
 tfs_service = TFSService()
 
+def _emit_step_event(event: str, payload: Dict[str, Any]):
+    """Передача события шага в поток /process-request/stream (если запрос обрабатывается потоково)"""
+    queue = _step_events.get()
+    if queue is not None:
+        queue.put_nowait((event, payload))
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+@router.post("/process-request/stream")
+async def process_user_request_stream(request: UserRequest) -> StreamingResponse:
+    """
+    Потоковый вариант /process-request (Server-Sent Events)
+
+    События: "step_started" и "step" (статус и длительность) - по ходу каждого шага,
+    "result" - итоговый DetailedProcessingResult; комментарии-heartbeat при долгих шагах
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    token = _step_events.set(queue)
+    try:
+        # Задача копирует контекст с очередью; обработка продолжается и при разрыве соединения
+        task = asyncio.create_task(process_user_request(request))
+    finally:
+        _step_events.reset(token)
+
+    async def _stream():
+        yield _sse("started", json.dumps({"user_query": request.query, "started_at": datetime.now().isoformat()},
+                                         ensure_ascii=False))
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, task}, timeout=15, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    event, payload = getter.result()
+                    yield _sse(event, json.dumps(payload, ensure_ascii=False, default=str))
+                    continue
+                getter.cancel()
+                if task in done:
+                    break
+                yield ": heartbeat\n\n"
+            while not queue.empty():
+                event, payload = queue.get_nowait()
+                yield _sse(event, json.dumps(payload, ensure_ascii=False, default=str))
+            yield _sse("result", task.result().model_dump_json())
+        except Exception as e:
+            logger.error(f"❌ Ошибка потоковой обработки запроса: {e}")
+            yield _sse("error", json.dumps({"error": str(e)}, ensure_ascii=False))
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/process-request", response_model=DetailedProcessingResult)
 async def process_user_request(request: UserRequest) -> DetailedProcessingResult:
     """
@@ -105,6 +176,15 @@ async def process_user_request(request: UserRequest) -> DetailedProcessingResult
         articles = step2["data"]
         selected_article = articles[0]  # Берем первую найденную статью
         
+        # Поиск возвращает только метаданные: тело загружается для выбранной статьи
+        step2_body = await execute_step(
+            result, "Загрузка содержимого статьи",
+            lambda: confluence_service.load_article_body(selected_article)
+        )
+        
+        if step2_body["status"] == ActionStatus.FAILED:
+            return finalize_result(result, f"Не удалось загрузить содержимое статьи '{selected_article.title}'")
+        
         # Сохраняем информацию о статье
         result.confluence_article = ConfluenceArticleInfo(
             id=selected_article.id,
@@ -233,6 +313,9 @@ async def execute_step(result: DetailedProcessingResult, step_name: str, action_
         start_time=datetime.now()
     )
     
+    index = len(result.execution_steps)
+    _emit_step_event("step_started", {"index": index, "step_name": step_name})
+    
     try:
         logger.info(f"🔄 Начинаем: {step_name}")
         action_result = await action_func()
@@ -245,6 +328,7 @@ async def execute_step(result: DetailedProcessingResult, step_name: str, action_
         logger.info(f"✅ Завершено: {step_name}")
         
         result.execution_steps.append(step)
+        _emit_step_event("step", _step_event_payload(result, step, index))
         return {"status": ActionStatus.SUCCESS, "data": action_result}
         
     except Exception as e:
@@ -268,8 +352,21 @@ async def execute_step(result: DetailedProcessingResult, step_name: str, action_
         logger.error(f"❌ Ошибка в {step_name}: {str(e)}")
         
         result.execution_steps.append(step)
+        _emit_step_event("step", _step_event_payload(result, step, index))
         return {"status": ActionStatus.FAILED, "error": str(e)}
 
+def _step_event_payload(result: DetailedProcessingResult, step: ExecutionStep, index: int) -> Dict[str, Any]:
+    """Статус и длительность шага для потока событий (без данных шага)"""
+    return {
+        "index": index,
+        "step_name": step.step_name,
+        "status": step.status.value,
+        "duration_seconds": step.duration_seconds,
+        "elapsed_seconds": (step.end_time - result.processing_start).total_seconds(),
+        "details": step.details,
+        "error_message": step.error_message
+    }
+
 def get_error_suggestion(error_type: str, error_message: str) -> str:
     """Получение рекомендации по исправлению ошибки"""
     
@@ -372,16 +469,27 @@ async def get_system_status():
                     "description": "Система документации и знаний"
                 },
                 "tfs": {
-                    "available": True,  # Предполагаем, что работает
+                    "available": tfs_health.connected is not False,  # Кэшированный статус фоновой проверки
                     "name": "TFS/Azure DevOps",
-                    "description": "Система управления задачами и проектами"
+                    "description": "Система управления задачами и проектами",
+                    "connection": tfs_health.status()
                 }
             },
             "system": {
                 "debug_mode": settings.DEBUG,
                 "log_level": settings.LOG_LEVEL,
                 "services_loaded": 3
-            }
+            },
+            "caches": {
+                "work_items": work_item_cache.stats(),
+                "confluence_pages": confluence_page_cache.stats(),
+                "link_graph": link_graph.stats(),
+                "checklists": checklist_result_cache.stats()
+            },
+            "wiql": wiql_service.status(),
+            "work_item_mirror": work_item_mirror.status(),
+            "singleflight": singleflight_stats(),
+            "jobs": job_manager.stats()
         }
     except Exception as e:
         logger.error(f"Ошибка при получении статуса системы: {e}")
@@ -613,10 +721,10 @@ async def handle_user_story_creation_request(request: UserRequest, result: Detai
                 result.message += "Для подтверждения создания отправьте: 'Да' или 'Создать'\n"
                 result.message += "Для отмены отправьте: 'Нет' или 'Отмена'"
                 
-                # Сохраняем данные для последующего создания
+                # Данные для последующего создания хранятся в сессии предпросмотра
                 result.additional_data = {
                     "confluence_url": confluence_url,
-                    "page_data": creation_result.get("page_data"),
+                    "preview_token": creation_result.get("preview_token"),
                     "preview": preview_data
                 }
                 
@@ -676,12 +784,14 @@ async def handle_user_confirmation(request: UserRequest, result: DetailedProcess
     try:
         logger.info(f"🎯 Обработка подтверждения пользователя: {request.query}")
         
-        # Проверяем, есть ли сохраненные данные для создания
-        if not hasattr(result, 'additional_data') or not result.additional_data:
+        # Сессия предпросмотра - только по токену из ответа preview (additional_data.preview_token)
+        additional_params = request.additional_params or {}
+        preview_token = additional_params.get("preview_token")
+        session = preview_session_store.get(preview_token) if preview_token else None
+        if not session:
             return finalize_result(result, "Нет данных для создания User Stories. Сначала выполните запрос на создание.")
         
-        additional_data = result.additional_data
-        confluence_url = additional_data.get("confluence_url")
+        confluence_url = session.confluence_url
         
         if not confluence_url:
             return finalize_result(result, "Не найден URL страницы Confluence для создания User Stories")
@@ -691,12 +801,14 @@ async def handle_user_confirmation(request: UserRequest, result: DetailedProcess
         is_confirmed = confirmation_text in ["да", "создать", "yes", "create", "подтвердить", "подтверждаю"]
         
         if not is_confirmed:
+            preview_session_store.discard(session.token)
             return finalize_result(result, "Создание User Stories отменено пользователем")
         
         # Создаем User Stories с подтверждением
         creation_result = await user_story_creator_service.create_user_stories_from_confluence(
             confluence_url=confluence_url,
-            user_confirmation="Да"
+            user_confirmation="Да",
+            preview_token=session.token
         )
         
         if creation_result["success"]:
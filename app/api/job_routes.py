@@ -0,0 +1,100 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
+import json
+import logging
+
+from app.services.job_manager import job_manager, JobQueueFullError
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+class SubmitJobRequest(BaseModel):
+    """Запрос на запуск фонового задания"""
+    type: str = Field(..., description="Тип задания: checklist, checklist_bulk, change_chain, change_chain_bulk, user_stories")
+    params: Dict[str, Any] = Field(default_factory=dict, description="Параметры задания")
+
+class JobResponse(BaseModel):
+    """Состояние фонового задания"""
+    job_id: str
+    type: str
+    status: str
+    progress: list = []
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    duration: Optional[float] = None
+    result: Optional[Any] = None
+
+def _get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задание {job_id} не найдено или его результат устарел")
+    return job
+
+@router.post("", response_model=JobResponse, status_code=202)
+async def submit_job(request: SubmitJobRequest):
+    """
+    Запуск долгой операции в фоне
+
+    Ответ возвращается сразу: состояние - GET /jobs/{job_id}, поток изменений -
+    GET /jobs/{job_id}/events (SSE), результат - GET /jobs/{job_id}/result
+    """
+    try:
+        job = job_manager.submit(request.type, request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return JobResponse(**job.to_dict())
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Состояние задания и ход выполнения"""
+    return JobResponse(**_get_job(job_id).to_dict())
+
+@router.get("/{job_id}/result", response_model=JobResponse)
+async def get_job_result(job_id: str):
+    """Результат завершенного задания (409 - задание еще выполняется)"""
+    job = _get_job(job_id)
+    if not job.is_finished:
+        raise HTTPException(status_code=409, detail=f"Задание {job_id} еще не завершено ({job.status})")
+    return JobResponse(**job.to_dict(include_result=True))
+
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: str) -> StreamingResponse:
+    """
+    Поток изменений задания (Server-Sent Events)
+
+    Событие "progress" - после каждого изменения, "done" - по завершении (с результатом);
+    комментарии-heartbeat не дают прокси закрыть соединение
+    """
+    _get_job(job_id)
+
+    async def _stream():
+        async for job in job_manager.watch(job_id):
+            if job is None:
+                yield ": heartbeat\n\n"
+                continue
+            event = "done" if job.is_finished else "progress"
+            data = json.dumps(job.to_dict(include_result=job.is_finished), ensure_ascii=False, default=str)
+            yield f"event: {event}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.delete("/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """Отмена задания из очереди или во время выполнения"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задание {job_id} не найдено")
+    return JobResponse(**job.to_dict())
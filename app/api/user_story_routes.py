@@ -13,12 +13,14 @@ class CreateUserStoriesRequest(BaseModel):
     """Запрос на создание User Stories из Confluence"""
     confluence_url: HttpUrl = Field(..., description="URL страницы Confluence")
     user_confirmation: Optional[str] = Field(None, description="Подтверждение пользователя (Да/Нет)")
+    preview_token: Optional[str] = Field(None, description="Токен предварительного просмотра")
 
 class UserStoryPreviewResponse(BaseModel):
     """Ответ с предварительным просмотром User Stories"""
     success: bool
     preview: Optional[Dict[str, Any]] = None
     needs_confirmation: bool = False
+    preview_token: Optional[str] = None
     error: Optional[str] = None
 
 class UserStoryCreationResponse(BaseModel):
@@ -48,7 +50,8 @@ async def create_user_stories_from_confluence(request: CreateUserStoriesRequest)
         # Вызов основного сервиса
         result = await user_story_creator_service.create_user_stories_from_confluence(
             confluence_url=str(request.confluence_url),
-            user_confirmation=request.user_confirmation
+            user_confirmation=request.user_confirmation,
+            preview_token=request.preview_token
         )
         
         if result["success"]:
@@ -57,7 +60,8 @@ async def create_user_stories_from_confluence(request: CreateUserStoriesRequest)
                 return UserStoryPreviewResponse(
                     success=True,
                     preview=result["preview"],
-                    needs_confirmation=True
+                    needs_confirmation=True,
+                    preview_token=result.get("preview_token")
                 )
             else:
                 # Возвращаем результат создания
@@ -102,7 +106,8 @@ async def preview_user_stories(confluence_url: str):
             return UserStoryPreviewResponse(
                 success=True,
                 preview=result["preview"],
-                needs_confirmation=True
+                needs_confirmation=True,
+                preview_token=result.get("preview_token")
             )
         else:
             return UserStoryPreviewResponse(
@@ -120,7 +125,8 @@ async def preview_user_stories(confluence_url: str):
 @router.post("/confirm-creation")
 async def confirm_user_stories_creation(
     confluence_url: str,
-    user_confirmation: str
+    user_confirmation: str,
+    preview_token: Optional[str] = None
 ):
     """
     Подтверждение создания User Stories после предварительного просмотра
@@ -128,13 +134,16 @@ async def confirm_user_stories_creation(
     Args:
         confluence_url: URL страницы Confluence
         user_confirmation: Подтверждение пользователя ("Да"/"Нет")
+        preview_token: Токен предварительного просмотра (страница не загружается повторно,
+            если ее версия не изменилась)
     """
     try:
         logger.info(f"Подтверждение создания User Stories: {user_confirmation}")
         
         result = await user_story_creator_service.create_user_stories_from_confluence(
             confluence_url=confluence_url,
-            user_confirmation=user_confirmation
+            user_confirmation=user_confirmation,
+            preview_token=preview_token
         )
         
         if result["success"]:
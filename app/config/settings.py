@@ -20,12 +20,102 @@ class Settings(BaseSettings):
     CONFLUENCE_USER: str = ""  # email пользователя
     CONFLUENCE_USERNAME: str = ""  # Alias for CONFLUENCE_USER
     CONFLUENCE_SPACE: Optional[str] = None  
+
+    # Пул HTTP-соединений к Confluence (асинхронный клиент)
+    CONFLUENCE_HTTP_MAX_CONNECTIONS: int = 10
+    CONFLUENCE_HTTP_TIMEOUT: float = 30.0
+    # Поиск статей: второй из параллельных поисков отменяется, если первый нашел столько статей
+    CONFLUENCE_SEARCH_ENOUGH_HITS: int = 5
+
+    # Кэш страниц Confluence по ID с проверкой версии (пустой путь - только в памяти)
+    CONFLUENCE_PAGE_CACHE_MAX_SIZE: int = 50
+    CONFLUENCE_PAGE_CACHE_PATH: str = "data/confluence_pages.db"
+    CONFLUENCE_PAGE_CACHE_DISK_MAX_SIZE: int = 500
     
     # TFS настройки  
     TFS_PROJECT: str = ""  
     TFS_ORGANIZATION: str = ""
     TFS_DEFAULT_PROJECT: Optional[str] = None
-    
+
+    # Пул HTTP-соединений к TFS (асинхронный клиент)
+    TFS_HTTP_MAX_CONNECTIONS: int = 20
+    TFS_HTTP_MAX_KEEPALIVE: int = 10
+    TFS_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    TFS_HTTP_TIMEOUT: float = 30.0
+
+    # Проверка подключения к TFS: найденный адрес API сохраняется, доступность проверяется в фоне
+    TFS_CONNECTION_STATE_PATH: str = "data/tfs_connection.json"
+    TFS_HEALTH_CHECK_INTERVAL: float = 60.0
+    # Повторная проверка возможностей WIQL, если сервер не ответил (секунды)
+    WIQL_PROBE_RETRY_INTERVAL: float = 60.0
+
+    # Кэш Work Items (TTL в секундах, после истечения - проверка по System.Rev)
+    WORK_ITEM_CACHE_ENABLED: bool = True
+    WORK_ITEM_CACHE_MAX_SIZE: int = 2000
+    WORK_ITEM_CACHE_TTL: float = 60.0
+    # Граф связей Work Items в памяти: максимум элементов (LRU)
+    LINK_GRAPH_MAX_SIZE: int = 20000
+
+    # Обход связей Work Items для чек-листов
+    CHECKLIST_TRAVERSAL_MAX_DEPTH: int = 2
+    CHECKLIST_TRAVERSAL_CHILDREN_MAX_DEPTH: int = 10
+    CHECKLIST_TRAVERSAL_MAX_FAN_OUT: int = 20
+    CHECKLIST_TRAVERSAL_MAX_ITEMS: int = 300
+    CHECKLIST_TRAVERSAL_CONCURRENCY: int = 4
+    CHECKLIST_TRAVERSAL_TIME_BUDGET: float = 90.0
+
+    # Кэш готовых чек-листов (проверка по ревизиям элементов; max_age - предельный возраст в секундах)
+    CHECKLIST_CACHE_ENABLED: bool = True
+    CHECKLIST_CACHE_MAX_SIZE: int = 200
+    CHECKLIST_CACHE_MAX_AGE: float = 3600.0
+    # Пакетные чек-листы (/checklist-bulk): максимум Work Items в запросе
+    CHECKLIST_BULK_MAX_ITEMS: int = 100
+
+    # Индекс Pull Requests для поиска интеграционных тестов (обновляется в фоне раз в PR_INDEX_REFRESH_INTERVAL)
+    PR_INDEX_PROJECT: str = "Houston"
+    PR_INDEX_REPOSITORY: str = "e44e86d8-98ea-413e-917a-7c205e947451"
+    PR_INDEX_DB_PATH: str = "data/pr_index.db"
+    PR_INDEX_REFRESH_INTERVAL: float = 300.0
+    PR_INDEX_MAX_NEW_PRS: int = 1000
+
+    # Индекс тест-планов для чек-листов (проекты через запятую, обновление в фоне)
+    TEST_PLAN_INDEX_ENABLED: bool = True
+    TEST_PLAN_INDEX_PROJECTS: str = "Houston"
+    TEST_PLAN_INDEX_DB_PATH: str = "data/test_plan_index.db"
+    TEST_PLAN_INDEX_REFRESH_INTERVAL: float = 900.0
+    # Полное перестроение (связи "Tests" всех тестовых случаев) - не реже, чем раз в столько секунд
+    TEST_PLAN_INDEX_FULL_REBUILD_INTERVAL: float = 86400.0
+
+    # Локальное зеркало Work Items (SQLite FTS5) для текстового поиска; синхронизация по ChangedDate
+    WORK_ITEM_MIRROR_ENABLED: bool = False
+    # Проекты через запятую; "*" - вся коллекция (нужно, чтобы зеркало заменяло поиск чек-листов по всей коллекции)
+    WORK_ITEM_MIRROR_PROJECTS: str = "Houston"
+    WORK_ITEM_MIRROR_DB_PATH: str = "data/work_item_mirror.db"
+    WORK_ITEM_MIRROR_SYNC_INTERVAL: float = 120.0
+    # Зеркало используется для поиска, только если синхронизировано не раньше стольких секунд назад
+    WORK_ITEM_MIRROR_MAX_STALENESS: float = 900.0
+    # Сверка с TFS для удаления удаленных элементов - раз в столько секунд
+    WORK_ITEM_MIRROR_PURGE_INTERVAL: float = 3600.0
+
+    # Сессии предварительного просмотра User Stories (TTL в секундах)
+    USER_STORY_PREVIEW_TTL: float = 1800.0
+    USER_STORY_PREVIEW_MAX_SESSIONS: int = 100
+
+    # Создание User Stories: $batch-запрос и параллелизм при создании по одной
+    USER_STORY_CREATE_USE_BATCH: bool = True
+    USER_STORY_CREATE_CONCURRENCY: int = 4
+
+    # Создание цепочки изменений одним $batch-запросом
+    CHANGE_CHAIN_USE_BATCH: bool = True
+    CHANGE_CHAIN_BULK_CONCURRENCY: int = 4
+    CHANGE_CHAIN_BULK_MAX_ITEMS: int = 100
+
+    # Фоновые задания: число обработчиков, размер очереди, хранение результатов (секунды)
+    JOB_WORKERS: int = 4
+    JOB_QUEUE_SIZE: int = 100
+    JOB_DB_PATH: str = "data/jobs.db"
+    JOB_RESULT_TTL: float = 86400.0
+
     # Настройки приложения
     DEBUG: bool = False
     LOG_LEVEL: str = "INFO"
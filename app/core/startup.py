@@ -4,6 +4,13 @@ from typing import Dict, Any
 from app.services.openai_service import OpenAIService
 from app.services.confluence_service import ConfluenceService
 from app.services.tfs_service import TFSService
+from app.services.wiql_service import wiql_service
+from app.services.tfs_health import tfs_health
+from app.services.test_plan_index import test_plan_index
+from app.services.pull_request_index import pull_request_index
+from app.services.work_item_mirror import work_item_mirror
+from app.services.job_manager import job_manager
+from app.services.job_handlers import register_job_handlers
 from app.config.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -24,10 +31,28 @@ async def initialize_extensions():
         # 2. Тестируем подключения
         await _test_connections()
         
-        # 3. Инициализируем расширения (если есть)
+        # 3. Определяем возможности WIQL в фоне (не задерживаем старт при недоступном TFS)
+        global_services["wiql_probe"] = asyncio.create_task(_probe_wiql())
+        
+        # Индекс тест-планов обновляется в фоне, чек-листы читают его локально
+        if settings.TEST_PLAN_INDEX_ENABLED:
+            global_services["test_plan_index_task"] = asyncio.create_task(test_plan_index.run_periodic())
+        
+        # Индекс PR (интеграционные тесты) - тоже только в фоне
+        global_services["pr_index_task"] = asyncio.create_task(pull_request_index.run_periodic())
+        
+        # Зеркало Work Items для локального текстового поиска (опционально)
+        if settings.WORK_ITEM_MIRROR_ENABLED:
+            global_services["work_item_mirror_task"] = asyncio.create_task(work_item_mirror.run_periodic())
+        
+        # Пул обработчиков фоновых заданий (долгие чек-листы, цепочки, User Stories)
+        register_job_handlers(job_manager)
+        job_manager.start()
+        
+        # 4. Инициализируем расширения (если есть)
         await _initialize_extensions()
         
-        # 4. Настраиваем логирование
+        # 5. Настраиваем логирование
         _configure_logging()
         
         logger.info("✅ Все расширения успешно инициализированы")
@@ -90,19 +115,28 @@ async def _test_connections():
     # Тест Confluence
     try:
         confluence_service = global_services["confluence"]
-        confluence_ok = confluence_service.test_connection()
+        confluence_ok = await confluence_service.test_connection()
         connection_results["confluence"] = confluence_ok
         logger.info(f"  Confluence: {'✅' if confluence_ok else '❌'}")
     except Exception as e:
         logger.warning(f"  Confluence: ❌ {e}")
         connection_results["confluence"] = False
     
-    # Тест TFS
+    # Тест TFS: адрес API определяется один раз, дальше статус читается из tfs_health
     try:
         tfs_service = global_services["tfs"]
-        tfs_ok = tfs_service.test_connection()
+        tfs_ok = await tfs_service.test_connection(force=True)
         connection_results["tfs"] = tfs_ok
         logger.info(f"  TFS: {'✅' if tfs_ok else '❌'}")
+        
+        # Найденный адрес применяется и к общему экземпляру сервиса
+        from app.services.tfs_service import tfs_service as shared_tfs_service
+        await shared_tfs_service.test_connection()
+        
+        # Фоновая проверка доступности TFS
+        global_services["tfs_health_task"] = asyncio.create_task(
+            tfs_health.run_periodic(tfs_service._check_connection)
+        )
     except Exception as e:
         logger.warning(f"  TFS: ❌ {e}")
         connection_results["tfs"] = False
@@ -118,6 +152,13 @@ async def _test_connections():
     else:
         logger.info("🎉 Все внешние сервисы доступны")
 
+async def _probe_wiql():
+    """Однократная проверка версии WIQL API и поддержки WorkItemLinks"""
+    try:
+        await wiql_service.get_capabilities()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось определить возможности WIQL: {e}")
+
 async def _initialize_extensions():
     """Инициализация расширений системы (если будут добавлены)"""
     
@@ -184,12 +225,17 @@ def get_service(service_name: str):
 
 def get_connection_status() -> Dict[str, bool]:
     """Получение статуса подключений к внешним сервисам"""
-    return global_services.get("connection_status", {})
+    status = dict(global_services.get("connection_status", {}))
+    if tfs_health.connected is not None:
+        # Актуальный статус TFS из фоновой проверки
+        status["tfs"] = tfs_health.is_available()
+    return status
 
 def get_system_info() -> Dict[str, Any]:
     """Получение информации о состоянии системы"""
     return {
-        "services_loaded": len([k for k in global_services.keys() if k not in ["connection_status", "extensions"]]),
+        "services_loaded": len([k for k in global_services.keys()
+                                if k not in ["connection_status", "extensions", "wiql_probe", "tfs_health_task"]]),
         "connections": get_connection_status(),
         "extensions": global_services.get("extensions", {}),
         "debug_mode": settings.DEBUG,
@@ -202,8 +248,12 @@ async def cleanup_extensions():
     logger.info("🧹 Очистка ресурсов...")
     
     try:
-        # Здесь можно добавить очистку ресурсов сервисов
-        # Например, закрытие соединений, очистка кэшей и т.д.
+        # Останавливаем фоновые задачи
+        for key in ["tfs_health_task", "wiql_probe", "test_plan_index_task", "pr_index_task", "work_item_mirror_task"]:
+            task = global_services.get(key)
+            if task and not task.done():
+                task.cancel()
+        await job_manager.stop()
         
         global_services.clear()
         logger.info("✅ Ресурсы очищены")
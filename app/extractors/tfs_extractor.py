@@ -4,6 +4,7 @@ from datetime import datetime
 from app.core.interfaces import IDataExtractor, DataItem, RelatedItem, DataSourceType
 from app.models.extended_models import TFSWorkItem
 from app.services.tfs_service import TFSService
+from app.services.link_graph import link_graph
 
 logger = logging.getLogger(__name__)
 
@@ -66,15 +67,16 @@ class TFSExtractor(IDataExtractor):
     async def get_related_items(self, item_id: str) -> List[RelatedItem]:
         """Получение связанных элементов"""
         try:
-            work_item = await self._get_work_item_details(int(item_id))
-            if not work_item:
-                return []
+            work_item_id = int(item_id)
+            # Связи берем из графа связей; элемент загружается, только если его связей там нет
+            if not link_graph.is_complete(work_item_id):
+                await self.tfs_service.get_work_item(work_item_id)
             
             related_items = []
             
             # Родительские элементы
-            if work_item.parent_id:
-                parent_item = await self.extract_item(str(work_item.parent_id))
+            for parent_id in link_graph.ancestors(work_item_id, max_depth=1):
+                parent_item = await self.extract_item(str(parent_id))
                 if parent_item:
                     related_items.append(RelatedItem(
                         item=parent_item,
@@ -82,7 +84,7 @@ class TFSExtractor(IDataExtractor):
                     ))
             
             # Дочерние элементы
-            for child_id in work_item.child_ids:
+            for child_id in link_graph.descendants(work_item_id, max_depth=1):
                 child_item = await self.extract_item(str(child_id))
                 if child_item:
                     related_items.append(RelatedItem(
@@ -91,7 +93,7 @@ class TFSExtractor(IDataExtractor):
                     ))
             
             # Связанные элементы
-            for related_id in work_item.related_ids:
+            for related_id in link_graph.related(work_item_id):
                 related_item = await self.extract_item(str(related_id))
                 if related_item:
                     related_items.append(RelatedItem(
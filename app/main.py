@@ -8,7 +8,10 @@ from app.api.advanced_endpoints import router as advanced_router
 from app.api.confluence_routes import router as confluence_router
 from app.api.tfs_routes import router as tfs_router
 from app.api.user_story_routes import router as user_story_router
-from app.core.startup import initialize_extensions
+from app.api.job_routes import router as job_router
+from app.core.startup import initialize_extensions, cleanup_extensions
+from app.services.tfs_service import close_http_client
+from app.services.confluence_service import close_http_client as close_confluence_http_client
 from app.config.settings import settings
 
 @asynccontextmanager
@@ -17,7 +20,9 @@ async def lifespan(app: FastAPI):
     await initialize_extensions()
     yield
     # Очистка при завершении
-    pass
+    await cleanup_extensions()
+    await close_http_client()
+    await close_confluence_http_client()
 
 app = FastAPI(
     title="Расширяемая система автоматизации TFS-Confluence",
@@ -43,6 +48,7 @@ app.include_router(advanced_router, tags=["advanced"])
 app.include_router(confluence_router, prefix="/api/v1", tags=["confluence"])
 app.include_router(tfs_router, prefix="/api/v1", tags=["tfs"])
 app.include_router(user_story_router, prefix="/api/v1", tags=["user-stories"])
+app.include_router(job_router, prefix="/api/v1", tags=["jobs"])
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
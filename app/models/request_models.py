@@ -24,11 +24,14 @@ class ConfluenceArticle(BaseModel):
     """Модель статьи Confluence"""
     id: str
     title: str
-    content: str
+    content: str = ""
     space_key: str
     url: Optional[str] = None
     created_date: Optional[datetime] = None
     modified_date: Optional[datetime] = None
+    version: Optional[int] = None
+    # False - результат поиска без тела (см. ConfluenceService.load_article_body)
+    body_loaded: bool = True
 
 class UserStoryData(BaseModel):
     """Модель данных для создания User Story"""
@@ -82,4 +85,12 @@ class UserRequest(BaseModel):
         json_encoders={
             datetime: lambda v: v.isoformat()
         }
-    )
\ No newline at end of file
+    )
+def parse_work_item_ids(value: Any, name: str) -> List[int]:
+    """ID рабочих элементов из JSON-параметра; ValueError - значение не список положительных целых чисел"""
+    if not isinstance(value, list):
+        raise ValueError(f"{name} должен быть списком ID рабочих элементов")
+    for item in value:
+        if isinstance(item, bool) or not isinstance(item, int) or item <= 0:
+            raise ValueError(f"{name}: недопустимый ID {item!r} (ожидаются положительные целые числа)")
+    return list(dict.fromkeys(value))
@@ -69,7 +69,11 @@ class DetailedProcessingResult(BaseModel):
     # Итоговая сводка
     summary: str
     recommendations: List[str] = []
-    
+
+    # Сообщение для чата и данные для следующего шага (preview_token для подтверждения)
+    message: Optional[str] = None
+    additional_data: Optional[Dict[str, Any]] = None
+
     model_config = ConfigDict(
         json_encoders={
             datetime: lambda v: v.isoformat()
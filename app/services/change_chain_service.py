@@ -1,8 +1,9 @@
+import asyncio
 import logging
-import json
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
 from datetime import datetime
-from app.services.tfs_service import TFSService
+from app.services.tfs_service import TFSService, TFSBatchOutcomeUnknownError
+from app.services.work_item_cache import work_item_cache
 from app.services.openai_service import OpenAIService
 from app.config.settings import settings
 from app.core.logging_config import log_tfs_operation, log_user_action
@@ -103,74 +104,59 @@ class ChangeChainService:
             if pattern.lower() in parsed_data["requestTitle"].lower():
                 raise ValueError("Заголовок содержит потенциально опасные символы")
 
+    def _source_ticket_data(self, source_backlog_id: int, fields: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Title and field values for the chain from source ticket fields (defaults when not available)"""
+        fields = fields or {}
+        return {
+            "title": fields.get("System.Title", f"Элемент #{source_backlog_id}"),
+            "fields": {
+                "implementation_project": fields.get("ST.ImplementationProject", "Mars"),
+                "mvp": fields.get("ST.MVP", "Нет"),
+                # Используем правильные значения для цепочки изменений (Houston\Foxtrot)
+                "iteration_id": 2781,  # Houston\Foxtrot
+                "area_id": 2780,       # Houston\Foxtrot
+                "iteration_path": "Houston\\Foxtrot",
+                "area_path": "Houston\\Foxtrot",
+                # Для BI используем итерацию с Upstream
+                "bi_iteration_id": 4047,  # Houston\Foxtrot\F25-Upstream
+                "bi_iteration_path": "Houston\\Foxtrot\\F25-Upstream",
+                "priority": fields.get("Microsoft.VSTS.Common.Priority", 2),
+                "value_area": fields.get("Microsoft.VSTS.Common.ValueArea", "Бизнес")
+            }
+        }
+
     async def _get_source_ticket_data(self, source_backlog_id: int) -> Dict[str, Any]:
         """Get title and field values from source ticket"""
         try:
-            url = f"{self.tfs_service.base_url}/Houston/_apis/wit/workitems/{source_backlog_id}?api-version=4.1&$expand=all"
-            response = self.tfs_service.session.get(url)
-            
-            if response.status_code == 200:
-                ticket_data = response.json()
-                fields = ticket_data['fields']
-                
-                return {
-                    "title": fields.get("System.Title", f"Элемент #{source_backlog_id}"),
-                    "fields": {
-                        "implementation_project": fields.get("ST.ImplementationProject", "Mars"),
-                        "mvp": fields.get("ST.MVP", "Нет"),
-                        # Используем правильные значения для цепочки изменений (Houston\Foxtrot)
-                        "iteration_id": 2781,  # Houston\Foxtrot
-                        "area_id": 2780,       # Houston\Foxtrot
-                        "iteration_path": "Houston\\Foxtrot",
-                        "area_path": "Houston\\Foxtrot",
-                        # Для BI используем итерацию с Upstream
-                        "bi_iteration_id": 4047,  # Houston\Foxtrot\F25-Upstream
-                        "bi_iteration_path": "Houston\\Foxtrot\\F25-Upstream",
-                        "priority": fields.get("Microsoft.VSTS.Common.Priority", 2),
-                        "value_area": fields.get("Microsoft.VSTS.Common.ValueArea", "Бизнес")
-                    }
-                }
-            else:
-                logger.warning(f"Could not get source ticket data: {response.status_code}")
-                return {
-                    "title": f"Элемент #{source_backlog_id}",
-                    "fields": {
-                        "implementation_project": "Mars",
-                        "mvp": "Нет",
-                        "iteration_id": 2781,
-                        "area_id": 2780,
-                        "iteration_path": "Houston\\Foxtrot",
-                        "area_path": "Houston\\Foxtrot",
-                        "priority": 2,
-                        "value_area": "Бизнес"
-                    }
-                }
+            # Через общий кэш Work Items: повторные цепочки от одного тикета не делают лишний GET
+            ticket = await self.tfs_service.get_work_item(source_backlog_id)
+            if ticket and ticket.fields:
+                return self._source_ticket_data(source_backlog_id, ticket.fields)
+            logger.warning(f"Could not get source ticket data: {source_backlog_id}")
         except Exception as e:
             logger.warning(f"Error getting source ticket data: {e}")
-            return {
-                "title": f"Элемент #{source_backlog_id}",
-                "fields": {
-                    "implementation_project": "Mars",
-                    "mvp": "Нет",
-                    "iteration_id": 2781,
-                    "area_id": 2780,
-                    "iteration_path": "Houston\\Foxtrot",
-                    "area_path": "Houston\\Foxtrot",
-                    "priority": 2,
-                    "value_area": "Бизнес"
-                }
-            }
+        return self._source_ticket_data(source_backlog_id, None)
+
+    async def get_source_tickets_data(self, source_backlog_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Source ticket data for many tickets with one batch read; tickets not found in TFS are absent"""
+        return {
+            item.id: self._source_ticket_data(item.id, item.fields)
+            for item in await self.tfs_service.get_work_items_batch(source_backlog_ids)
+            if item.fields
+        }
 
     async def create_linked_change_chain(
         self, 
         project: str, 
         request_title: str, 
         source_backlog_id: int,
-        request_id: Optional[str] = None
+        request_id: Optional[str] = None,
+        source_data: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         Create linked change chain: Epic -> Feature -> Product Backlog Item
         Product Backlog Item is linked as child to source_backlog_id
+        source_data - already loaded source ticket data (bulk creation), otherwise it is fetched
         """
         
         try:
@@ -189,55 +175,52 @@ class ChangeChainService:
             )
             
             # Get source ticket fields and title
-            source_data = await self._get_source_ticket_data(source_backlog_id)
+            if source_data is None:
+                source_data = await self._get_source_ticket_data(source_backlog_id)
             source_title = source_data["title"]
             source_fields = source_data["fields"]
             logger.info(f"Source ticket title: {source_title}")
             logger.info(f"Source ticket fields: {source_fields}")
             
-            # 1. Create Epic with source title
-            epic_id = await self._create_work_item(
-                project=project,
-                work_item_type="Epic",
-                title=source_title,
-                description=f"Epic для {source_title}",
-                request_id=request_id,
-                source_fields=source_fields,
-                use_implementation_project=False
-            )
-            
-            # 2. Create Feature with source title
-            feature_id = await self._create_work_item(
-                project=project,
-                work_item_type="Feature",
-                title=source_title,
-                description=f"Feature для {source_title}",
-                request_id=request_id,
-                source_fields=source_fields,
-                use_implementation_project=False
-            )
+            chain = [
+                # (тип, заголовок, описание, use_implementation_project)
+                ("Epic", source_title, f"Epic для {source_title}", False),
+                ("Feature", source_title, f"Feature для {source_title}", False),
+                ("Backlog Item", f"HLD {source_title}", f"HLD для {source_title}", True),
+            ]
             
-            # 3. Create Backlog Item with HLD prefix and implementation project
-            backlog_item_id = await self._create_work_item(
-                project=project,
-                work_item_type="Backlog Item",
-                title=f"HLD {source_title}",
-                description=f"HLD для {source_title}",
-                request_id=request_id,
-                source_fields=source_fields,
-                use_implementation_project=True
-            )
+            # 1. Epic, Feature и Backlog Item вместе со связями - одним $batch-запросом
+            batch_ids = [None, None, None]
+            if settings.CHANGE_CHAIN_USE_BATCH:
+                batch_ids = await self._create_chain_batch(project, chain, source_backlog_id, request_id, source_fields)
             
-            # 4. Create links
-            # Epic -> Feature
-            await self._create_link(epic_id, feature_id, "System.LinkTypes.Hierarchy-Forward")
+            # 2. Элементы, которые $batch точно не создал (отклонен сервером), создаются последовательно
+            ids = list(batch_ids)
+            for index, (work_item_type, title, description, use_implementation_project) in enumerate(chain):
+                if not ids[index]:
+                    ids[index] = await self._create_work_item(
+                        project=project,
+                        work_item_type=work_item_type,
+                        title=title,
+                        description=description,
+                        request_id=request_id,
+                        source_fields=source_fields,
+                        use_implementation_project=use_implementation_project
+                    )
+            epic_id, feature_id, backlog_item_id = ids
             
-            # Feature -> BacklogItem
-            await self._create_link(feature_id, backlog_item_id, "System.LinkTypes.Hierarchy-Forward")
+            # 3. Связи для элементов, созданных вне $batch
+            if not batch_ids[1]:
+                # Epic -> Feature
+                await self._create_link(epic_id, feature_id, "System.LinkTypes.Hierarchy-Forward")
             
-            # BacklogItem -> Source (as child) - используем ST.Backlog.LinkTypes.Hierarchy-Reverse
-            # Исправлено: backlog_item_id должен ссылаться на source_backlog_id как на родителя
-            await self._create_link(backlog_item_id, source_backlog_id, "ST.Backlog.LinkTypes.Hierarchy-Reverse")
+            if not batch_ids[2]:
+                # Feature -> BacklogItem
+                await self._create_link(feature_id, backlog_item_id, "System.LinkTypes.Hierarchy-Forward")
+                
+                # BacklogItem -> Source (as child) - используем ST.Backlog.LinkTypes.Hierarchy-Reverse
+                # Исправлено: backlog_item_id должен ссылаться на source_backlog_id как на родителя
+                await self._create_link(backlog_item_id, source_backlog_id, "ST.Backlog.LinkTypes.Hierarchy-Reverse")
             
             # Формируем правильный URL для TFS (используем defaultcollection с маленькой буквы)
             base_tfs_url = self.tfs_service.base_url.replace('/_apis', '').replace('DefaultCollection', 'defaultcollection')
@@ -298,6 +281,96 @@ class ChangeChainService:
         url = f"{self.tfs_service.base_url}/{project}/_apis/wit/workitems/${work_item_type}"
         params = {"api-version": "4.1"}
         
+        patch_document, values = self._build_work_item_patch(
+            work_item_type, title, description, request_id, source_fields, use_implementation_project
+        )
+        area_path = values["area_path"]
+        iteration_path = values["iteration_path"]
+        priority = values["priority"]
+        value_area = values["value_area"]
+        implementation_project = values["implementation_project"]
+        mvp = values["mvp"]
+        
+        try:
+            response = await self.tfs_service.send_json_patch("POST", url, patch_document, params=params)
+            response.raise_for_status()
+            
+            result = response.json()
+            work_item_id = result["id"]
+            
+            logger.info(f"✅ Created {work_item_type} with ID: {work_item_id}")
+            logger.info(f"   📄 Title: {title}")
+            logger.info(f"   🏷️ Project: {project}")
+            logger.info(f"   📍 Area Path: {area_path}")
+            logger.info(f"   🔄 Iteration Path: {iteration_path}")
+            logger.info(f"   ⭐ Priority: {priority}")
+            logger.info(f"   💼 Value Area: {value_area}")
+            if work_item_type == "Backlog Item" and use_implementation_project:
+                logger.info(f"   🏢 Implementation Project: {implementation_project}")
+            if work_item_type in ["Feature", "Backlog Item"]:
+                logger.info(f"   🎯 MVP: {mvp}")
+            return work_item_id
+            
+        except Exception as e:
+            logger.error(f"Error creating {work_item_type}: {str(e)}")
+            raise Exception(f"Ошибка при создании {work_item_type}: {str(e)}")
+
+    async def create_change_chains_bulk(
+        self,
+        project: str,
+        source_backlog_ids: List[int],
+        request_id: Optional[str] = None,
+        concurrency: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Create change chains for many source tickets.
+        
+        All source tickets are read with one batch request, chains are created with bounded
+        concurrency and per-chain results are yielded as soon as each chain completes.
+        No chain is created for a source ticket that is not found (or cannot be read) in TFS.
+        """
+        source_backlog_ids = list(dict.fromkeys(int(sid) for sid in source_backlog_ids))
+        try:
+            sources = await self.get_source_tickets_data(source_backlog_ids)
+        except Exception as e:
+            logger.error(f"Error getting source tickets data: {e}")
+            for source_backlog_id in source_backlog_ids:
+                yield {"sourceBacklogId": source_backlog_id, "success": False,
+                       "error": f"Не удалось получить исходный тикет: {e}"}
+            return
+        semaphore = asyncio.Semaphore(max(1, concurrency or settings.CHANGE_CHAIN_BULK_CONCURRENCY))
+        
+        async def _create(source_backlog_id: int) -> Dict[str, Any]:
+            if source_backlog_id not in sources:
+                return {"sourceBacklogId": source_backlog_id, "success": False,
+                        "error": f"Исходный тикет #{source_backlog_id} не найден"}
+            async with semaphore:
+                try:
+                    chain = await self.create_linked_change_chain(
+                        project=project,
+                        request_title=f"Цепочка изменений для элемента #{source_backlog_id}",
+                        source_backlog_id=source_backlog_id,
+                        request_id=request_id,
+                        source_data=sources[source_backlog_id]
+                    )
+                    return {"sourceBacklogId": source_backlog_id, "success": True, "data": chain}
+                except Exception as e:
+                    return {"sourceBacklogId": source_backlog_id, "success": False, "error": str(e)}
+        
+        for completed in asyncio.as_completed([_create(sid) for sid in source_backlog_ids]):
+            yield await completed
+
+    def _build_work_item_patch(
+        self,
+        work_item_type: str,
+        title: str,
+        description: str,
+        request_id: Optional[str] = None,
+        source_fields: Optional[Dict[str, Any]] = None,
+        use_implementation_project: bool = False
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """JSON Patch document for a new chain work item and the field values used in it"""
+        
         # Use source fields if provided, otherwise use defaults
         if source_fields:
             # Для Backlog Item используем специальные значения с Upstream
@@ -366,34 +439,92 @@ class ChangeChainService:
             "value": history_comment
         })
         
+        values = {
+            "area_path": area_path,
+            "iteration_path": iteration_path,
+            "priority": priority,
+            "value_area": value_area,
+            "implementation_project": implementation_project,
+            "mvp": mvp
+        }
+        return patch_document, values
+
+    def _relation_op(self, link_type: str, target_id: int) -> Dict[str, Any]:
+        """JSON Patch operation adding a link (target_id may be a temporary negative ID inside $batch)"""
+        return {
+            "op": "add",
+            "path": "/relations/-",
+            "value": {
+                "rel": link_type,
+                "url": f"{self.tfs_service.base_url}/_apis/wit/workitems/{target_id}",
+                "attributes": {
+                    "comment": f"Связано автоматически через Change Chain Service"
+                }
+            }
+        }
+
+    async def _create_chain_batch(
+        self,
+        project: str,
+        chain: List[Tuple[str, str, str, bool]],
+        source_backlog_id: int,
+        request_id: Optional[str] = None,
+        source_fields: Optional[Dict[str, Any]] = None
+    ) -> List[Optional[int]]:
+        """
+        Create Epic, Feature and Backlog Item with their hierarchy links in one $batch call.
+        
+        New items reference each other by temporary negative IDs (-1, -2, -3). Each child carries
+        the reverse hierarchy link to its parent, which is the same link as the forward one created
+        on the parent in the sequential path. Returns IDs in chain order; None for items that were
+        not created (all None if the server rejects $batch). If the outcome is unknown (timeout or
+        server error after the request was sent) the chain fails: the items may already exist, and
+        creating them again one by one would duplicate the chain.
+        """
+        links = [
+            [],
+            [("System.LinkTypes.Hierarchy-Reverse", -1)],
+            [("System.LinkTypes.Hierarchy-Reverse", -2),
+             ("ST.Backlog.LinkTypes.Hierarchy-Reverse", source_backlog_id)],
+        ]
+        
+        requests = []
+        for index, (work_item_type, title, description, use_implementation_project) in enumerate(chain):
+            patch_document, _ = self._build_work_item_patch(
+                work_item_type, title, description, request_id, source_fields, use_implementation_project
+            )
+            patch_document.insert(0, {"op": "add", "path": "/id", "value": -(index + 1)})
+            patch_document.extend(self._relation_op(link_type, target_id) for link_type, target_id in links[index])
+            url = f"{self.tfs_service.base_url}/{project}/_apis/wit/workitems/${work_item_type}"
+            requests.append(self.tfs_service.batch_patch_request("PATCH", url, patch_document))
+        
         try:
-            response = self.tfs_service.session.post(
-                url,
-                params=params,
-                headers={'Content-Type': 'application/json-patch+json'},
-                data=json.dumps(patch_document, ensure_ascii=False).encode('utf-8')
+            results = await self.tfs_service.execute_batch(requests)
+        except TFSBatchOutcomeUnknownError as e:
+            work_item_cache.invalidate(source_backlog_id)
+            raise Exception(
+                f"результат $batch неизвестен ({e}), элементы цепочки могли быть созданы - "
+                f"проверьте дочерние элементы #{source_backlog_id} перед повторным запуском"
             )
-            response.raise_for_status()
-            
-            result = response.json()
-            work_item_id = result["id"]
-            
-            logger.info(f"✅ Created {work_item_type} with ID: {work_item_id}")
-            logger.info(f"   📄 Title: {title}")
-            logger.info(f"   🏷️ Project: {project}")
-            logger.info(f"   📍 Area Path: {area_path}")
-            logger.info(f"   🔄 Iteration Path: {iteration_path}")
-            logger.info(f"   ⭐ Priority: {priority}")
-            logger.info(f"   💼 Value Area: {value_area}")
-            if work_item_type == "Backlog Item" and use_implementation_project:
-                logger.info(f"   🏢 Implementation Project: {implementation_project}")
-            if work_item_type in ["Feature", "Backlog Item"]:
-                logger.info(f"   🎯 MVP: {mvp}")
-            return work_item_id
-            
-        except Exception as e:
-            logger.error(f"Error creating {work_item_type}: {str(e)}")
-            raise Exception(f"Ошибка при создании {work_item_type}: {str(e)}")
+        if results is None:
+            logger.warning("$batch is not available, falling back to sequential creation")
+            return [None] * len(chain)
+        
+        ids: List[Optional[int]] = []
+        for (work_item_type, title, _, _), result in zip(chain, results):
+            body = result.get("body")
+            if result.get("code") == 200 and isinstance(body, dict) and body.get("id"):
+                ids.append(body["id"])
+                logger.info(f"✅ Created {work_item_type} with ID: {body['id']} ($batch)")
+                logger.info(f"   📄 Title: {title}")
+            else:
+                ids.append(None)
+                logger.warning(f"⚠️ $batch did not create {work_item_type} ({result.get('code')}): {str(body)[:200]}")
+        ids.extend([None] * (len(chain) - len(ids)))
+        
+        if ids[2]:
+            work_item_cache.invalidate(source_backlog_id)
+        return ids
 
     async def _create_link(self, source_id: int, target_id: int, link_type: str):
         """Create a link between work items"""
@@ -401,28 +532,13 @@ class ChangeChainService:
         url = f"{self.tfs_service.base_url}/_apis/wit/workitems/{source_id}"
         params = {"api-version": "4.1"}
         
-        patch_document = [
-            {
-                "op": "add",
-                "path": "/relations/-",
-                "value": {
-                    "rel": link_type,
-                    "url": f"{self.tfs_service.base_url}/_apis/wit/workitems/{target_id}",
-                    "attributes": {
-                        "comment": f"Связано автоматически через Change Chain Service"
-                    }
-                }
-            }
-        ]
+        patch_document = [self._relation_op(link_type, target_id)]
         
         try:
-            response = self.tfs_service.session.patch(
-                url,
-                params=params,
-                headers={'Content-Type': 'application/json-patch+json'},
-                data=json.dumps(patch_document, ensure_ascii=False).encode('utf-8')
-            )
+            response = await self.tfs_service.send_json_patch("PATCH", url, patch_document, params=params)
             response.raise_for_status()
+            work_item_cache.invalidate(source_id)
+            work_item_cache.invalidate(target_id)
             
             logger.info(f"✅ Link created: {source_id} -> {target_id} ({link_type})")
             logger.info(f"   🔗 Source ID: {source_id}")
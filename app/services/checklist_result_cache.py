@@ -0,0 +1,119 @@
+"""
+Кэш готовых чек-листов БДК ЗЗЛ по отпечатку ревизий обойденных Work Items
+"""
+
+import threading
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedChecklist:
+    """Чек-лист и ревизии (ID -> System.Rev) элементов, по которым он построен"""
+    work_item_id: int
+    revisions: Dict[int, int]
+    checklist: str
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+
+class ChecklistResultCache:
+    """
+    Кэш чек-листов.
+
+    Ключ - ID основного элемента, запись хранит набор (ID, ревизия) всех элементов обхода.
+    Перед использованием запись проверяется одним облегченным запросом ревизий: чек-лист
+    строится заново, только если изменился, появился или пропал хотя бы один элемент.
+    Результаты текстового поиска от ревизий не зависят, поэтому запись дополнительно
+    ограничена max_age. Память ограничена LRU-вытеснением.
+    """
+
+    def __init__(self, max_size: int = 200, max_age: float = 3600.0, enabled: bool = True):
+        self._entries: "OrderedDict[int, CachedChecklist]" = OrderedDict()
+        self._max_size = max_size
+        self._max_age = max_age
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._evictions = 0
+
+    def get(self, work_item_id: int) -> Optional[CachedChecklist]:
+        """Запись чек-листа (ревизии должен проверить вызывающий код); устаревшие по max_age удаляются"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(int(work_item_id))
+            if entry is None:
+                return None
+            if self._max_age and entry.age > self._max_age:
+                del self._entries[int(work_item_id)]
+                return None
+            self._entries.move_to_end(int(work_item_id))
+            return entry
+
+    def record(self, hit: bool, stale: bool = False):
+        """Учет результата: hit - ревизии совпали; stale - запись была, но ревизии изменились"""
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+                if stale:
+                    self._stale += 1
+
+    def put(self, work_item_id: int, revisions: Dict[int, int], checklist: str) -> Optional[CachedChecklist]:
+        """Сохранение чек-листа; без ревизий (неполный обход) запись не создается"""
+        if not self.enabled or not revisions or any(rev is None for rev in revisions.values()):
+            return None
+        entry = CachedChecklist(int(work_item_id), dict(revisions), checklist)
+        with self._lock:
+            self._entries[entry.work_item_id] = entry
+            self._entries.move_to_end(entry.work_item_id)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return entry
+
+    def invalidate(self, work_item_id: int):
+        with self._lock:
+            self._entries.pop(int(work_item_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для /api/v1/status"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "max_age": self._max_age,
+                "hits": self._hits,
+                "misses": self._misses,
+                "stale": self._stale,
+                "evictions": self._evictions,
+                "hit_rate": round(self._hits / total, 3) if total else 0.0,
+            }
+
+
+# Глобальный экземпляр кэша чек-листов
+checklist_result_cache = ChecklistResultCache(
+    max_size=settings.CHECKLIST_CACHE_MAX_SIZE,
+    max_age=settings.CHECKLIST_CACHE_MAX_AGE,
+    enabled=settings.CHECKLIST_CACHE_ENABLED,
+)
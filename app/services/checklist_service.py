@@ -2,8 +2,17 @@ import logging
 import re
 import json
 import asyncio
-from typing import Dict, Any, List, Set
+from typing import Dict, Any, AsyncIterator, List, Optional, Set, Tuple
 from app.services.tfs_service import TFSService
+from app.services.work_item_traversal import WorkItemTraversal, extract_related_ids
+from app.services.wiql_service import wiql_service, escape_wiql, wiql_list
+from app.services.pull_request_index import pull_request_index
+from app.services.test_plan_index import test_plan_index
+from app.services.work_item_text_index import WorkItemTextIndex
+from app.services.work_item_mirror import work_item_mirror, html_to_text
+from app.services.link_graph import link_graph
+from app.services.checklist_result_cache import checklist_result_cache
+from app.services.singleflight import checklist_flight
 from app.models.link_types import (
     LinkType, LinkDirection, BUG_SEARCH_LINK_TYPES, 
     get_wiql_condition_for_link_types, get_all_search_fields_for_types
@@ -13,12 +22,22 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Типы тестовых элементов и багов (русские и английские процессы TFS)
+TEST_WORK_ITEM_TYPES = ['Тестовый случай', 'План тестирования', 'Набор тестов', 'Test Case', 'Test Plan', 'Test Suite']
+BUG_WORK_ITEM_TYPES = ['Ошибка', 'Bug']
+
+# Пакетные чек-листы: размер частей WIQL-запросов (длина запроса ограничена)
+BULK_TERMS_PER_QUERY = 100
+BULK_IDS_PER_QUERY = 1000
+
 class ChecklistService:
     """Service for creating БДК ЗЗЛ checklists from work items"""
 
     def __init__(self):
         self.tfs_service = TFSService()
         self._log_lock = asyncio.Lock()
+        self._text_index: Optional[WorkItemTextIndex] = None
+        self._text_index_fingerprint: Optional[int] = None
 
     async def _log_debug(self, text: str):
         try:
@@ -37,6 +56,45 @@ class ChecklistService:
         Create БДК ЗЗЛ checklist for work item and its children
         Format: Создай чек-лист БДК ЗЗЛ #<id>
         """
+        result = await self.get_checklist(work_item_id)
+        return result["checklist"]
+
+    async def get_checklist(self, work_item_id: int) -> Dict[str, Any]:
+        """
+        Чек-лист с учетом кэша: {"checklist", "cache_hit", "cache_age"}.
+        Кэшированный чек-лист отдается, если ревизии всех элементов обхода не изменились
+        (проверка одним пакетным запросом System.Rev), иначе строится заново.
+        Одновременные запросы для одного элемента ждут одно построение.
+        """
+        return await checklist_flight.do(int(work_item_id), lambda: self._get_checklist(int(work_item_id)))
+
+    async def _get_checklist(self, work_item_id: int) -> Dict[str, Any]:
+        cached = checklist_result_cache.get(work_item_id)
+        if cached is not None:
+            try:
+                revisions = await self.tfs_service._fetch_work_item_revisions(list(cached.revisions))
+                current = {wid: rev for wid, (rev, _) in revisions.items()}
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось проверить ревизии для кэша чек-листа {work_item_id}: {e}")
+                current = None
+            if current == cached.revisions:
+                checklist_result_cache.record(hit=True)
+                logger.info(f"⚡ Чек-лист для {work_item_id} взят из кэша (возраст {cached.age:.0f} сек)")
+                return {"checklist": cached.checklist, "cache_hit": True, "cache_age": round(cached.age, 1)}
+            checklist_result_cache.record(hit=False, stale=True)
+            await self._log_debug(f"[CACHE] Ревизии элементов для {work_item_id} изменились, чек-лист строится заново\n")
+        else:
+            checklist_result_cache.record(hit=False)
+
+        checklist, revisions = await self._build_checklist(work_item_id)
+        if revisions:
+            checklist_result_cache.put(work_item_id, revisions, checklist)
+        else:
+            checklist_result_cache.invalidate(work_item_id)
+        return {"checklist": checklist, "cache_hit": False, "cache_age": 0.0}
+
+    async def _build_checklist(self, work_item_id: int) -> Tuple[str, Dict[int, Optional[int]]]:
+        """Построение чек-листа: текст и ревизии элементов обхода (пустые - результат не кэшируется)"""
         try:
             logger.info(f"Creating checklist for work item ID: {work_item_id}")
             await self._log_debug(f"\n=== CREATE CHECKLIST for {work_item_id} at {datetime.now().isoformat()} ===\n")
@@ -89,11 +147,11 @@ class ChecklistService:
             checklist = self._format_checklist(test_plan_urls, integration_test_urls, bug_urls)
             logger.info(f"✅ Checklist created successfully for work item {work_item_id}")
             await self._log_debug(f"Checklist result:\n{checklist}\n")
-            return checklist
+            return checklist, {wi["id"]: wi.get("rev") for wi in all_items}
         except Exception as e:
             logger.error(f"Error creating checklist for work item {work_item_id}: {e}")
             await self._log_debug(f"Error creating checklist for work item {work_item_id}: {e}\n")
-            return f"Ошибка при создании чек-листа: {e}"
+            return f"Ошибка при создании чек-листа: {e}", {}
 
     async def _get_work_items_recursive(self, work_item_id: int) -> List[Dict[str, Any]]:
         """Recursively get work item and all its children"""
@@ -114,80 +172,45 @@ class ChecklistService:
             raise Exception(f"Ошибка при получении рабочих элементов: {e}")
 
     async def _get_children_recursive(self, parent_id: int) -> List[Dict[str, Any]]:
-        """Get all children of a work item recursively"""
+        """Get all children of a work item (level-by-level traversal of hierarchy links)"""
         try:
-            children: List[Dict[str, Any]] = []
-
-            # Try different API versions for WIQL
-            api_versions = ["4.1", "5.0", "5.1", "6.0"]
-            
-            for api_version in api_versions:
-                try:
-                    url = f"{self.tfs_service.base_url}/_apis/wit/wiql"
-                    params = {"api-version": api_version}
-                    
-                    # Try different WIQL query formats for older TFS
-                    wiql_queries = [
-                        f"SELECT [System.Id] FROM WorkItems WHERE [System.Parent] = {parent_id}",
-                        f"SELECT [System.Id] FROM WorkItems WHERE [System.Parent] = {parent_id} ORDER BY [System.Id]",
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.Parent] = {parent_id}"
-                    ]
-                    
-                    for wiql_query in wiql_queries:
-                        try:
-                            # adjust Content-Type for WIQL endpoint
-                            orig_ct = self.tfs_service.session.headers.get("Content-Type")
-                            self.tfs_service.session.headers["Content-Type"] = "application/json"
-                            response = self.tfs_service.session.post(url, params=params, json={"query": wiql_query})
-                            self.tfs_service.session.headers["Content-Type"] = orig_ct
-
-                            if response.status_code == 200:
-                                result = response.json()
-                                if not isinstance(result, dict):
-                                    continue
-                                    
-                                for item in result.get("workItems", []):
-                                    child_id = item["id"]
-                                    child_item = await self.tfs_service.get_work_item(child_id)
-                                    children.append({
-                                        "id": child_item.id,
-                                        "title": child_item.title,
-                                        "work_item_type": child_item.work_item_type,
-                                    })
-                                    children.extend(await self._get_children_recursive(child_id))
-                                
-                                logger.info(f"Successfully got children using WIQL API version {api_version}")
-                                return children
-                                
-                        except Exception as query_error:
-                            logger.debug(f"WIQL query failed with version {api_version}: {query_error}")
-                            continue
-                            
-                except Exception as version_error:
-                    logger.debug(f"API version {api_version} failed: {version_error}")
-                    continue
+            # Все дерево потомков одним запросом WorkItemLinks ... MODE (Recursive)
+            links = await wiql_service.query_links(
+                [parent_id], ["System.LinkTypes.Hierarchy-Forward"], recursive=True
+            )
+            if links is not None:
+                child_ids = [target for source, target, _ in links if source is not None]
+                return [
+                    {
+                        "id": child.id,
+                        "title": child.title,
+                        "work_item_type": child.work_item_type,
+                    }
+                    for child in await self.tfs_service.get_work_items_batch(child_ids)
+                ]
             
-            # Fallback: try to get children through work item relations
-            try:
-                parent_item = await self.tfs_service.get_work_item(parent_id)
-                if hasattr(parent_item, 'relations') and parent_item.relations:
-                    for relation in parent_item.relations:
-                        if relation.get('rel') == 'System.LinkTypes.Hierarchy-Forward':
-                            child_url = relation.get('url', '')
-                            if child_url:
-                                # Extract child ID from URL
-                                child_id = int(child_url.split('/')[-1])
-                                child_item = await self.tfs_service.get_work_item(child_id)
-                                children.append({
-                                    "id": child_item.id,
-                                    "title": child_item.title,
-                                    "work_item_type": child_item.work_item_type,
-                                })
-                                children.extend(await self._get_children_recursive(child_id))
-            except Exception as fallback_error:
-                logger.debug(f"Fallback method failed: {fallback_error}")
-
-            return children
+            # Сервер не поддерживает рекурсивный запрос - обход по уровням через связи
+            traversal = WorkItemTraversal(
+                self.tfs_service,
+                max_depth=settings.CHECKLIST_TRAVERSAL_CHILDREN_MAX_DEPTH
+            )
+            result = await traversal.traverse(
+                [parent_id],
+                link_types={"System.LinkTypes.Hierarchy-Forward"},
+                include_roots=False
+            )
+            if result.timed_out or result.truncated:
+                logger.warning(f"Children traversal for {parent_id} stopped early "
+                               f"(timed_out={result.timed_out}, truncated={result.truncated})")
+            
+            return [
+                {
+                    "id": node.item.id,
+                    "title": node.item.title,
+                    "work_item_type": node.item.work_item_type,
+                }
+                for node in result.nodes
+            ]
 
         except Exception as e:
             logger.error(f"Error getting children for work item {parent_id}: {e}")
@@ -218,35 +241,14 @@ class ChecklistService:
         return urls
 
     async def _query_test_management_api(self, work_item_id: int) -> Set[str]:
-        """Query Test Management API for test plans"""
+        """Test plans, suites and test cases linked to the work item (local test plan index)"""
         urls: Set[str] = set()
         
-        # Try different API versions for Test Management
-        api_versions = ["4.1", "5.0", "5.1", "6.0"]
-        
-        for api_version in api_versions:
-            try:
-                url = f"{self.tfs_service.base_url}/_apis/test/plans"
-                params = {"api-version": api_version, "includePlanDetails": "true"}
-                resp = self.tfs_service.session.get(url, params=params)
-                
-                if resp.status_code == 200:
-                    data = resp.json()
-                    for plan in data.get("value", []):
-                        if any(str(work_item_id) in str(v) for v in plan.get("properties", {}).values()):
-                            urls.add(f"{settings.TFS_URL}/_testPlans/execute?planId={plan['id']}")
-                    logger.info(f"Successfully queried test management API with version {api_version}")
-                    break
-                elif resp.status_code == 404:
-                    logger.debug(f"Test Management API not available with version {api_version}")
-                    continue
-                else:
-                    logger.debug(f"Test Management API error {resp.status_code} with version {api_version}")
-                    continue
-                    
-            except Exception as e:
-                logger.debug(f"Test Management API version {api_version} failed: {e}")
-                continue
+        # Тест-планы, наборы и тестовые случаи из локального индекса (обновляется в фоне)
+        try:
+            urls.update(await test_plan_index.find_test_urls([work_item_id]))
+        except Exception as e:
+            logger.debug(f"Test plan index lookup failed: {e}")
         
         # If Test Management API is not available, try alternative approach
         if not urls:
@@ -269,48 +271,30 @@ class ChecklistService:
         """Search for test cases and test plans that reference this work item or related user stories"""
         urls: Set[str] = set()
         try:
-            api_versions = ["4.1", "5.0", "5.1", "6.0"]
             search_terms = [str(work_item_id)] + list(user_story_titles)
-            for api_version in api_versions:
-                try:
-                    url = f"{self.tfs_service.base_url}/_apis/wit/wiql"
-                    params = {"api-version": api_version}
-                    wiql_queries = []
-                    for term in search_terms:
-                        wiql_queries.extend([
-                            f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Тестовый случай' AND ([System.Description] CONTAINS '{term}' OR [System.Title] CONTAINS '{term}')",
-                            f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'План тестирования' AND ([System.Description] CONTAINS '{term}' OR [System.Title] CONTAINS '{term}')",
-                            f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Набор тестов' AND ([System.Description] CONTAINS '{term}' OR [System.Title] CONTAINS '{term}')",
-                            f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Test Case' AND ([System.Description] CONTAINS '{term}' OR [System.Title] CONTAINS '{term}')",
-                            f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Test Plan' AND ([System.Description] CONTAINS '{term}' OR [System.Title] CONTAINS '{term}')",
-                            f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Test Suite' AND ([System.Description] CONTAINS '{term}' OR [System.Title] CONTAINS '{term}')"
-                        ])
-                    for wiql in wiql_queries:
-                        logger.info(f"WIQL: {wiql}")
-                        await self._log_debug(f"WIQL: {wiql}\n")
-                        try:
-                            orig_ct = self.tfs_service.session.headers.get("Content-Type")
-                            self.tfs_service.session.headers["Content-Type"] = "application/json"
-                            resp = self.tfs_service.session.post(url, params=params, json={"query": wiql})
-                            self.tfs_service.session.headers["Content-Type"] = orig_ct
-                            if resp.status_code == 200:
-                                data = resp.json()
-                                for item in data.get("workItems", []):
-                                    logger.info(f"Found test item: {item}")
-                                    await self._log_debug(f"Found test item: {item}\n")
-                                    urls.add(f"{settings.TFS_URL}/_workitems/edit/{item['id']}")
-                                if urls:
-                                    logger.info(f"Found {len(urls)} test items referencing work item {work_item_id} or related user stories")
-                                    await self._log_debug(f"Found {len(urls)} test items referencing work item {work_item_id} or related user stories\n")
-                                    return urls
-                        except Exception as query_error:
-                            logger.debug(f"Test item search query failed: {query_error}")
-                            await self._log_debug(f"Test item search query failed: {query_error}\n")
-                            continue
-                except Exception as version_error:
-                    logger.debug(f"Test item search API version {api_version} failed: {version_error}")
-                    await self._log_debug(f"Test item search API version {api_version} failed: {version_error}\n")
-                    continue
+            if work_item_mirror.is_ready():
+                for item_id in sorted(work_item_mirror.search(search_terms, TEST_WORK_ITEM_TYPES)):
+                    urls.add(f"{settings.TFS_URL}/_workitems/edit/{item_id}")
+                await self._log_debug(f"Found {len(urls)} test items in local work item mirror\n")
+                return urls
+            
+            terms_condition = " OR ".join(
+                f"[System.Description] CONTAINS '{escape_wiql(term)}' OR [System.Title] CONTAINS '{escape_wiql(term)}'"
+                for term in search_terms
+            )
+            wiql = (
+                f"SELECT [System.Id], [System.Title] FROM WorkItems "
+                f"WHERE [System.WorkItemType] IN ({wiql_list(TEST_WORK_ITEM_TYPES)}) AND ({terms_condition})"
+            )
+            logger.info(f"WIQL: {wiql}")
+            await self._log_debug(f"WIQL: {wiql}\n")
+            
+            for item_id in await wiql_service.query_ids(wiql) or []:
+                await self._log_debug(f"Found test item: {item_id}\n")
+                urls.add(f"{settings.TFS_URL}/_workitems/edit/{item_id}")
+            if urls:
+                logger.info(f"Found {len(urls)} test items referencing work item {work_item_id} or related user stories")
+                await self._log_debug(f"Found {len(urls)} test items referencing work item {work_item_id} or related user stories\n")
         except Exception as e:
             logger.debug(f"Test item search failed: {e}")
             await self._log_debug(f"Test item search failed: {e}\n")
@@ -340,43 +324,17 @@ class ChecklistService:
         """Search for integration test work items that reference this work item"""
         urls: Set[str] = set()
         try:
-            api_versions = ["4.1", "5.0", "5.1", "6.0"]
+            # CONTAINS в WIQL регистронезависим, поэтому достаточно одного запроса
+            wiql = (
+                f"SELECT [System.Id], [System.Title] FROM WorkItems "
+                f"WHERE ([System.Title] CONTAINS 'Integration' OR [System.Description] CONTAINS 'Integration') "
+                f"AND ([System.Description] CONTAINS '{work_item_id}' OR [System.Title] CONTAINS '{work_item_id}')"
+            )
+            for item_id in await wiql_service.query_ids(wiql) or []:
+                urls.add(f"{settings.TFS_URL}/_workitems/edit/{item_id}")
             
-            for api_version in api_versions:
-                try:
-                    url = f"{self.tfs_service.base_url}/_apis/wit/wiql"
-                    params = {"api-version": api_version}
-                    
-                    # Search for work items with integration test keywords
-                    wiql_queries = [
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE ([System.Title] CONTAINS 'Integration' OR [System.Description] CONTAINS 'Integration') AND ([System.Description] CONTAINS '{work_item_id}' OR [System.Title] CONTAINS '{work_item_id}')",
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE ([System.Title] CONTAINS 'integration' OR [System.Description] CONTAINS 'integration') AND ([System.Description] CONTAINS '{work_item_id}' OR [System.Title] CONTAINS '{work_item_id}')",
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE ([System.WorkItemType] = 'Test Case' OR [System.WorkItemType] = 'Task') AND ([System.Title] CONTAINS 'Integration' OR [System.Description] CONTAINS 'Integration') AND ([System.Description] CONTAINS '{work_item_id}' OR [System.Title] CONTAINS '{work_item_id}')"
-                    ]
-                    
-                    for wiql in wiql_queries:
-                        try:
-                            orig_ct = self.tfs_service.session.headers.get("Content-Type")
-                            self.tfs_service.session.headers["Content-Type"] = "application/json"
-                            resp = self.tfs_service.session.post(url, params=params, json={"query": wiql})
-                            self.tfs_service.session.headers["Content-Type"] = orig_ct
-                            
-                            if resp.status_code == 200:
-                                data = resp.json()
-                                for item in data.get("workItems", []):
-                                    urls.add(f"{settings.TFS_URL}/_workitems/edit/{item['id']}")
-                                
-                                if urls:
-                                    logger.info(f"Found {len(urls)} integration test work items referencing work item {work_item_id}")
-                                    return urls
-                                    
-                        except Exception as query_error:
-                            logger.debug(f"Integration test search query failed: {query_error}")
-                            continue
-                            
-                except Exception as version_error:
-                    logger.debug(f"Integration test search API version {api_version} failed: {version_error}")
-                    continue
+            if urls:
+                logger.info(f"Found {len(urls)} integration test work items referencing work item {work_item_id}")
                     
         except Exception as e:
             logger.debug(f"Integration test work item search failed: {e}")
@@ -389,7 +347,7 @@ class ChecklistService:
         try:
             url = f"{self.tfs_service.base_url}/_apis/git/pullrequests"
             params = {"api-version": "4.1", "searchCriteria.includeLinks": "true"}
-            resp = self.tfs_service.session.get(url, params=params)
+            resp = await self.tfs_service.get(url, params=params)
             resp.raise_for_status()
             data = resp.json()
             for pr in data.get("value", []):
@@ -433,7 +391,7 @@ class ChecklistService:
         try:
             url = f"{self.tfs_service.base_url}/_apis/git/pullrequests/{pr_id}/files"
             params = {"api-version": "4.1"}
-            resp = self.tfs_service.session.get(url, params=params)
+            resp = await self.tfs_service.get(url, params=params)
             resp.raise_for_status()
             data = resp.json()
             for fi in data.get("value", []):
@@ -460,6 +418,11 @@ class ChecklistService:
             logger.info(f"Optimized test plan search for {len(search_terms)} terms")
             await self._log_debug(f"Optimized test plan search for {len(search_terms)} terms: {search_terms}\n")
             
+            # Наборы на основе требований и тестовые случаи со связью "Tests" - из локального индекса
+            index_urls = await test_plan_index.find_test_urls(work_item_ids)
+            urls.update(index_urls)
+            await self._log_debug(f"Test plan index: {len(index_urls)} URLs\n")
+            
             # Выполняем поиск один раз для всех терминов
             urls.update(await self._search_test_items_by_reference_optimized(search_terms))
             
@@ -514,48 +477,38 @@ class ChecklistService:
     async def _get_linked_bugs(self, work_item_id: int, user_story_ids: set, user_story_titles: set) -> Set[str]:
         bug_urls: Set[str] = set()
         try:
-            api_versions = ["4.1", "5.0", "5.1", "6.0"]
-            search_terms = [str(work_item_id)] + list(user_story_ids) + list(user_story_titles)
-            for api_version in api_versions:
-                try:
-                    url = f"{self.tfs_service.base_url}/_apis/wit/wiql"
-                    params = {"api-version": api_version}
-                    wiql_queries = []
-                    for term in search_terms:
-                        wiql_queries.extend([
-                            f"SELECT [System.Id] FROM WorkItems WHERE [System.WorkItemType] = 'Ошибка' AND [System.Links.LinkType] = 'Related' AND [System.Links.TargetWorkItemId] = '{term}'",
-                            f"SELECT [System.Id] FROM WorkItems WHERE [System.WorkItemType] = 'Ошибка' AND [System.Links.TargetWorkItemId] = '{term}'",
-                            f"SELECT [System.Id] FROM WorkItems WHERE [System.WorkItemType] = 'Ошибка' AND [System.Links.LinkType] = 'System.LinkTypes.Related' AND [System.Links.TargetWorkItemId] = '{term}'",
-                            f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Ошибка' AND [System.Links.TargetWorkItemId] = '{term}'",
-                            f"SELECT [System.Id] FROM WorkItems WHERE [System.WorkItemType] = 'Ошибка' AND ([System.Links.TargetWorkItemId] = '{term}' OR [System.Links.SourceWorkItemId] = '{term}')",
-                            f"SELECT [System.Id] FROM WorkItems WHERE [System.WorkItemType] = 'Ошибка' AND ([System.Description] CONTAINS '{term}' OR [System.Title] CONTAINS '{term}')"
-                        ])
-                    for wiql in wiql_queries:
-                        logger.info(f"BUG WIQL: {wiql}")
-                        await self._log_debug(f"BUG WIQL: {wiql}\n")
-                        try:
-                            orig_ct = self.tfs_service.session.headers.get("Content-Type")
-                            self.tfs_service.session.headers["Content-Type"] = "application/json"
-                            resp = self.tfs_service.session.post(url, params=params, json={"query": wiql})
-                            self.tfs_service.session.headers["Content-Type"] = orig_ct
-                            if resp.status_code == 200:
-                                data = resp.json()
-                                for itm in data.get("workItems", []):
-                                    logger.info(f"Found bug: {itm}")
-                                    await self._log_debug(f"Found bug: {itm}\n")
-                                    bug_urls.add(f"{settings.TFS_URL}/_workitems/edit/{itm['id']}")
-                                if bug_urls:
-                                    logger.info(f"Found {len(bug_urls)} bugs referencing work item {work_item_id} or related user stories")
-                                    await self._log_debug(f"Found {len(bug_urls)} bugs referencing work item {work_item_id} or related user stories\n")
-                                    return bug_urls
-                        except Exception as query_error:
-                            logger.debug(f"Bug search query failed: {query_error}")
-                            await self._log_debug(f"Bug search query failed: {query_error}\n")
-                            continue
-                except Exception as version_error:
-                    logger.debug(f"Bug search API version {api_version} failed: {version_error}")
-                    await self._log_debug(f"Bug search API version {api_version} failed: {version_error}\n")
-                    continue
+            id_terms = {int(work_item_id)} | {int(sid) for sid in user_story_ids if str(sid).isdigit()}
+            
+            # 1. Баги, связанные с элементами, - один запрос по WorkItemLinks
+            links = await wiql_service.query_links(
+                id_terms,
+                target_condition=f"[Target].[System.WorkItemType] IN ({wiql_list(BUG_WORK_ITEM_TYPES)})"
+            )
+            for source, target, _ in links or []:
+                if source is not None:
+                    await self._log_debug(f"Found bug: {target}\n")
+                    bug_urls.add(f"{settings.TFS_URL}/_workitems/edit/{target}")
+            
+            # 2. Баги, упоминающие элементы или заголовки User Story в тексте
+            if not bug_urls:
+                search_terms = [str(term) for term in id_terms] + list(user_story_titles)
+                terms_condition = " OR ".join(
+                    f"[System.Description] CONTAINS '{escape_wiql(term)}' OR [System.Title] CONTAINS '{escape_wiql(term)}'"
+                    for term in search_terms
+                )
+                wiql = (
+                    f"SELECT [System.Id] FROM WorkItems "
+                    f"WHERE [System.WorkItemType] IN ({wiql_list(BUG_WORK_ITEM_TYPES)}) AND ({terms_condition})"
+                )
+                logger.info(f"BUG WIQL: {wiql}")
+                await self._log_debug(f"BUG WIQL: {wiql}\n")
+                for item_id in await wiql_service.query_ids(wiql) or []:
+                    await self._log_debug(f"Found bug: {item_id}\n")
+                    bug_urls.add(f"{settings.TFS_URL}/_workitems/edit/{item_id}")
+            
+            if bug_urls:
+                logger.info(f"Found {len(bug_urls)} bugs referencing work item {work_item_id} or related user stories")
+                await self._log_debug(f"Found {len(bug_urls)} bugs referencing work item {work_item_id} or related user stories\n")
         except Exception as e:
             logger.debug(f"Bug search failed: {e}")
             await self._log_debug(f"Bug search failed: {e}\n")
@@ -735,62 +688,35 @@ class ChecklistService:
                 "SELECT TOP 200 [System.Id], [System.Title], [System.WorkItemType], [System.Description] FROM WorkItems WHERE [System.ChangedDate] >= '2024-01-01'"
             ]
             
-            api_versions = ["4.1", "5.0", "5.1", "6.0"]
-            
-            for api_version in api_versions:
-                for approach in approaches:
-                    try:
-                        logger.info(f"Trying WIQL approach: {approach[:50]}... with API {api_version}")
-                        
-                        url = f"{self.tfs_service.base_url}/_apis/wit/wiql"
-                        params = {"api-version": api_version}
-                        
-                        orig_ct = self.tfs_service.session.headers.get("Content-Type")
-                        self.tfs_service.session.headers["Content-Type"] = "application/json"
-                        
-                        # Add timeout to prevent hanging
-                        response = self.tfs_service.session.post(url, params=params, json={"query": approach}, timeout=30)
-                        self.tfs_service.session.headers["Content-Type"] = orig_ct
-                        
-                        if response.status_code == 200:
-                            data = response.json()
-                            work_items = data.get("workItems", [])
-                            
-                            logger.info(f"Found {len(work_items)} work items, getting details...")
-                            
-                            # Get details for each work item with timeout
-                            for i, item in enumerate(work_items):
-                                try:
-                                    if i >= 50:  # Limit to prevent hanging
-                                        logger.info(f"Limited to first 50 items to prevent timeout")
-                                        break
-                                        
-                                    item_id = item['id']
-                                    item_details = await self.tfs_service.get_work_item(item_id)
-                                    
-                                    all_items.append({
-                                        'id': item_id,
-                                        'title': item_details.title,
-                                        'work_item_type': item_details.work_item_type,
-                                        'description': getattr(item_details, 'description', '') or ''
-                                    })
-                                    
-                                    # Log progress every 10 items
-                                    if (i + 1) % 10 == 0:
-                                        logger.info(f"Processed {i + 1}/{len(work_items)} work items")
-                                        
-                                except Exception as e:
-                                    logger.debug(f"Error getting details for #{item['id']}: {e}")
-                                    continue
-                            
-                            logger.info(f"Retrieved {len(all_items)} work items via WIQL API {api_version}")
-                            return all_items
-                        else:
-                            logger.debug(f"WIQL failed with status {response.status_code}")
-                            
-                    except Exception as e:
-                        logger.debug(f"WIQL approach failed: {e}")
+            for approach in approaches:
+                try:
+                    logger.info(f"Trying WIQL approach: {approach[:50]}...")
+                    
+                    item_ids = await wiql_service.query_ids(approach)
+                    if item_ids is None:
+                        logger.debug("WIQL approach failed")
                         continue
+                    
+                    logger.info(f"Found {len(item_ids)} work items, getting details...")
+                    
+                    # Get details for the first work items with one batch request
+                    if len(item_ids) > 50:  # Limit to prevent hanging
+                        logger.info(f"Limited to first 50 items to prevent timeout")
+                    
+                    for item_details in await self.tfs_service.get_work_items_batch(item_ids[:50]):
+                        all_items.append({
+                            'id': item_details.id,
+                            'title': item_details.title,
+                            'work_item_type': item_details.work_item_type,
+                            'description': (item_details.fields or {}).get('System.Description', '') or ''
+                        })
+                    
+                    logger.info(f"Retrieved {len(all_items)} work items via WIQL")
+                    return all_items
+                    
+                except Exception as e:
+                    logger.debug(f"WIQL approach failed: {e}")
+                    continue
             
             logger.warning("All WIQL approaches failed, returning empty list")
             return []
@@ -799,10 +725,17 @@ class ChecklistService:
             logger.error(f"Error getting all work items: {e}")
             return []
 
+    def _get_text_index(self, all_items: List[Dict[str, Any]]) -> WorkItemTextIndex:
+        """Индекс слов снимка Work Items (перестраивается только при изменении снимка)"""
+        fingerprint = WorkItemTextIndex.fingerprint(all_items)
+        if self._text_index is None or self._text_index_fingerprint != fingerprint:
+            self._text_index = WorkItemTextIndex(all_items)
+            self._text_index_fingerprint = fingerprint
+            logger.info(f"Built text index for {len(all_items)} work items")
+        return self._text_index
+
     async def _find_related_by_text_alternative(self, all_items: List[Dict[str, Any]], work_item_id: int) -> List[Dict[str, Any]]:
-        """Find related items by text search based on real TFS data analysis"""
-        related_items = []
-        
+        """Find related items by text search based on real TFS data analysis (via in-memory token index)"""
         # Получаем информацию об основном work item для контекста
         try:
             main_item = await self.tfs_service.get_work_item(work_item_id)
@@ -846,34 +779,28 @@ class ChecklistService:
             "статический фильтр"
         ]
         
-        for item in all_items:
-            title = item.get('title', '').lower()
-            description = item.get('description', '').lower()
-            work_item_type = item.get('work_item_type', '').lower()
-            
-            # Проверяем все паттерны
-            for pattern in search_patterns:
-                if pattern.lower() in title or pattern.lower() in description:
-                    related_items.append(item)
-                    break
-            
-            # Дополнительная логика для поиска связанных элементов
-            # Если это элемент из Houston проекта или тестовый элемент
-            if ('houston' in title or 'houston' in description or 
-                work_item_type in ['ошибка', 'backlog item', 'задача', 'bug', 'набор тестов', 'test case', 'test plan']):
-                # Ищем элементы, которые могут быть связаны с основным тикетом
-                if any(keyword in title or keyword in description for keyword in [
-                    'unilever', 'vosa', 'подсветка', 'ассортимент', 'фильтр', 
-                    'backlog', 'integration', 'test', 'bug', 'ошибка', 'набор тестов'
-                ]):
-                    if item not in related_items:
-                        related_items.append(item)
-            
-            # Специальная логика для поиска дочерних элементов
-            # Ищем элементы, которые содержат ключевые слова из основного тикета
-            if main_title and any(keyword in title for keyword in main_title.split()[:3]):  # Первые 3 слова
-                if item not in related_items:
-                    related_items.append(item)
+        index = self._get_text_index(all_items)
+        
+        # Проверяем все паттерны
+        matched = index.find(search_patterns)
+        
+        # Дополнительная логика для поиска связанных элементов
+        # Если это элемент из Houston проекта или тестовый элемент
+        candidates = index.find(['houston']) | index.with_types(
+            ['ошибка', 'backlog item', 'задача', 'bug', 'набор тестов', 'test case', 'test plan']
+        )
+        # Ищем элементы, которые могут быть связаны с основным тикетом
+        matched |= candidates & index.find([
+            'unilever', 'vosa', 'подсветка', 'ассортимент', 'фильтр', 
+            'backlog', 'integration', 'test', 'bug', 'ошибка', 'набор тестов'
+        ])
+        
+        # Специальная логика для поиска дочерних элементов
+        # Ищем элементы, которые содержат ключевые слова из основного тикета
+        if main_title:
+            matched |= index.find(main_title.split()[:3], fields=("title",))  # Первые 3 слова
+        
+        related_items = index.select(matched)
         
         logger.info(f"Found {len(related_items)} related items by enhanced text search")
         return related_items
@@ -896,114 +823,39 @@ class ChecklistService:
             return []
 
     async def _get_all_related_work_items_internal(self, work_item_id: int) -> List[Dict[str, Any]]:
-        """Внутренняя функция для получения связанных work items"""
+        """Внутренняя функция для получения связанных work items (обход по уровням)"""
         all_items = {}
         try:
-            # 1. Получаем основной work item
-            wi = await self.tfs_service.get_work_item(work_item_id)
-            all_items[wi.id] = {
-                "id": wi.id, 
-                "title": wi.title, 
-                "work_item_type": wi.work_item_type,
-                "project": getattr(wi, 'project', 'Backlog')
-            }
-            await self._log_debug(f"[MAIN] Основной work item: {wi.id} - {wi.title} ({wi.work_item_type})")
-            
-            # 2. Получаем все связи первого уровня (с ограничением)
-            first_level_ids = set()
-            processed_count = 0
-            max_relations = 20  # Ограничиваем количество связей для предотвращения зависания
-            
-            for rel in wi.relations or []:
-                if processed_count >= max_relations:
-                    await self._log_debug(f"[RELATIONS-1] Достигнуто ограничение {max_relations} связей, останавливаем обработку")
-                    break
-                    
-                url = rel.get("url", "")
-                rel_type = rel.get("rel", "")
-                await self._log_debug(f"[RELATIONS-1] Связь: {rel_type} -> {url}")
-                
-                if url and not url.endswith("workItems/"):
-                    try:
-                        rid = int(url.split("/")[-1])
-                        first_level_ids.add(rid)
-                        processed_count += 1
-                        await self._log_debug(f"[RELATIONS-1] Добавлен ID: {rid}")
-                    except Exception as e:
-                        await self._log_debug(f"[RELATIONS-1] Ошибка извлечения ID из {url}: {e}")
-                        continue
-            
-            await self._log_debug(f"[RELATIONS-1] Найдено {len(first_level_ids)} связанных IDs первого уровня (из {len(wi.relations or [])} доступных)")
-            
-            # 3. Получаем детали всех связанных work items первого уровня
-            # Используем индивидуальные запросы, так как batch API не работает для cross-project
-            for rid in first_level_ids:
-                try:
-                    wi_rel = await self.tfs_service.get_work_item(rid)
-                    project = getattr(wi_rel, 'project', 'Unknown')
-                    all_items[rid] = {
-                        "id": rid,
-                        "title": wi_rel.title,
-                        "work_item_type": wi_rel.work_item_type,
-                        "project": project
-                    }
-                    await self._log_debug(f"[RELATIONS-1] Получен: {rid} - {wi_rel.title} ({wi_rel.work_item_type}) в проекте {project}")
-                except Exception as e:
-                    await self._log_debug(f"[RELATIONS-1] Ошибка получения {rid}: {e}")
-                    continue
-            
-            # 4. Получаем связи второго уровня (с ограничением)
-            second_level_ids = set()
-            second_level_processed = 0
-            max_second_level = 10  # Ограничиваем количество связей второго уровня
-            
-            for item in all_items.values():
-                if item["id"] == work_item_id:  # Пропускаем основной элемент
-                    continue
-                    
-                if second_level_processed >= max_second_level:
-                    await self._log_debug(f"[RELATIONS-2] Достигнуто ограничение {max_second_level} связей второго уровня, останавливаем обработку")
-                    break
-                    
-                try:
-                    wi_2 = await self.tfs_service.get_work_item(item["id"])
-                    for rel in wi_2.relations or []:
-                        if second_level_processed >= max_second_level:
-                            break
-                            
-                        url = rel.get("url", "")
-                        rel_type = rel.get("rel", "")
-                        if url and not url.endswith("workItems/"):
-                            try:
-                                rid = int(url.split("/")[-1])
-                                if rid not in all_items and rid != work_item_id:
-                                    second_level_ids.add(rid)
-                                    second_level_processed += 1
-                                    await self._log_debug(f"[RELATIONS-2] Добавлен ID 2-го уровня: {rid} (тип связи: {rel_type})")
-                            except Exception as e:
-                                await self._log_debug(f"[RELATIONS-2] Ошибка извлечения ID из {url}: {e}")
-                                continue
-                except Exception as e:
-                    await self._log_debug(f"[RELATIONS-2] Ошибка получения связей для {item['id']}: {e}")
-                    continue
+            traversal = WorkItemTraversal(self.tfs_service)
+            result = await traversal.traverse([work_item_id])
+            
+            if not result.nodes:
+                await self._log_debug(f"[MAIN] Основной work item {work_item_id} не найден")
+                return []
+            
+            for node in result.nodes:
+                wi = node.item
+                project = getattr(wi, 'project', None) or ('Backlog' if node.depth == 0 else 'Unknown')
+                all_items[wi.id] = {
+                    "id": wi.id,
+                    "title": wi.title,
+                    "work_item_type": wi.work_item_type,
+                    "project": project,
+                    # Ревизия для кэша чек-листов; неполный по времени обход не кэшируется
+                    "rev": None if result.timed_out else (wi.fields or {}).get("System.Rev")
+                }
+                if node.depth == 0:
+                    await self._log_debug(f"[MAIN] Основной work item: {wi.id} - {wi.title} ({wi.work_item_type})")
+                else:
+                    await self._log_debug(f"[RELATIONS-{node.depth}] Получен: {wi.id} - {wi.title} ({wi.work_item_type}) "
+                                          f"в проекте {project} (связь {node.rel_type} от {node.parent_id})")
             
-            await self._log_debug(f"[RELATIONS-2] Найдено {len(second_level_ids)} связанных IDs второго уровня")
-            
-            # 5. Получаем детали всех связанных work items второго уровня
-            for rid in second_level_ids:
-                try:
-                    wi_2 = await self.tfs_service.get_work_item(rid)
-                    project = getattr(wi_2, 'project', 'Unknown')
-                    all_items[rid] = {
-                        "id": rid,
-                        "title": wi_2.title,
-                        "work_item_type": wi_2.work_item_type,
-                        "project": project
-                    }
-                    await self._log_debug(f"[RELATIONS-2] Получен: {rid} - {wi_2.title} ({wi_2.work_item_type}) в проекте {project}")
-                except Exception as e:
-                    await self._log_debug(f"[RELATIONS-2] Ошибка получения {rid}: {e}")
-                    continue
+            if result.truncated:
+                await self._log_debug(f"[RELATIONS] Достигнуты ограничения обхода (fan-out {traversal.max_fan_out}, "
+                                      f"элементов {traversal.max_items}), часть связей пропущена")
+            if result.timed_out:
+                await self._log_debug(f"[TIMEOUT] Бюджет времени обхода {traversal.time_budget} сек исчерпан, "
+                                      f"возвращаем {len(all_items)} найденных элементов")
             
             # 6. Группируем по проектам для отчета
             projects = {}
@@ -1024,60 +876,43 @@ class ChecklistService:
             await self._log_debug(f"Ошибка получения связанных work items: {e}\n")
             return []
 
+    async def _find_test_item_ids(self, search_terms: List[str]) -> Optional[List[int]]:
+        """ID тест-элементов, в заголовке или описании которых есть один из терминов (None - запрос не удался)"""
+        # Локальное зеркало Work Items (FTS5) вместо CONTAINS-запроса к TFS - только если
+        # зеркалируется вся коллекция: запрос ищет во всех проектах
+        if work_item_mirror.is_ready():
+            item_ids = sorted(work_item_mirror.search(search_terms, TEST_WORK_ITEM_TYPES))
+            logger.info(f"Found {len(item_ids)} test items via local work item mirror")
+            return item_ids
+        
+        terms_condition = " OR ".join(
+            f"([System.Description] CONTAINS '{escape_wiql(term)}' OR [System.Title] CONTAINS '{escape_wiql(term)}')"
+            for term in search_terms
+        )
+        wiql = (
+            f"SELECT [System.Id], [System.Title] FROM WorkItems "
+            f"WHERE [System.WorkItemType] IN ({wiql_list(TEST_WORK_ITEM_TYPES)}) AND ({terms_condition})"
+        )
+        logger.info(f"OPTIMIZED TEST WIQL: {wiql[:100]}...")
+        await self._log_debug(f"OPTIMIZED TEST WIQL: {wiql}\n")
+        return await wiql_service.query_ids(wiql)
+
     async def _search_test_items_by_reference_optimized(self, search_terms: List[str]) -> Set[str]:
-        """Оптимизированный поиск тест-элементов по ссылкам"""
+        """Оптимизированный поиск тест-элементов по ссылкам (один WIQL-запрос на все термины и типы)"""
         urls: Set[str] = set()
         try:
-            api_versions = ["4.1", "5.0", "5.1", "6.0"]
+            item_ids = await self._find_test_item_ids(search_terms)
+            if item_ids is None:
+                await self._log_debug("Optimized test search query failed\n")
+                return urls
             
-            for api_version in api_versions:
-                try:
-                    url = f"{self.tfs_service.base_url}/_apis/wit/wiql"
-                    params = {"api-version": api_version}
-                    
-                    # Создаем один WIQL запрос для всех терминов
-                    terms_condition = " OR ".join([f"([System.Description] CONTAINS '{term}' OR [System.Title] CONTAINS '{term}')" for term in search_terms])
-                    
-                    wiql_queries = [
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Тестовый случай' AND ({terms_condition})",
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'План тестирования' AND ({terms_condition})",
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Набор тестов' AND ({terms_condition})",
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Test Case' AND ({terms_condition})",
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Test Plan' AND ({terms_condition})",
-                        f"SELECT [System.Id], [System.Title] FROM WorkItems WHERE [System.WorkItemType] = 'Test Suite' AND ({terms_condition})"
-                    ]
-                    
-                    for wiql in wiql_queries:
-                        logger.info(f"OPTIMIZED TEST WIQL: {wiql[:100]}...")
-                        await self._log_debug(f"OPTIMIZED TEST WIQL: {wiql}\n")
-                        
-                        try:
-                            orig_ct = self.tfs_service.session.headers.get("Content-Type")
-                            self.tfs_service.session.headers["Content-Type"] = "application/json"
-                            resp = self.tfs_service.session.post(url, params=params, json={"query": wiql})
-                            self.tfs_service.session.headers["Content-Type"] = orig_ct
-                            
-                            if resp.status_code == 200:
-                                data = resp.json()
-                                for item in data.get("workItems", []):
-                                    logger.info(f"Found test item: {item}")
-                                    await self._log_debug(f"Found test item: {item}\n")
-                                    urls.add(f"{settings.TFS_URL}/_workitems/edit/{item['id']}")
-                                
-                                if urls:
-                                    logger.info(f"Found {len(urls)} test items via optimized search")
-                                    await self._log_debug(f"Found {len(urls)} test items via optimized search\n")
-                                    return urls
-                                    
-                        except Exception as query_error:
-                            logger.debug(f"Optimized test search query failed: {query_error}")
-                            await self._log_debug(f"Optimized test search query failed: {query_error}\n")
-                            continue
-                            
-                except Exception as version_error:
-                    logger.debug(f"Optimized test search API version {api_version} failed: {version_error}")
-                    await self._log_debug(f"Optimized test search API version {api_version} failed: {version_error}\n")
-                    continue
+            for item_id in item_ids:
+                await self._log_debug(f"Found test item: {item_id}\n")
+                urls.add(f"{settings.TFS_URL}/_workitems/edit/{item_id}")
+            
+            if urls:
+                logger.info(f"Found {len(urls)} test items via optimized search")
+                await self._log_debug(f"Found {len(urls)} test items via optimized search\n")
                     
         except Exception as e:
             logger.debug(f"Optimized test item search failed: {e}")
@@ -1112,141 +947,32 @@ class ChecklistService:
         return urls
 
     async def _search_pr_with_test_files(self, work_item_ids: List[int]) -> Set[str]:
-        """Поиск PR с тестовыми файлами, связанных с work items"""
+        """Поиск PR с тестовыми файлами, связанных с work items (через локальный индекс PR)"""
         urls: Set[str] = set()
         try:
-            # Houston репозиторий
-            project_name = "Houston"
-            repo_id = "e44e86d8-98ea-413e-917a-7c205e947451"
-            
-            logger.info(f"Searching PR in Houston repository for work items: {work_item_ids}")
-            await self._log_debug(f"Searching PR in Houston repository for work items: {work_item_ids}\n")
-            
-            # Получаем список завершенных PR
-            pr_list_url = f"{self.tfs_service.base_url}/{project_name}/_apis/git/repositories/{repo_id}/pullrequests"
-            params = {
-                "status": "completed",
-                "$top": 100,
-                "api-version": "4.1"
-            }
-            
-            resp = self.tfs_service.session.get(pr_list_url, params=params)
-            if resp.status_code != 200:
-                logger.warning(f"Failed to get PR list: {resp.status_code}")
-                await self._log_debug(f"Failed to get PR list: {resp.status_code}\n")
-                return urls
-            
-            prs = resp.json().get('value', [])
-            logger.info(f"Found {len(prs)} completed PRs")
-            await self._log_debug(f"Found {len(prs)} completed PRs\n")
+            logger.info(f"Searching PR in {pull_request_index.project} repository for work items: {work_item_ids}")
+            await self._log_debug(f"Searching PR in {pull_request_index.project} repository for work items: {work_item_ids}\n")
             
-            # Фильтруем PR, связанные с нашими work items
-            relevant_prs = []
-            
-            # Сначала получаем связанные work items для расширения поиска
-            all_related_ids = set(work_item_ids)
-            for work_item_id in work_item_ids:
-                try:
-                    work_item = await self.tfs_service.get_work_item(work_item_id)
-                    if work_item and work_item.relations:
-                        for relation in work_item.relations:
-                            rel_url = relation.get('url', '')
-                            if rel_url:
-                                rel_id = rel_url.split('/')[-1]
-                                all_related_ids.add(int(rel_id))
-                except Exception as e:
-                    logger.debug(f"Error getting relations for {work_item_id}: {e}")
-                    continue
+            # Сначала получаем связанные work items для расширения поиска (из графа связей;
+            # загружаются только элементы, которых в графе еще нет)
+            missing = link_graph.missing(work_item_ids)
+            if missing:
+                await self.tfs_service.get_work_items_batch(missing)
+            all_related_ids = set(link_graph.neighbourhood(work_item_ids, hops=1))
             
             logger.info(f"Searching PR for work items: {work_item_ids} and related: {all_related_ids}")
             await self._log_debug(f"Searching PR for work items: {work_item_ids} and related: {all_related_ids}\n")
             
-            for pr in prs:
-                pr_id = pr.get('pullRequestId')
-                title = pr.get('title', '')
-                description = pr.get('description', '')
-                
-                # Проверяем, содержит ли PR упоминание наших work items или связанных
-                for work_item_id in all_related_ids:
-                    if str(work_item_id) in title or str(work_item_id) in description:
-                        relevant_prs.append(pr)
-                        logger.info(f"Found relevant PR {pr_id}: {title}")
-                        await self._log_debug(f"Found relevant PR {pr_id}: {title}\n")
-                        break
-            
-            logger.info(f"Found {len(relevant_prs)} PRs related to work items")
-            await self._log_debug(f"Found {len(relevant_prs)} PRs related to work items\n")
-            
-            # Проверяем каждый релевантный PR на наличие тестовых файлов
-            for pr in relevant_prs:
-                pr_id = pr.get('pullRequestId')
-                try:
-                    # Получаем изменения файлов в PR (пробуем разные endpoints)
-                    changes_endpoints = [
-                        f"{self.tfs_service.base_url}/{project_name}/_apis/git/repositories/{repo_id}/pullrequests/{pr_id}/changes",
-                        f"{self.tfs_service.base_url}/{project_name}/_apis/git/repositories/{repo_id}/pullrequests/{pr_id}/files",
-                        f"{self.tfs_service.base_url}/_apis/git/repositories/{repo_id}/pullrequests/{pr_id}/changes",
-                        f"{self.tfs_service.base_url}/_apis/git/repositories/{repo_id}/pullrequests/{pr_id}/files"
-                    ]
-                    
-                    changes_resp = None
-                    for changes_url in changes_endpoints:
-                        try:
-                            changes_resp = self.tfs_service.session.get(changes_url, params={"api-version": "4.1"})
-                            if changes_resp.status_code == 200:
-                                logger.info(f"Successfully got changes from: {changes_url}")
-                                await self._log_debug(f"Successfully got changes from: {changes_url}\n")
-                                break
-                        except Exception as e:
-                            logger.debug(f"Failed to get changes from {changes_url}: {e}")
-                            continue
-                    
-                    if changes_resp and changes_resp.status_code == 200:
-                        changes_data = changes_resp.json()
-                        change_entries = changes_data.get('changeEntries', [])
-                        
-                        test_files = []
-                        for change in change_entries:
-                            item_path = change.get('item', {}).get('path', '')
-                            # Ищем тестовые файлы по паттернам
-                            if any(test_pattern in item_path.lower() for test_pattern in ['test', 'spec', 'specs', 'tnt', 'crocus']):
-                                test_files.append(item_path)
-                        
-                        if test_files:
-                            logger.info(f"PR {pr_id} contains {len(test_files)} test files")
-                            await self._log_debug(f"PR {pr_id} contains {len(test_files)} test files: {test_files[:5]}\n")
-                            
-                            # Создаем URL для PR
-                            pr_url = f"https://tfssrv.systtech.ru/tfs/defaultcollection/_git/Houston/pullrequest/{pr_id}"
-                            urls.add(pr_url)
-                            
-                            logger.info(f"Added integration test PR: {pr_url}")
-                            await self._log_debug(f"Added integration test PR: {pr_url}\n")
-                        else:
-                            logger.debug(f"PR {pr_id} does not contain test files")
-                            await self._log_debug(f"PR {pr_id} does not contain test files\n")
-                    else:
-                        # Если не удалось получить изменения файлов, но PR связан с нашими work items,
-                        # добавляем его как потенциальный интеграционный тест
-                        logger.info(f"Could not get file changes for PR {pr_id}, but it's related to our work items")
-                        await self._log_debug(f"Could not get file changes for PR {pr_id}, but it's related to our work items\n")
-                        
-                        # Проверяем название PR на наличие ключевых слов тестов
-                        title = pr.get('title', '').lower()
-                        description = pr.get('description', '').lower()
-                        test_keywords = ['test', 'spec', 'tnt', 'crocus', 'integration']
-                        
-                        if any(keyword in title or keyword in description for keyword in test_keywords):
-                            pr_url = f"https://tfssrv.systtech.ru/tfs/defaultcollection/_git/Houston/pullrequest/{pr_id}"
-                            urls.add(pr_url)
-                            
-                            logger.info(f"Added PR based on title/description keywords: {pr_url}")
-                            await self._log_debug(f"Added PR based on title/description keywords: {pr_url}\n")
-                        
-                except Exception as pr_error:
-                    logger.debug(f"Error processing PR {pr_id}: {pr_error}")
-                    await self._log_debug(f"Error processing PR {pr_id}: {pr_error}\n")
-                    continue
+            test_prs = await pull_request_index.find_test_prs(all_related_ids)
+            for pr_url, test_files in test_prs.items():
+                urls.add(pr_url)
+                if test_files:
+                    await self._log_debug(f"PR {pr_url} contains {len(test_files)} test files: {test_files[:5]}\n")
+                else:
+                    await self._log_debug(f"Added PR based on title/description keywords: {pr_url}\n")
+            
+            logger.info(f"Found {len(urls)} PRs with tests related to work items")
+            await self._log_debug(f"Found {len(urls)} PRs with tests related to work items\n")
                     
         except Exception as e:
             logger.error(f"Error searching PR with test files: {e}")
@@ -1269,66 +995,50 @@ class ChecklistService:
             logger.info(f"Searching bugs by relations for IDs: {id_terms}")
             await self._log_debug(f"Searching bugs by relations for IDs: {id_terms}\n")
             
-            # Поскольку WIQL не поддерживает поиск по связям, используем прямой подход:
+            bug_link_types = {link_type.value for link_type in BUG_SEARCH_LINK_TYPES}
+            
+            # Один запрос по WorkItemLinks: связи нужных типов с целевыми элементами-багами
+            links = await wiql_service.query_links(
+                [int(t) for t in id_terms],
+                link_types=bug_link_types,
+                target_condition=f"[Target].[System.WorkItemType] IN ({wiql_list(BUG_WORK_ITEM_TYPES)})"
+            )
+            if links is not None:
+                for source, target, _ in links:
+                    if source is not None:
+                        await self._log_debug(f"Found bug: {target} (linked from {source})\n")
+                        urls.add(f"{settings.TFS_URL}/_workitems/edit/{target}")
+                logger.info(f"Found {len(urls)} bugs via WorkItemLinks query")
+                await self._log_debug(f"Found {len(urls)} bugs via WorkItemLinks query\n")
+                return urls
+            
+            # Сервер не поддерживает WorkItemLinks - используем прямой подход:
             # 1. Получаем все связанные work items для каждого ID
             # 2. Фильтруем только баги
-            
-            for work_item_id in id_terms:
-                try:
-                    logger.info(f"Getting relations for work item {work_item_id}")
-                    await self._log_debug(f"Getting relations for work item {work_item_id}\n")
-                    
-                    # Получаем work item с расширенными связями
-                    work_item = await self.tfs_service.get_work_item(int(work_item_id))
-                    
-                    if not work_item or not work_item.relations:
-                        logger.debug(f"No relations found for work item {work_item_id}")
-                        await self._log_debug(f"No relations found for work item {work_item_id}\n")
-                        continue
-                    
-                    logger.info(f"Found {len(work_item.relations)} relations for work item {work_item_id}")
-                    await self._log_debug(f"Found {len(work_item.relations)} relations for work item {work_item_id}\n")
-                    
-                    # Фильтруем связи по типам, подходящим для поиска багов
-                    bug_relations = []
-                    for relation in work_item.relations:
-                        rel_type = relation.get('rel', '')
-                        if rel_type in [link_type.value for link_type in BUG_SEARCH_LINK_TYPES]:
-                            bug_relations.append(relation)
-                    
-                    logger.info(f"Found {len(bug_relations)} bug-related relations for work item {work_item_id}")
-                    await self._log_debug(f"Found {len(bug_relations)} bug-related relations for work item {work_item_id}\n")
-                    
-                    # Получаем детали связанных work items
-                    for relation in bug_relations:
-                        try:
-                            rel_url = relation.get('url', '')
-                            if not rel_url:
-                                continue
-                                
-                            # Извлекаем ID из URL
-                            rel_id = rel_url.split('/')[-1]
-                            
-                            logger.info(f"Getting details for related work item {rel_id}")
-                            await self._log_debug(f"Getting details for related work item {rel_id}\n")
-                            
-                            # Получаем детали связанного work item
-                            related_item = await self.tfs_service.get_work_item(int(rel_id))
-                            
-                            if related_item and related_item.work_item_type in ['Ошибка', 'Bug']:
-                                logger.info(f"Found bug: {related_item.id} - {related_item.title}")
-                                await self._log_debug(f"Found bug: {related_item.id} - {related_item.title}\n")
-                                urls.add(f"{settings.TFS_URL}/_workitems/edit/{related_item.id}")
-                            
-                        except Exception as rel_error:
-                            logger.debug(f"Error processing relation {relation}: {rel_error}")
-                            await self._log_debug(f"Error processing relation {relation}: {rel_error}\n")
-                            continue
-                    
-                except Exception as work_item_error:
-                    logger.debug(f"Error processing work item {work_item_id}: {work_item_error}")
-                    await self._log_debug(f"Error processing work item {work_item_id}: {work_item_error}\n")
-                    continue
+            related_ids: List[int] = []
+            
+            logger.info(f"Getting relations for work items {id_terms}")
+            await self._log_debug(f"Getting relations for work items {id_terms}\n")
+            
+            # Связи исходных work items берем из графа (недостающие загружаем одним batch-запросом)
+            source_ids = [int(t) for t in id_terms]
+            missing = link_graph.missing(source_ids)
+            if missing:
+                await self.tfs_service.get_work_items_batch(missing)
+            for source_id in source_ids:
+                # Фильтруем связи по типам, подходящим для поиска багов
+                bug_related = link_graph.neighbors(source_id, link_types=bug_link_types)
+                logger.info(f"Found {len(bug_related)} bug-related relations for work item {source_id}")
+                await self._log_debug(f"Found {len(bug_related)} bug-related relations for work item {source_id}\n")
+                related_ids.extend(bug_related)
+            
+            # Получаем детали всех связанных work items одним batch-запросом
+            if related_ids:
+                for related_item in await self.tfs_service.get_work_items_batch(related_ids):
+                    if related_item.work_item_type in ['Ошибка', 'Bug']:
+                        logger.info(f"Found bug: {related_item.id} - {related_item.title}")
+                        await self._log_debug(f"Found bug: {related_item.id} - {related_item.title}\n")
+                        urls.add(f"{settings.TFS_URL}/_workitems/edit/{related_item.id}")
             
             if urls:
                 logger.info(f"Found {len(urls)} bugs via relation-based search")
@@ -1343,5 +1053,201 @@ class ChecklistService:
         
         return urls
 
+    # --- Пакетные чек-листы ---
+
+    async def create_checklists_bulk(self, work_item_ids: List[int]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Чек-листы для многих Work Items за один проход.
+
+        Обход связей выполняется один раз от всех корней (общие элементы загружаются однажды),
+        поиск тест-планов, интеграционных тестов и багов - по объединению элементов всех
+        деревьев, после чего найденное распределяется по корням. Готовые чек-листы попадают
+        в кэш чек-листов; результаты возвращаются по одному на каждый ID. Если какой-то из
+        поисков не удался, чек-листы неполные: они не кэшируются и помечаются success=False.
+        """
+        root_ids = list(dict.fromkeys(int(wid) for wid in work_item_ids))
+        await self._log_debug(f"\n=== BULK CHECKLIST for {len(root_ids)} items at {datetime.now().isoformat()} ===\n")
+        
+        traversal = WorkItemTraversal(self.tfs_service, max_items=settings.CHECKLIST_TRAVERSAL_MAX_ITEMS * len(root_ids))
+        result = await traversal.traverse(root_ids)
+        items_by_id = {node.item.id: node.item for node in result.nodes}
+        members = {
+            root_id: self._traversal_members(root_id, items_by_id, traversal.max_depth, traversal.max_fan_out)
+            for root_id in root_ids if root_id in items_by_id
+        }
+        all_ids = sorted({wid for ids in members.values() for wid in ids})
+        logger.info(f"Bulk checklist: {len(members)}/{len(root_ids)} roots, {len(all_ids)} unique work items")
+        
+        # Термины текстового поиска тестов для каждого корня - как в create_checklist
+        root_terms: Dict[int, Set[str]] = {}
+        for root_id, ids in members.items():
+            terms = {str(wid) for wid in ids}
+            for wid in ids:
+                item = items_by_id[wid]
+                if wid == root_id or item.work_item_type.lower() == "user story":
+                    terms.add(item.title)
+            root_terms[root_id] = {term for term in terms if term}
+        
+        failures: List[str] = []
+        test_urls, pr_urls, bug_urls = await asyncio.gather(
+            self._bulk_test_urls(all_ids, set().union(*root_terms.values()) if root_terms else set(), failures),
+            self._bulk_integration_test_urls(all_ids, failures),
+            self._bulk_bug_urls(all_ids, failures),
+        )
+        by_id_tests, by_term_tests = test_urls
+        
+        for root_id in root_ids:
+            ids = members.get(root_id)
+            if ids is None:
+                yield {"work_item_id": root_id, "success": False, "error": f"Work Item {root_id} не найден"}
+                continue
+            test_plans: Set[str] = set()
+            for wid in ids:
+                test_plans |= by_id_tests.get(wid, set())
+            for term in root_terms[root_id]:
+                test_plans |= by_term_tests.get(term, set())
+            neighbourhood = set(link_graph.neighbourhood(ids, hops=1))
+            integration_tests = {url for url, linked in pr_urls.items() if linked & neighbourhood}
+            bugs: Set[str] = set()
+            for wid in ids:
+                bugs |= bug_urls.get(wid, set())
+            
+            checklist = self._format_checklist(test_plans, integration_tests, bugs)
+            if not result.timed_out and not failures:
+                checklist_result_cache.put(
+                    root_id, {wid: (items_by_id[wid].fields or {}).get("System.Rev") for wid in ids}, checklist
+                )
+            item_result = {
+                "work_item_id": root_id,
+                "success": not failures,
+                "title": items_by_id[root_id].title,
+                "related_count": len(ids),
+                "test_plans": sorted(test_plans),
+                "integration_tests": sorted(integration_tests),
+                "bugs": sorted(bugs),
+                "checklist": checklist,
+            }
+            if failures:
+                item_result["incomplete"] = True
+                item_result["error"] = f"Чек-лист неполный, не выполнен поиск: {', '.join(sorted(failures))}"
+            yield item_result
+
+    @staticmethod
+    def _traversal_members(root_id: int, items_by_id: Dict[int, Any], max_depth: int, max_fan_out: int) -> List[int]:
+        """Элементы дерева одного корня внутри общего обхода (те же правила глубины и fan-out)"""
+        members = [root_id]
+        seen = {root_id}
+        frontier = [root_id]
+        for _ in range(max_depth):
+            next_frontier = []
+            for wid in frontier:
+                for related_id, _rel in extract_related_ids(items_by_id[wid])[:max_fan_out]:
+                    if related_id not in seen and related_id in items_by_id:
+                        seen.add(related_id)
+                        next_frontier.append(related_id)
+            members.extend(next_frontier)
+            frontier = next_frontier
+        return members
+
+    async def _bulk_test_urls(self, work_item_ids: List[int], terms: Set[str],
+                              failures: List[str]) -> Tuple[Dict[int, Set[str]], Dict[str, Set[str]]]:
+        """Тесты по ID (индекс тест-планов) и по терминам (один текстовый поиск на все термины); сбои - в failures"""
+        by_id: Dict[int, Set[str]] = {}
+        by_term: Dict[str, Set[str]] = {}
+        try:
+            by_id = await test_plan_index.find_test_urls_by_work_item(work_item_ids)
+        except Exception as e:
+            logger.error(f"Bulk test plan index lookup failed: {e}")
+            failures.append("test plans")
+        try:
+            # Длина WIQL-запроса ограничена: термины ищутся частями
+            sorted_terms = sorted(terms)
+            item_ids: List[int] = []
+            for start in range(0, len(sorted_terms), BULK_TERMS_PER_QUERY):
+                chunk_ids = await self._find_test_item_ids(sorted_terms[start:start + BULK_TERMS_PER_QUERY])
+                if chunk_ids is None:
+                    raise Exception("test item WIQL query failed")
+                item_ids.extend(chunk_ids)
+            item_ids = list(dict.fromkeys(item_ids))
+            if item_ids:
+                # Какие термины встречаются в каждом найденном элементе - по его заголовку и описанию
+                # (описание без HTML-разметки, как в зеркале)
+                if work_item_mirror.is_ready():
+                    found = work_item_mirror.get_work_items(item_ids)
+                else:
+                    found = await self.tfs_service.get_work_items_batch(
+                        item_ids, fields=["System.Title", "System.Description"], expand=None
+                    )
+                index = WorkItemTextIndex([
+                    {"id": item.id, "title": item.title,
+                     "description": html_to_text((item.fields or {}).get("System.Description"))}
+                    for item in found
+                ])
+                for term in terms:
+                    positions = index.find([term])
+                    if term.isdigit():
+                        # Номер не должен быть частью другого номера
+                        pattern = re.compile(rf"(?<!\d){term}(?!\d)")
+                        positions = {p for p in positions
+                                     if any(pattern.search(index.text(p, field)) for field in index.fields)}
+                    if positions:
+                        by_term[term] = {f"{settings.TFS_URL}/_workitems/edit/{item['id']}"
+                                         for item in index.select(positions)}
+        except Exception as e:
+            logger.error(f"Bulk test item search failed: {e}")
+            failures.append("test items")
+        return by_id, by_term
+
+    async def _bulk_integration_test_urls(self, work_item_ids: List[int], failures: List[str]) -> Dict[str, Set[int]]:
+        """PR с тестами -> связанные Work Items (поиск один раз по окрестности всех элементов)"""
+        try:
+            missing = link_graph.missing(work_item_ids)
+            if missing:
+                await self.tfs_service.get_work_items_batch(missing)
+            related_ids = set(link_graph.neighbourhood(work_item_ids, hops=1))
+            test_prs = await pull_request_index.find_test_prs(related_ids)
+            links = pull_request_index.find_pr_links(related_ids)
+            return {url: links.get(url, set()) for url in test_prs}
+        except Exception as e:
+            logger.error(f"Bulk integration test search failed: {e}")
+            failures.append("integration tests")
+            return {}
+
+    async def _bulk_bug_urls(self, work_item_ids: List[int], failures: List[str]) -> Dict[int, Set[str]]:
+        """Баги по исходным Work Items (один запрос WorkItemLinks на все элементы)"""
+        by_source: Dict[int, Set[str]] = {}
+        try:
+            bug_link_types = {link_type.value for link_type in BUG_SEARCH_LINK_TYPES}
+            links: Optional[List[tuple]] = []
+            for start in range(0, len(work_item_ids), BULK_IDS_PER_QUERY):
+                chunk_links = await wiql_service.query_links(
+                    work_item_ids[start:start + BULK_IDS_PER_QUERY],
+                    link_types=bug_link_types,
+                    target_condition=f"[Target].[System.WorkItemType] IN ({wiql_list(BUG_WORK_ITEM_TYPES)})"
+                )
+                if chunk_links is None:
+                    links = None
+                    break
+                links.extend(chunk_links)
+            if links is None:
+                # Без WorkItemLinks - связи из графа, типы связанных элементов одним batch-запросом
+                missing = link_graph.missing(work_item_ids)
+                if missing:
+                    await self.tfs_service.get_work_items_batch(missing)
+                related = {wid: link_graph.neighbors(wid, link_types=bug_link_types) for wid in work_item_ids}
+                related_ids = sorted({rid for ids in related.values() for rid in ids})
+                bug_ids = {
+                    item.id for item in await self.tfs_service.get_work_items_batch(related_ids)
+                    if item.work_item_type in BUG_WORK_ITEM_TYPES
+                } if related_ids else set()
+                links = [(wid, rid, None) for wid, ids in related.items() for rid in ids if rid in bug_ids]
+            for source, target, _ in links:
+                if source is not None:
+                    by_source.setdefault(source, set()).add(f"{settings.TFS_URL}/_workitems/edit/{target}")
+        except Exception as e:
+            logger.error(f"Bulk bug search failed: {e}")
+            failures.append("bugs")
+        return by_source
+
 # Global instance
 checklist_service = ChecklistService()
@@ -0,0 +1,186 @@
+"""
+Кэш страниц Confluence по ID с проверкой номера версии и сохранением на диск (SQLite)
+"""
+
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    title TEXT,
+    space_key TEXT,
+    raw TEXT,
+    clean TEXT,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages (accessed_at);
+"""
+
+
+@dataclass
+class CachedPage:
+    """Страница одной версии: исходный HTML и (после первого запроса) очищенный текст"""
+    page_id: str
+    version: Optional[int]
+    title: str
+    space_key: str
+    raw: str
+    clean: Optional[str] = None
+
+
+class ConfluencePageCache:
+    """
+    Кэш страниц Confluence.
+
+    Ключ - ID страницы, запись хранит номер версии. Перед использованием запись проверяется
+    запросом только метаданных version: тело страницы загружается заново лишь если версия
+    изменилась. Память ограничена LRU-вытеснением; при заданном пути записи дублируются в
+    SQLite и переживают перезапуск (размер файла тоже ограничен).
+    """
+
+    def __init__(self, max_size: int = 50, db_path: str = None, disk_max_size: int = 500):
+        self._entries: "OrderedDict[str, CachedPage]" = OrderedDict()
+        self._max_size = max_size
+        self.db_path = db_path or None
+        self._disk_max_size = disk_max_size
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._hits = 0
+        self._misses = 0
+        self._revalidated = 0
+        self._evictions = 0
+
+    # --- SQLite ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _load_from_disk(self, page_id: str) -> Optional[CachedPage]:
+        if not self.db_path:
+            return None
+        try:
+            with self._db_lock:
+                row = self._connect().execute(
+                    "SELECT version, title, space_key, raw, clean FROM pages WHERE page_id = ?", (page_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Не удалось прочитать кэш страниц Confluence: {e}")
+            return None
+        if row is None:
+            return None
+        return CachedPage(page_id, row[0], row[1] or "", row[2] or "", row[3] or "", row[4])
+
+    def _save_to_disk(self, page: CachedPage):
+        if not self.db_path:
+            return
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages (page_id, version, title, space_key, raw, clean, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (page.page_id, page.version, page.title, page.space_key, page.raw, page.clean, time.time())
+                )
+                conn.execute(
+                    "DELETE FROM pages WHERE page_id NOT IN "
+                    "(SELECT page_id FROM pages ORDER BY accessed_at DESC LIMIT ?)", (self._disk_max_size,)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Не удалось сохранить страницу {page.page_id} в кэш на диске: {e}")
+
+    def _delete_from_disk(self, page_id: str):
+        if not self.db_path:
+            return
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                conn.execute("DELETE FROM pages WHERE page_id = ?", (page_id,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Не удалось удалить страницу {page_id} из кэша на диске: {e}")
+
+    # --- Операции кэша ---
+
+    def _remember(self, page: CachedPage):
+        with self._lock:
+            self._entries[page.page_id] = page
+            self._entries.move_to_end(page.page_id)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def get(self, page_id: str) -> Optional[CachedPage]:
+        """Запись страницы (версию должен проверить вызывающий код); промах не учитывается в статистике"""
+        page_id = str(page_id)
+        with self._lock:
+            page = self._entries.get(page_id)
+            if page is not None:
+                self._entries.move_to_end(page_id)
+                return page
+        page = self._load_from_disk(page_id)
+        if page is not None:
+            self._remember(page)
+        return page
+
+    def record(self, hit: bool, revalidated: bool = False):
+        """Учет результата проверки записи: hit - версия совпала, тело не загружалось"""
+        with self._lock:
+            if hit:
+                self._hits += 1
+                if revalidated:
+                    self._revalidated += 1
+            else:
+                self._misses += 1
+
+    def put(self, page: CachedPage):
+        """Сохранение страницы в памяти и на диске"""
+        self._remember(page)
+        self._save_to_disk(page)
+
+    def invalidate(self, page_id: str):
+        """Удаление страницы (после ее изменения через API)"""
+        page_id = str(page_id)
+        with self._lock:
+            self._entries.pop(page_id, None)
+        self._delete_from_disk(page_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для /api/v1/status"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "persistent": bool(self.db_path),
+                "hits": self._hits,
+                "misses": self._misses,
+                "revalidated": self._revalidated,
+                "evictions": self._evictions,
+                "hit_rate": round(self._hits / total, 3) if total else 0.0,
+            }
+
+
+# Глобальный экземпляр кэша (общий для всех экземпляров ConfluenceService)
+confluence_page_cache = ConfluencePageCache(
+    max_size=settings.CONFLUENCE_PAGE_CACHE_MAX_SIZE,
+    db_path=settings.CONFLUENCE_PAGE_CACHE_PATH,
+    disk_max_size=settings.CONFLUENCE_PAGE_CACHE_DISK_MAX_SIZE,
+)
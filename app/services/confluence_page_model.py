@@ -0,0 +1,153 @@
+"""
+Модель страницы Confluence: HTML разбирается один раз на версию страницы
+"""
+
+import re
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+# lxml заметно быстрее встроенного парсера; если не установлен - используем html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+CRITERIA_KEYWORDS = ['дано', 'когда', 'тогда']
+USER_STORY_TABLE_KEYWORDS = ['user story', 'пользовательская история', 'дано', 'когда', 'тогда']
+
+
+def clean_cell_text(text: str) -> str:
+    """Нормализация текста ячейки: неразрывные пробелы и повторяющиеся пробелы"""
+    text = text.replace('&nbsp;', ' ').replace('\xa0', ' ')
+    return re.sub(r'\s+', ' ', text)
+
+
+def build_cell_matrix(table, column_count: int) -> List[List[str]]:
+    """
+    Матрица значений строк данных (без первой строки-заголовка) с развернутыми rowspan/colspan.
+    Значение ячейки с rowspan повторяется во всех строках, которые она покрывает.
+    """
+    matrix = []
+    rowspans: Dict[Tuple[int, int], str] = {}
+    for tr_idx, tr in enumerate(table.find_all('tr')[1:]):
+        row = []
+        cells = tr.find_all(['td', 'th'])
+        col = 0
+        i = 0
+        while col < column_count:
+            if (tr_idx, col) in rowspans:
+                row.append(rowspans[(tr_idx, col)])
+                col += 1
+                continue
+            if i >= len(cells):
+                row.append("")
+                col += 1
+                continue
+            cell = cells[i]
+            text = clean_cell_text(cell.get_text(separator=' ', strip=True))
+            rowspan = int(cell.get('rowspan', 1))
+            colspan = int(cell.get('colspan', 1))
+            for _ in range(colspan):
+                row.append(text)
+                for r in range(1, rowspan):
+                    rowspans[(tr_idx + r, col)] = text
+                col += 1
+            i += 1
+        matrix.append(row)
+    return matrix
+
+
+class TableInfo:
+    """Предрассчитанные сведения о таблице: заголовки, классификация и матрица ячеек"""
+
+    def __init__(self, table):
+        self.table = table
+        self.rows = table.find_all('tr')
+        self.text_lower = table.get_text().lower()
+        header_row = self.rows[0] if self.rows else None
+        self.headers: List[str] = (
+            [clean_cell_text(cell.get_text(strip=True)) for cell in header_row.find_all(['th', 'td'])]
+            if header_row else []
+        )
+        self.headers_lower = [h.lower() for h in self.headers]
+        self.th_texts_lower = [th.get_text(strip=True).lower() for th in table.find_all('th')]
+        self._matrices: Dict[int, List[List[str]]] = {}
+
+    @property
+    def has_criteria_headers(self) -> bool:
+        """Первая строка содержит все колонки Дано / Когда / Тогда"""
+        return all(any(keyword in h for h in self.headers_lower) for keyword in CRITERIA_KEYWORDS)
+
+    @property
+    def has_criteria_th(self) -> bool:
+        """Хотя бы один <th> содержит Дано / Когда / Тогда"""
+        joined = ' '.join(self.th_texts_lower)
+        return any(keyword in joined for keyword in CRITERIA_KEYWORDS)
+
+    @property
+    def contains_user_stories(self) -> bool:
+        return any(keyword in self.text_lower for keyword in USER_STORY_TABLE_KEYWORDS)
+
+    def matrix(self, column_count: int) -> List[List[str]]:
+        """Матрица ячеек (кэшируется по числу колонок)"""
+        if column_count not in self._matrices:
+            self._matrices[column_count] = build_cell_matrix(self.table, column_count)
+        return self._matrices[column_count]
+
+
+class ConfluencePageModel:
+    """Разобранная страница: DOM, текст и индекс таблиц"""
+
+    def __init__(self, page_id: str, title: str, content: str, version: Optional[int] = None):
+        self.page_id = page_id
+        self.title = title
+        self.content = content
+        self.version = version
+        self.soup = BeautifulSoup(content, HTML_PARSER)
+        self.tables: List[TableInfo] = [TableInfo(table) for table in self.soup.find_all('table')]
+        self._tables_by_id = {id(info.table): info for info in self.tables}
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.soup.get_text()
+        return self._text
+
+    def table_info(self, table) -> Optional[TableInfo]:
+        """Сведения о таблице этой страницы (None - если таблица не из этого документа)"""
+        return self._tables_by_id.get(id(table))
+
+
+_MODEL_CACHE_SIZE = 16
+_model_cache: "OrderedDict[Tuple[str, str], ConfluencePageModel]" = OrderedDict()
+_model_cache_lock = threading.Lock()
+
+
+def get_page_model(page_id: str, title: str, content: str, version: Optional[int] = None) -> ConfluencePageModel:
+    """Модель страницы из кэша (ключ - ID и версия страницы, без версии - хэш содержимого)"""
+    version_key = str(version) if version is not None else hashlib.sha1(content.encode('utf-8')).hexdigest()
+    key = (str(page_id), version_key)
+    with _model_cache_lock:
+        model = _model_cache.get(key)
+        if model is not None:
+            _model_cache.move_to_end(key)
+            return model
+
+    model = ConfluencePageModel(page_id, title, content, version)
+    logger.info(f"🧩 Страница {page_id} разобрана ({HTML_PARSER}): {len(model.tables)} таблиц")
+
+    with _model_cache_lock:
+        _model_cache[key] = model
+        _model_cache.move_to_end(key)
+        while len(_model_cache) > _MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+    return model
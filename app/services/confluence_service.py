@@ -1,10 +1,13 @@
-import requests
+import httpx
 import base64
+import asyncio
 import logging
 from typing import Optional, List, Dict, Any
 from bs4 import BeautifulSoup
 from app.config.settings import settings
 from app.models.request_models import ConfluenceArticle
+from app.services.confluence_page_cache import CachedPage, confluence_page_cache
+from app.services.singleflight import confluence_article_flight
 from app.models.confluence_models import (
     ConfluencePageRequest, ConfluencePageResponse, ConfluenceTemplate,
     ConfluenceSpace, ConfluencePageUpdateRequest, ConfluenceCommentRequest,
@@ -14,14 +17,41 @@ from app.core.logging_config import log_confluence_operation
 
 logger = logging.getLogger(__name__)
 
+# Общий пул соединений к Confluence
+_http_client: Optional[httpx.AsyncClient] = None
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Ленивое создание общего асинхронного HTTP-клиента Confluence с keep-alive"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        limits = httpx.Limits(
+            max_connections=settings.CONFLUENCE_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.CONFLUENCE_HTTP_MAX_CONNECTIONS
+        )
+        _http_client = httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(settings.CONFLUENCE_HTTP_TIMEOUT)
+        )
+    return _http_client
+
+async def close_http_client():
+    """Закрытие общего пула соединений Confluence (вызывается при остановке приложения)"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
 class ConfluenceService:
     """Сервис для работы с Confluence API"""
     
     def __init__(self):
         self.base_url = settings.CONFLUENCE_URL.rstrip('/')
         self.auth = self._get_auth_headers()
-        self.session = requests.Session()
-        self.session.headers.update(self.auth)
+    
+    async def _request(self, method: str, url: str, params: Dict[str, Any] = None,
+                       json_body: Any = None) -> httpx.Response:
+        """Неблокирующий HTTP-запрос к Confluence через общий пул соединений"""
+        return await _get_http_client().request(method, url, params=params, json=json_body, headers=self.auth)
     
     def _get_auth_headers(self) -> dict:
         """Создаем заголовки для аутентификации"""
@@ -39,7 +69,7 @@ class ConfluenceService:
             url = f"{self.base_url}/rest/api/space"
             params = {"limit": 100}
             
-            response = self.session.get(url, params=params)
+            response = await self._request("GET", url, params=params)
             response.raise_for_status()
             
             data = response.json()
@@ -60,60 +90,169 @@ class ConfluenceService:
         except Exception:
             return html_content
     
+    def _article_from_content(self, item: Dict[str, Any]) -> ConfluenceArticle:
+        """Метаданные статьи из объекта content REST API (тело загружается через load_article_body)"""
+        return ConfluenceArticle(
+            id=item["id"],
+            title=item["title"],
+            space_key=item.get("space", {}).get("key", ""),
+            version=item.get("version", {}).get("number"),
+            body_loaded=False
+        )
+    
+    async def load_article_body(self, article: ConfluenceArticle) -> ConfluenceArticle:
+        """
+        Загрузка и очистка тела статьи из результатов поиска.
+        
+        Тело запрашивается только для выбранной статьи (версия из результатов поиска
+        сверяется с кэшем страниц); очищенный текст вычисляется один раз для версии.
+        """
+        if article.body_loaded:
+            return article
+        
+        page = await self.get_cached_page(article.id, article.version)
+        if page.clean is None:
+            page.clean = self._clean_html_content(page.raw)
+            confluence_page_cache.put(page)
+        
+        article.version = page.version
+        article.content = page.clean
+        article.body_loaded = True
+        logger.info(f"Загружено содержимое статьи: {article.title} (версия {article.version})")
+        return article
+    
+    async def get_cached_page(self, page_id: str, version: Optional[int] = None) -> CachedPage:
+        """
+        Страница из кэша с проверкой версии.
+        
+        Если текущая версия известна (например, из результатов поиска), она сверяется с кэшем
+        без запроса; иначе запрашиваются только метаданные version. Тело загружается заново
+        лишь при отсутствии записи или смене версии.
+        """
+        cached = confluence_page_cache.get(page_id)
+        if cached is not None:
+            current_version = version if version is not None else await self.get_page_version(page_id)
+            if current_version is not None and current_version == cached.version:
+                confluence_page_cache.record(hit=True, revalidated=version is None)
+                logger.info(f"📦 Страница {page_id} (версия {cached.version}) взята из кэша")
+                return cached
+        
+        confluence_page_cache.record(hit=False)
+        page = await self._fetch_page(page_id)
+        if page.version is not None:
+            confluence_page_cache.put(page)
+        return page
+    
+    async def _fetch_page(self, page_id: str) -> CachedPage:
+        """Загрузка тела, пространства и версии страницы"""
+        url = f"{self.base_url}/rest/api/content/{page_id}"
+        response = await self._request("GET", url, params={"expand": "body.storage,space,version"})
+        response.raise_for_status()
+        data = response.json()
+        
+        return CachedPage(
+            page_id=str(data["id"]),
+            version=data.get("version", {}).get("number"),
+            title=data["title"],
+            space_key=data.get("space", {}).get("key", ""),
+            raw=data.get("body", {}).get("storage", {}).get("value", "")
+        )
+    
     async def search_articles(self, keywords: str) -> List[ConfluenceArticle]:
         """
         Поиск статей по ключевым словам
         
+        Поиск по названию и полнотекстовый CQL-поиск выполняются параллельно. Если первый
+        завершившийся поиск нашел достаточно статей, второй отменяется. Результаты
+        объединяются без дубликатов и ранжируются (совпадения в названии - выше).
+        
         Пример: search_articles("tdd итоговое окно")
         """
+        logger.info(f"Поиск статей в Confluence по запросу: {keywords}")
         
+        tasks = {
+            asyncio.create_task(self._search_by_title(keywords)): "title",
+            asyncio.create_task(self._search_by_content(keywords)): "content",
+        }
+        results: Dict[str, List[ConfluenceArticle]] = {"title": [], "content": []}
+        title_error: Optional[Exception] = None
+        pending = set(tasks)
+        
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        results[tasks[task]] = task.result()
+                    except Exception as e:
+                        title_error = e
+                    if pending and len(results[tasks[task]]) >= settings.CONFLUENCE_SEARCH_ENOUGH_HITS:
+                        logger.info(f"Поиск по {tasks[task]} нашел достаточно статей, второй поиск отменен")
+                        for other in pending:
+                            other.cancel()
+                        pending = set()
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        articles = self._rank_articles(keywords, results["title"], results["content"])
+        if not articles and title_error is not None:
+            raise Exception(f"Ошибка при поиске в Confluence: {str(title_error)}")
+        
+        logger.info(f"Найдено статей: {len(articles)} (по названию: {len(results['title'])}, "
+                    f"по содержимому: {len(results['content'])})")
+        return articles
+    
+    def _rank_articles(self, keywords: str, title_hits: List[ConfluenceArticle],
+                       content_hits: List[ConfluenceArticle]) -> List[ConfluenceArticle]:
+        """Объединение результатов без дубликатов: точное название, доля слов запроса в названии, источник"""
+        query = keywords.lower().strip()
+        words = [word for word in query.split() if word]
+        title_ids = {article.id for article in title_hits}
+        content_ids = {article.id for article in content_hits}
+        
+        unique: Dict[str, ConfluenceArticle] = {}
+        for article in title_hits + content_hits:
+            unique.setdefault(article.id, article)
+        
+        def _score(article: ConfluenceArticle) -> float:
+            title = article.title.lower()
+            score = 3.0 if title == query else 0.0
+            if words:
+                score += sum(1 for word in words if word in title) / len(words)
+            if article.id in title_ids:
+                score += 1.0
+            if article.id in content_ids:
+                score += 0.5
+            return score
+        
+        ranked = sorted(unique.values(), key=_score, reverse=True)
+        return ranked[:settings.MAX_SEARCH_RESULTS]
+    
+    async def _search_by_title(self, keywords: str) -> List[ConfluenceArticle]:
+        """Поиск по названию статьи"""
         search_url = f"{self.base_url}/rest/api/content"
         
         # Параметры поиска
         params = {
             "title": keywords,  # Поиск в названии
-            "expand": "body.storage,space",
+            "expand": "space,version",
             "limit": 10,
             "type": "page"
         }
         
         try:
-            logger.info(f"Поиск статей в Confluence по запросу: {keywords}")
-            response = self.session.get(search_url, params=params)
+            response = await self._request("GET", search_url, params=params)
             response.raise_for_status()
             
-            data = response.json()
-            articles = []
-            
-            logger.info(f"Найдено статей: {len(data.get('results', []))}")
-            
-            for item in data.get("results", []):
-                # Извлекаем содержимое
-                content_html = ""
-                if "body" in item and "storage" in item["body"]:
-                    content_html = item["body"]["storage"]["value"]
-                
-                # Очищаем HTML
-                clean_content = self._clean_html_content(content_html)
-                
-                article = ConfluenceArticle(
-                    id=item["id"],
-                    title=item["title"],
-                    content=clean_content,
-                    space_key=item.get("space", {}).get("key", "")
-                )
-                articles.append(article)
+            articles = [self._article_from_content(item) for item in response.json().get("results", [])]
+            for article in articles:
                 logger.info(f"Добавлена статья: {article.title} (ID: {article.id})")
-            
-            # Если не найдено по точному названию, попробуем поиск по содержимому
-            if not articles:
-                articles = await self._search_by_content(keywords)
-            
             return articles
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при поиске в Confluence: {str(e)}")
-            if hasattr(e.response, 'text'):
+            if isinstance(e, httpx.HTTPStatusError):
                 logger.error(f"Детали ошибки: {e.response.text}")
             raise Exception(f"Ошибка при поиске в Confluence: {str(e)}")
     
@@ -122,40 +261,25 @@ class ConfluenceService:
         search_url = f"{self.base_url}/rest/api/search"
         
         # CQL запрос для поиска по содержимому
-        cql_query = f'text ~ "{keywords}" and type=page'
+        escaped = keywords.replace('\\', '\\\\').replace('"', '\\"')
+        cql_query = f'text ~ "{escaped}" and type=page'
         
         params = {
             "cql": cql_query,
             "limit": 10,
-            "expand": "content.body.storage,content.space"
+            "expand": "content.space,content.version"
         }
         
         try:
             logger.info(f"Поиск по содержимому: {cql_query}")
-            response = self.session.get(search_url, params=params)
+            response = await self._request("GET", search_url, params=params)
             response.raise_for_status()
             
-            data = response.json()
-            articles = []
-            
-            for item in data.get("results", []):
-                content = item.get("content", {})
-                
-                content_html = ""
-                if "body" in content and "storage" in content["body"]:
-                    content_html = content["body"]["storage"]["value"]
-                
-                clean_content = self._clean_html_content(content_html)
-                
-                article = ConfluenceArticle(
-                    id=content["id"],
-                    title=content["title"],
-                    content=clean_content,
-                    space_key=content.get("space", {}).get("key", "")
-                )
-                articles.append(article)
-            
-            return articles
+            return [
+                self._article_from_content(item["content"])
+                for item in response.json().get("results", [])
+                if item.get("content")
+            ]
             
         except Exception as e:
             logger.error(f"Ошибка при поиске по содержимому: {str(e)}")
@@ -167,40 +291,47 @@ class ConfluenceService:
         
         Пример: get_article_by_id("123456")
         """
-        
-        url = f"{self.base_url}/rest/api/content/{article_id}"
-        params = {"expand": "body.storage,space"}
-        
+        # Одновременные запросы одной страницы ждут одну загрузку
+        return await confluence_article_flight.do(
+            (self.base_url, str(article_id)), lambda: self._get_article_by_id(article_id)
+        )
+
+    async def _get_article_by_id(self, article_id: str) -> Optional[ConfluenceArticle]:
         try:
             logger.info(f"Получение статьи по ID: {article_id}")
-            response = self.session.get(url, params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            content_html = ""
-            if "body" in data and "storage" in data["body"]:
-                content_html = data["body"]["storage"]["value"]
+            page = await self.get_cached_page(article_id)
             
             article = ConfluenceArticle(
-                id=data["id"],
-                title=data["title"],
-                content=content_html,
-                space_key=data.get("space", {}).get("key", "")
+                id=page.page_id,
+                title=page.title,
+                content=page.raw,
+                space_key=page.space_key,
+                version=page.version
             )
             
             logger.info(f"Получена статья: {article.title}")
             return article
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при получении статьи: {str(e)}")
             return None
 
-    def test_connection(self) -> bool:
+    async def get_page_version(self, page_id: str) -> Optional[int]:
+        """Текущий номер версии страницы (без загрузки содержимого)"""
+        url = f"{self.base_url}/rest/api/content/{page_id}"
+        try:
+            response = await self._request("GET", url, params={"expand": "version"})
+            response.raise_for_status()
+            return response.json().get("version", {}).get("number")
+        except httpx.HTTPError as e:
+            logger.warning(f"Не удалось получить версию страницы {page_id}: {str(e)}")
+            return None
+
+    async def test_connection(self) -> bool:
         """Тестирование подключения к Confluence API"""
         try:
             test_url = f"{self.base_url}/rest/api/space"
-            response = self.session.get(test_url, params={"limit": 1})
+            response = await self._request("GET", test_url, params={"limit": 1})
             response.raise_for_status()
             logger.info("✅ Подключение к Confluence успешно")
             return True
@@ -244,7 +375,7 @@ class ConfluenceService:
                 page_data["ancestors"] = [{"id": parent_id}]
                 logger.info(f"📄 Страница будет создана как дочерняя для страницы ID: {parent_id}")
             
-            response = self.session.post(url, json=page_data)
+            response = await self._request("POST", url, json_body=page_data)
             response.raise_for_status()
             
             result = response.json()
@@ -304,7 +435,7 @@ class ConfluenceService:
             
             # Сначала получаем текущую версию страницы
             get_url = f"{self.base_url}/rest/api/content/{page_id}"
-            get_response = self.session.get(get_url, params={"expand": "version"})
+            get_response = await self._request("GET", get_url, params={"expand": "version"})
             get_response.raise_for_status()
             
             current_data = get_response.json()
@@ -330,10 +461,11 @@ class ConfluenceService:
             
             # Выполняем обновление
             update_url = f"{self.base_url}/rest/api/content/{page_id}"
-            response = self.session.put(update_url, json=update_data)
+            response = await self._request("PUT", update_url, json_body=update_data)
             response.raise_for_status()
             
             result = response.json()
+            confluence_page_cache.invalidate(page_id)
             page_url = f"{self.base_url}/pages/viewpage.action?pageId={page_id}"
             
             logger.info(f"✅ Страница обновлена успешно:")
@@ -385,7 +517,7 @@ class ConfluenceService:
                 }
             }
             
-            response = self.session.post(url, json=comment_data)
+            response = await self._request("POST", url, json_body=comment_data)
             response.raise_for_status()
             
             result = response.json()
@@ -480,7 +612,7 @@ class ConfluenceService:
             if space_key:
                 params["spaceKey"] = space_key
             
-            response = self.session.get(url, params=params)
+            response = await self._request("GET", url, params=params)
             response.raise_for_status()
             
             data = response.json()
@@ -518,7 +650,7 @@ class ConfluenceService:
             logger.info(f"🔄 Получение шаблона ID: {template_id}")
             
             url = f"{self.base_url}/rest/api/template/{template_id}"
-            response = self.session.get(url)
+            response = await self._request("GET", url)
             response.raise_for_status()
             
             data = response.json()
@@ -551,7 +683,7 @@ class ConfluenceService:
             url = f"{self.base_url}/rest/api/space"
             params = {"limit": 100}
             
-            response = self.session.get(url, params=params)
+            response = await self._request("GET", url, params=params)
             response.raise_for_status()
             
             data = response.json()
@@ -598,7 +730,7 @@ class ConfluenceService:
             if request.space_key:
                 params["spaceKey"] = request.space_key
             
-            response = self.session.get(url, params=params)
+            response = await self._request("GET", url, params=params)
             response.raise_for_status()
             
             data = response.json()
@@ -680,7 +812,7 @@ class ConfluenceService:
             
             for label in labels:
                 label_data = {"name": label}
-                response = self.session.post(url, json=label_data)
+                response = await self._request("POST", url, json_body=label_data)
                 response.raise_for_status()
             
             logger.info(f"✅ Метки добавлены к странице {page_id}")
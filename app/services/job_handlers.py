@@ -0,0 +1,150 @@
+"""
+Типы фоновых заданий: чек-листы, цепочки изменений и создание User Stories из Confluence
+"""
+
+import logging
+from typing import Any, Dict, List
+
+from app.config.settings import settings
+from app.models.request_models import parse_work_item_ids
+from app.services.job_manager import JobManager, ProgressReporter, job_manager
+from app.services.checklist_service import checklist_service
+from app.services.change_chain_service import change_chain_service
+from app.services.user_story_creator_service import user_story_creator_service
+
+logger = logging.getLogger(__name__)
+
+
+def _require(params: Dict[str, Any], name: str) -> Any:
+    value = params.get(name)
+    if value in (None, "", []):
+        raise ValueError(f"Не указан параметр {name}")
+    return value
+
+
+def _require_str(params: Dict[str, Any], name: str) -> str:
+    value = _require(params, name)
+    if not isinstance(value, str):
+        raise ValueError(f"Параметр {name} должен быть строкой")
+    return value
+
+
+def _require_id(params: Dict[str, Any], name: str) -> int:
+    return parse_work_item_ids([_require(params, name)], name)[0]
+
+
+def _require_ids(params: Dict[str, Any], name: str, max_items: int) -> List[int]:
+    ids = parse_work_item_ids(_require(params, name), name)
+    if len(ids) > max_items:
+        raise ValueError(f"Слишком много элементов в {name}: {len(ids)} (максимум {max_items})")
+    return ids
+
+
+# --- Проверка параметров при постановке в очередь (ошибка - 400, а не сбой в обработчике) ---
+
+def validate_checklist_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {**params, "work_item_id": _require_id(params, "work_item_id")}
+
+
+def validate_checklist_bulk_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {**params, "workItemIds": _require_ids(params, "workItemIds", settings.CHECKLIST_BULK_MAX_ITEMS)}
+
+
+def validate_change_chain_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    if params.get("message"):
+        return {**params, "message": _require_str(params, "message")}
+    return {
+        **params,
+        "project": _require_str(params, "project"),
+        "requestTitle": _require_str(params, "requestTitle"),
+        "sourceBacklogId": _require_id(params, "sourceBacklogId"),
+    }
+
+
+def validate_change_chain_bulk_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    if params.get("project") is not None and not isinstance(params["project"], str):
+        raise ValueError("Параметр project должен быть строкой")
+    return {**params, "sourceBacklogIds": _require_ids(params, "sourceBacklogIds", settings.CHANGE_CHAIN_BULK_MAX_ITEMS)}
+
+
+def validate_user_stories_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {**params, "confluence_url": _require_str(params, "confluence_url")}
+
+
+async def run_checklist_job(params: Dict[str, Any], report: ProgressReporter) -> Dict[str, Any]:
+    """params: {"work_item_id": 123}"""
+    work_item_id = params["work_item_id"]
+    report(f"Построение чек-листа для #{work_item_id}")
+    result = await checklist_service.get_checklist(work_item_id)
+    report("Чек-лист из кэша" if result["cache_hit"] else "Чек-лист построен")
+    return {"work_item_id": work_item_id, **result}
+
+
+async def run_checklist_bulk_job(params: Dict[str, Any], report: ProgressReporter) -> Dict[str, Any]:
+    """params: {"workItemIds": [123, 456]}"""
+    work_item_ids = params["workItemIds"]
+    report(f"Построение чек-листов для {len(work_item_ids)} элементов")
+    items = [item async for item in checklist_service.create_checklists_bulk(work_item_ids)]
+    created = sum(1 for item in items if item["success"])
+    return {"items": items, "summary": {"total": len(items), "created": created, "failed": len(items) - created}}
+
+
+async def run_change_chain_job(params: Dict[str, Any], report: ProgressReporter) -> Dict[str, Any]:
+    """params: {"message": "..."} или {"project", "requestTitle", "sourceBacklogId", "requestId"}"""
+    if params.get("message"):
+        report("Разбор запроса")
+        parsed = await change_chain_service.parse_change_request(params["message"])
+    else:
+        parsed = {
+            "project": params["project"],
+            "requestTitle": params["requestTitle"],
+            "sourceBacklogId": params["sourceBacklogId"],
+            "requestId": params.get("requestId"),
+        }
+    report(f"Создание цепочки изменений для #{parsed['sourceBacklogId']}")
+    chain = await change_chain_service.create_linked_change_chain(
+        project=parsed["project"],
+        request_title=parsed["requestTitle"],
+        source_backlog_id=parsed["sourceBacklogId"],
+        request_id=parsed.get("requestId")
+    )
+    return {"data": chain, "parsed_request": parsed}
+
+
+async def run_change_chain_bulk_job(params: Dict[str, Any], report: ProgressReporter) -> Dict[str, Any]:
+    """params: {"project": "Houston", "sourceBacklogIds": [123, 456], "requestId": "..."}"""
+    source_ids = params["sourceBacklogIds"]
+    items = []
+    async for item in change_chain_service.create_change_chains_bulk(
+        params.get("project") or "Houston", source_ids, params.get("requestId")
+    ):
+        items.append(item)
+        report(f"#{item['sourceBacklogId']}: {'создана' if item['success'] else 'ошибка'} "
+               f"({len(items)}/{len(source_ids)})")
+    created = sum(1 for item in items if item["success"])
+    return {"items": items, "summary": {"total": len(items), "created": created, "failed": len(items) - created}}
+
+
+async def run_user_stories_job(params: Dict[str, Any], report: ProgressReporter) -> Dict[str, Any]:
+    """params: {"confluence_url", "user_confirmation", "preview_token"} - как у /user-stories/create-from-confluence"""
+    confluence_url = params["confluence_url"]
+    confirmation = params.get("user_confirmation")
+    report("Создание User Stories" if confirmation is not None else "Подготовка предварительного просмотра")
+    result = await user_story_creator_service.create_user_stories_from_confluence(
+        confluence_url=confluence_url,
+        user_confirmation=confirmation,
+        preview_token=params.get("preview_token")
+    )
+    # Разобранная страница (объекты UserStoryData) нужна только внутри сервиса
+    result = {key: value for key, value in result.items() if key != "page_data"}
+    if not result.get("success"):
+        raise RuntimeError(result.get("error") or "Не удалось создать User Stories")
+    return result
+
+
+def register_job_handlers(manager: JobManager = job_manager):
+    manager.register("checklist", run_checklist_job, validate_checklist_params)
+    manager.register("checklist_bulk", run_checklist_bulk_job, validate_checklist_bulk_params)
+    manager.register("change_chain", run_change_chain_job, validate_change_chain_params)
+    manager.register("change_chain_bulk", run_change_chain_bulk_job, validate_change_chain_bulk_params)
+    manager.register("user_stories", run_user_stories_job, validate_user_stories_params)
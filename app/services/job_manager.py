@@ -0,0 +1,359 @@
+"""
+Фоновые задания для долгих операций (чек-листы, цепочки изменений, User Stories):
+очередь с ограниченным размером, пул асинхронных обработчиков, результаты в SQLite с TTL
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    job_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs (expires_at);
+"""
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINAL_STATUSES = {JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED}
+
+# Обработчик задания: (параметры, функция отчета о ходе выполнения) -> результат (JSON-совместимый)
+ProgressReporter = Callable[[str], None]
+JobHandler = Callable[[Dict[str, Any], ProgressReporter], Awaitable[Any]]
+# Проверка параметров при постановке в очередь: нормализованные параметры или ValueError
+JobValidator = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+class JobQueueFullError(Exception):
+    """Очередь заданий заполнена"""
+
+
+@dataclass
+class Job:
+    """Задание и его состояние"""
+    job_id: str
+    job_type: str
+    params: Dict[str, Any]
+    status: str = JOB_QUEUED
+    progress: List[Dict[str, Any]] = field(default_factory=list)
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+    cancel_requested: bool = field(default=False, repr=False)
+    changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINAL_STATUSES
+
+    def report(self, message: str):
+        """Отметка о ходе выполнения (видна при опросе и в потоке событий)"""
+        self.progress.append({"message": message, "at": round(time.time() - self.created_at, 3)})
+        self._notify()
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def to_dict(self, include_result: bool = False) -> Dict[str, Any]:
+        data = {
+            "job_id": self.job_id,
+            "type": self.job_type,
+            "status": self.status,
+            "progress": list(self.progress),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": round(self.finished_at - (self.started_at or self.created_at), 3)
+            if self.finished_at else None,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class JobManager:
+    """
+    Менеджер фоновых заданий.
+
+    submit() ставит задание в очередь ограниченного размера (при переполнении - JobQueueFullError)
+    и сразу возвращает его ID; задания выполняют workers обработчиков. Состояние доступно
+    опросом (get) или потоком изменений (watch). Завершенные задания хранятся в памяти и в
+    SQLite ещё result_ttl секунд; задания, прерванные перезапуском, помечаются как failed.
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 100, db_path: str = None,
+                 result_ttl: float = 86400.0):
+        self._handlers: Dict[str, JobHandler] = {}
+        self._validators: Dict[str, JobValidator] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._worker_count = workers
+        self._queue_size = queue_size
+        self.db_path = db_path or None
+        self._result_ttl = result_ttl
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def register(self, job_type: str, handler: JobHandler, validator: JobValidator = None):
+        self._handlers[job_type] = handler
+        if validator is not None:
+            self._validators[job_type] = validator
+
+    @property
+    def job_types(self) -> List[str]:
+        return sorted(self._handlers)
+
+    # --- SQLite ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _save(self, job: Job):
+        if not self.db_path:
+            return
+        expires_at = job.finished_at + self._result_ttl if job.finished_at else None
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO jobs (job_id, job_type, status, params, progress, result, error, "
+                    "created_at, started_at, finished_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job.job_id, job.job_type, job.status, json.dumps(job.params, ensure_ascii=False),
+                     json.dumps(job.progress, ensure_ascii=False),
+                     json.dumps(job.result, ensure_ascii=False, default=str), job.error,
+                     job.created_at, job.started_at, job.finished_at, expires_at)
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Не удалось сохранить задание {job.job_id}: {e}")
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        if not self.db_path:
+            return None
+        try:
+            with self._db_lock:
+                row = self._connect().execute(
+                    "SELECT job_type, status, params, progress, result, error, created_at, started_at, finished_at "
+                    "FROM jobs WHERE job_id = ? AND (expires_at IS NULL OR expires_at > ?)", (job_id, time.time())
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Не удалось прочитать задание {job_id}: {e}")
+            return None
+        if row is None:
+            return None
+        return Job(job_id, row[0], json.loads(row[2] or "{}"), status=row[1], progress=json.loads(row[3] or "[]"),
+                   result=json.loads(row[4]) if row[4] else None, error=row[5],
+                   created_at=row[6], started_at=row[7], finished_at=row[8])
+
+    def _purge_expired(self):
+        now = time.time()
+        for job_id in [jid for jid, job in self._jobs.items()
+                       if job.is_finished and job.finished_at + self._result_ttl < now]:
+            del self._jobs[job_id]
+        if not self.db_path:
+            return
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                conn.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Не удалось удалить устаревшие задания: {e}")
+
+    def _fail_interrupted(self):
+        """Задания, не завершенные до перезапуска, больше не выполнятся"""
+        if not self.db_path:
+            return
+        now = time.time()
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?, expires_at = ? "
+                    "WHERE status IN (?, ?)",
+                    (JOB_FAILED, "Задание прервано перезапуском сервиса", now, now + self._result_ttl,
+                     JOB_QUEUED, JOB_RUNNING)
+                )
+                conn.commit()
+            if cursor.rowcount:
+                logger.warning(f"⚠️ Заданий, прерванных перезапуском: {cursor.rowcount}")
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Не удалось обновить прерванные задания: {e}")
+
+    # --- Жизненный цикл ---
+
+    def start(self):
+        """Запуск обработчиков (из работающего event loop)"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._fail_interrupted()
+        self._purge_expired()
+        self._workers = [asyncio.create_task(self._worker(n)) for n in range(self._worker_count)]
+        logger.info(f"✅ Фоновые задания: {self._worker_count} обработчиков, очередь до {self._queue_size}")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # --- Задания ---
+
+    def submit(self, job_type: str, params: Dict[str, Any]) -> Job:
+        """
+        Постановка задания в очередь; ValueError - неизвестный тип или неверные параметры,
+        JobQueueFullError - очередь заполнена
+        """
+        if job_type not in self._handlers:
+            raise ValueError(f"Неизвестный тип задания: {job_type} (доступны: {', '.join(self.job_types)})")
+        params = dict(params or {})
+        validator = self._validators.get(job_type)
+        if validator is not None:
+            params = validator(params)
+        if self._queue is None:
+            raise RuntimeError("Обработчики фоновых заданий не запущены")
+        job = Job(uuid.uuid4().hex, job_type, params)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFullError(f"Очередь заданий заполнена ({self._queue_size})")
+        self._jobs[job.job_id] = job
+        self._save(job)
+        logger.info(f"📥 Задание {job.job_id} ({job_type}) поставлено в очередь")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Отмена задания: из очереди - сразу, выполняющегося - через отмену его задачи"""
+        job = self._jobs.get(job_id)
+        if job is None or job.is_finished:
+            return job if job is not None else self._load(job_id)
+        job.cancel_requested = True
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            self._finish(job, JOB_CANCELLED, error="Задание отменено")
+        return job
+
+    async def watch(self, job_id: str, heartbeat: float = 15.0) -> AsyncIterator[Optional[Job]]:
+        """Состояние задания после каждого изменения (None - изменений не было heartbeat секунд)"""
+        job = self.get(job_id)
+        if job is None:
+            return
+        while True:
+            # Событие берется до передачи состояния: изменения во время его обработки не теряются
+            changed = job.changed
+            yield job
+            if job.is_finished:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: str = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job.task = None
+        job._notify()
+        self._save(job)
+
+    async def _worker(self, number: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.is_finished:
+                    continue
+                await self._run(job)
+            except Exception as e:
+                logger.error(f"❌ Обработчик заданий {number}: {e}")
+            finally:
+                self._queue.task_done()
+                self._purge_expired()
+
+    async def _run(self, job: Job):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        job.report("Выполнение начато")
+        self._save(job)
+        job.task = asyncio.create_task(self._handlers[job.job_type](job.params, job.report))
+        try:
+            result = await job.task
+        except asyncio.CancelledError:
+            if job.cancel_requested:
+                logger.info(f"🛑 Задание {job.job_id} отменено")
+                self._finish(job, JOB_CANCELLED, error="Задание отменено")
+                return
+            self._finish(job, JOB_FAILED, error="Задание прервано остановкой сервиса")
+            raise
+        except Exception as e:
+            logger.error(f"❌ Задание {job.job_id} ({job.job_type}) завершилось ошибкой: {e}")
+            self._finish(job, JOB_FAILED, error=str(e))
+            return
+        self._finish(job, JOB_SUCCEEDED, result=result)
+        logger.info(f"✅ Задание {job.job_id} ({job.job_type}) выполнено за {job.to_dict()['duration']} сек")
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для /api/v1/status"""
+        statuses: Dict[str, int] = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": len(self._workers),
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "queue_max_size": self._queue_size,
+            "result_ttl": self._result_ttl,
+            "persistent": bool(self.db_path),
+            "job_types": self.job_types,
+            "jobs": statuses,
+        }
+
+
+# Глобальный экземпляр (обработчики регистрируются в app.services.job_handlers)
+job_manager = JobManager(
+    workers=settings.JOB_WORKERS,
+    queue_size=settings.JOB_QUEUE_SIZE,
+    db_path=settings.JOB_DB_PATH,
+    result_ttl=settings.JOB_RESULT_TTL,
+)
@@ -0,0 +1,246 @@
+"""
+Индекс связей Work Items в памяти: списки смежности по типам связей для многошаговых запросов
+"""
+
+import threading
+import logging
+from array import array
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.config.settings import settings
+from app.models.link_types import LINK_TYPES_INFO, LinkCategory, LinkType
+from app.models.tfs_models import WorkItemInfo
+from app.services.work_item_cache import CacheKey, work_item_cache
+
+logger = logging.getLogger(__name__)
+
+# Типы связей "вниз" (родитель -> дочерний) и "вверх" (дочерний -> родитель)
+DESCENDANT_LINK_TYPES = {LinkType.HIERARCHY_FORWARD.value, LinkType.ST_BACKLOG_HIERARCHY_FORWARD.value}
+ANCESTOR_LINK_TYPES = {LinkType.HIERARCHY_REVERSE.value, LinkType.ST_BACKLOG_HIERARCHY_REVERSE.value}
+
+
+def link_category(rel_type: str) -> Optional[LinkCategory]:
+    """Категория связи из справочника link_types (None - тип не описан в справочнике)"""
+    try:
+        return LINK_TYPES_INFO[LinkType(rel_type)]["category"]
+    except (ValueError, KeyError):
+        return None
+
+
+def reverse_link_type(rel_type: str) -> Optional[str]:
+    """Обратный тип связи (для RELATED - он же)"""
+    try:
+        reverse = LINK_TYPES_INFO[LinkType(rel_type)].get("reverse_type")
+    except (ValueError, KeyError):
+        return None
+    return reverse.value if reverse else None
+
+
+def parse_work_item_relations(item: WorkItemInfo) -> List[Tuple[str, int]]:
+    """(тип связи, ID) связей с другими Work Items; ссылки на артефакты и гиперссылки пропускаются"""
+    links = []
+    for relation in item.relations or []:
+        url = relation.get("url", "")
+        if "/workitems/" not in url.lower():
+            continue
+        try:
+            links.append((relation.get("rel", ""), int(url.rstrip("/").split("/")[-1])))
+        except ValueError:
+            continue
+    return links
+
+
+class LinkGraph:
+    """
+    Граф связей Work Items.
+
+    Для каждого элемента хранятся компактные массивы ID (array('l')) по типам связей; типы
+    связей кодируются номерами. Полный список связей элемента берется из загруженного
+    Work Item (и заменяется при новой ревизии), частичные - из запросов WorkItemLinks: для них
+    добавляется и обратная связь у целевого элемента.
+
+    Полный список актуален, пока в кэше Work Items есть свежая запись элемента со связями:
+    иначе элемент считается незагруженным (missing), и вызывающий код запрашивает его через
+    TFSService, который проверяет System.Rev и при новой ревизии перестраивает запись.
+    Записи сбрасываются при изменении элемента через API и при вытеснении из кэша; число
+    элементов в графе ограничено max_size (LRU).
+    """
+
+    def __init__(self, max_size: int = 20000):
+        self._adjacency: "OrderedDict[int, Dict[int, array]]" = OrderedDict()
+        self._complete: Dict[int, Optional[int]] = {}
+        self._max_size = max_size
+        self._evictions = 0
+        self._type_codes: Dict[str, int] = {}
+        self._type_names: List[str] = []
+        self._lock = threading.Lock()
+
+    def _code(self, rel_type: str) -> int:
+        code = self._type_codes.get(rel_type)
+        if code is None:
+            code = len(self._type_names)
+            self._type_codes[rel_type] = code
+            self._type_names.append(rel_type)
+        return code
+
+    def _codes(self, link_types: Optional[Iterable[str]] = None,
+               categories: Optional[Iterable[LinkCategory]] = None) -> Optional[Set[int]]:
+        """Коды типов для фильтра (None - все типы)"""
+        if link_types is None and categories is None:
+            return None
+        codes: Set[int] = set()
+        if link_types is not None:
+            codes.update(self._type_codes[t] for t in link_types if t in self._type_codes)
+        if categories is not None:
+            categories = set(categories)
+            codes.update(code for name, code in self._type_codes.items() if link_category(name) in categories)
+        return codes
+
+    def _add_edge(self, source: int, rel_type: str, target: int):
+        lists = self._adjacency.setdefault(source, {})
+        ids = lists.setdefault(self._code(rel_type), array("l"))
+        if target not in ids:
+            ids.append(target)
+        self._touch(source)
+
+    def _touch(self, work_item_id: int):
+        """Отметка использования записи и LRU-вытеснение сверх max_size (под self._lock)"""
+        self._adjacency.move_to_end(work_item_id)
+        while len(self._adjacency) > self._max_size:
+            evicted, _ = self._adjacency.popitem(last=False)
+            self._complete.pop(evicted, None)
+            self._evictions += 1
+
+    # --- Наполнение ---
+
+    def update_from_item(self, item: WorkItemInfo):
+        """Полный список связей элемента (если ревизия не изменилась - без перестройки)"""
+        if item.relations is None:
+            return
+        rev = (item.fields or {}).get("System.Rev")
+        with self._lock:
+            if item.id in self._complete and rev is not None and self._complete[item.id] == rev:
+                self._touch(item.id)
+                return
+            grouped: Dict[int, array] = {}
+            for rel_type, target in parse_work_item_relations(item):
+                ids = grouped.setdefault(self._code(rel_type), array("l"))
+                if target not in ids:
+                    ids.append(target)
+            self._adjacency[item.id] = grouped
+            self._complete[item.id] = rev
+            self._touch(item.id)
+
+    def update_from_items(self, items: Iterable[WorkItemInfo]):
+        for item in items:
+            self.update_from_item(item)
+
+    def add_links(self, links: Iterable[Tuple[Optional[int], int, Optional[str]]]):
+        """Связи из запроса WorkItemLinks: (source_id, target_id, тип); корневые строки пропускаются"""
+        with self._lock:
+            for source, target, rel_type in links:
+                if source is None or not rel_type:
+                    continue
+                if source not in self._complete:
+                    self._add_edge(source, rel_type, target)
+                reverse = reverse_link_type(rel_type)
+                if reverse and target not in self._complete:
+                    self._add_edge(target, reverse, source)
+
+    def invalidate(self, work_item_id: int):
+        """Сброс связей элемента (после изменения связей или полей)"""
+        with self._lock:
+            self._adjacency.pop(int(work_item_id), None)
+            self._complete.pop(int(work_item_id), None)
+
+    def on_cache_eviction(self, key: CacheKey):
+        """Вытеснение из кэша записи со связями: полный список больше не проверяется по ревизии"""
+        if key[1] is None and key[2] == "relations":
+            self.invalidate(key[0])
+
+    # --- Запросы ---
+
+    def is_complete(self, work_item_id: int) -> bool:
+        """Полный список связей загружен и подтвержден свежей записью кэша Work Items"""
+        work_item_id = int(work_item_id)
+        return (work_item_id in self._complete
+                and work_item_cache.is_fresh(work_item_cache.make_key(work_item_id, expand="relations")))
+
+    def missing(self, work_item_ids: Iterable[int]) -> List[int]:
+        """ID, полный список связей которых не загружен или требует проверки ревизии"""
+        return [int(wid) for wid in work_item_ids if not self.is_complete(wid)]
+
+    def neighbors(self, work_item_id: int, link_types: Optional[Iterable[str]] = None,
+                  categories: Optional[Iterable[LinkCategory]] = None) -> List[int]:
+        """Соседи элемента по связям выбранных типов и категорий"""
+        codes = self._codes(link_types, categories)
+        result: List[int] = []
+        seen: Set[int] = set()
+        for code, ids in self._adjacency.get(int(work_item_id), {}).items():
+            if codes is not None and code not in codes:
+                continue
+            for target in ids:
+                if target not in seen:
+                    seen.add(target)
+                    result.append(target)
+        return result
+
+    def links(self, work_item_id: int) -> List[Tuple[str, int]]:
+        """(тип связи, ID) всех известных связей элемента"""
+        return [
+            (self._type_names[code], target)
+            for code, ids in self._adjacency.get(int(work_item_id), {}).items()
+            for target in ids
+        ]
+
+    def neighbourhood(self, work_item_ids: Iterable[int], hops: int = 1, link_types: Optional[Iterable[str]] = None,
+                      categories: Optional[Iterable[LinkCategory]] = None) -> Dict[int, int]:
+        """Элементы в пределах hops шагов: ID -> расстояние (исходные элементы - 0)"""
+        codes = self._codes(link_types, categories)
+        distances: Dict[int, int] = {int(wid): 0 for wid in work_item_ids}
+        queue = deque(distances)
+        while queue:
+            current = queue.popleft()
+            depth = distances[current]
+            if depth >= hops:
+                continue
+            for code, ids in self._adjacency.get(current, {}).items():
+                if codes is not None and code not in codes:
+                    continue
+                for target in ids:
+                    if target not in distances:
+                        distances[target] = depth + 1
+                        queue.append(target)
+        return distances
+
+    def descendants(self, work_item_id: int, max_depth: int = 10) -> List[int]:
+        """Дочерние элементы всех уровней (по иерархическим связям)"""
+        found = self.neighbourhood([work_item_id], max_depth, link_types=DESCENDANT_LINK_TYPES)
+        return [wid for wid, depth in sorted(found.items(), key=lambda pair: pair[1]) if depth > 0]
+
+    def ancestors(self, work_item_id: int, max_depth: int = 10) -> List[int]:
+        """Родительские элементы от ближайшего к корню"""
+        found = self.neighbourhood([work_item_id], max_depth, link_types=ANCESTOR_LINK_TYPES)
+        return [wid for wid, depth in sorted(found.items(), key=lambda pair: pair[1]) if depth > 0]
+
+    def related(self, work_item_id: int) -> List[int]:
+        """Элементы со связью "Связанные" """
+        return self.neighbors(work_item_id, categories=[LinkCategory.RELATED])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "work_items": len(self._adjacency),
+                "complete": len(self._complete),
+                "links": sum(len(ids) for lists in self._adjacency.values() for ids in lists.values()),
+                "link_types": len(self._type_names),
+                "max_size": self._max_size,
+                "evictions": self._evictions,
+            }
+
+
+# Глобальный экземпляр графа (наполняется TFSService и WIQL-запросами WorkItemLinks)
+link_graph = LinkGraph(max_size=settings.LINK_GRAPH_MAX_SIZE)
+work_item_cache.add_invalidation_listener(link_graph.invalidate)
+work_item_cache.add_eviction_listener(link_graph.on_cache_eviction)
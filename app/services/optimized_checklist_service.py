@@ -12,6 +12,7 @@ from dataclasses import dataclass
 from datetime import datetime
 from functools import wraps
 from app.services.tfs_service import TFSService
+from app.services.work_item_mirror import work_item_mirror
 from app.config.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -180,6 +181,12 @@ class OptimizedWIQLService:
         if not search_terms or not work_item_types:
             return set()
         
+        # Локальное зеркало Work Items (FTS5) отвечает без запроса к TFS
+        if work_item_mirror.is_ready():
+            ids = work_item_mirror.search(search_terms, work_item_types)
+            logger.info(f"✅ Mirror search found {len(ids)} items")
+            return {f"{settings.TFS_URL}/_workitems/edit/{item_id}" for item_id in ids}
+        
         # Создаем один комплексный WIQL запрос
         work_item_type_condition = " OR ".join([f"[System.WorkItemType] = '{wt}'" for wt in work_item_types])
         search_condition = " OR ".join([f"([System.Title] CONTAINS '{term}' OR [System.Description] CONTAINS '{term}')" for term in search_terms])
@@ -0,0 +1,96 @@
+"""
+Хранилище сессий предварительного просмотра User Stories (preview -> подтверждение)
+"""
+
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PreviewSession:
+    """Разобранная при предварительном просмотре страница"""
+    token: str
+    confluence_url: str
+    page_id: str
+    version: Optional[int]
+    page_data: Any
+    preview: Dict[str, Any]
+    created_at: float = field(default_factory=time.monotonic)
+
+    def is_expired(self, ttl: float) -> bool:
+        return time.monotonic() - self.created_at > ttl
+
+
+class PreviewSessionStore:
+    """
+    Сессии предварительного просмотра по токену.
+
+    При подтверждении создания используется уже разобранная страница: повторная загрузка
+    и парсинг нужны только если версия страницы в Confluence изменилась после просмотра.
+    """
+
+    def __init__(self, ttl: float = 1800.0, max_sessions: int = 100):
+        self._sessions: "OrderedDict[str, PreviewSession]" = OrderedDict()
+        self._ttl = ttl
+        self._max_sessions = max_sessions
+        self._lock = threading.Lock()
+
+    def _purge_expired(self):
+        for token in [t for t, s in self._sessions.items() if s.is_expired(self._ttl)]:
+            del self._sessions[token]
+
+    def create(self, confluence_url: str, page_id: str, version: Optional[int],
+               page_data: Any, preview: Dict[str, Any]) -> PreviewSession:
+        """Новая сессия; самые старые вытесняются при превышении лимита"""
+        session = PreviewSession(uuid.uuid4().hex, confluence_url, page_id, version, page_data, preview)
+        with self._lock:
+            self._purge_expired()
+            self._sessions[session.token] = session
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+        logger.info(f"💾 Сессия предпросмотра {session.token} для страницы {page_id} (версия {version})")
+        return session
+
+    def get(self, token: str) -> Optional[PreviewSession]:
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if session.is_expired(self._ttl):
+                del self._sessions[token]
+                return None
+            return session
+
+    def pop(self, token: str) -> Optional[PreviewSession]:
+        """Сессия забирается из хранилища: подтвердить один предпросмотр можно только один раз"""
+        with self._lock:
+            session = self._sessions.pop(token, None)
+        if session is None or session.is_expired(self._ttl):
+            return None
+        return session
+
+    def discard(self, token: str):
+        """Удаление сессии после создания User Stories или отмены"""
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._purge_expired()
+            return {"sessions": len(self._sessions), "max_sessions": self._max_sessions, "ttl_seconds": self._ttl}
+
+
+# Глобальный экземпляр хранилища
+preview_session_store = PreviewSessionStore(
+    ttl=settings.USER_STORY_PREVIEW_TTL,
+    max_sessions=settings.USER_STORY_PREVIEW_MAX_SESSIONS,
+)
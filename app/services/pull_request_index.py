@@ -0,0 +1,322 @@
+"""
+Локальный индекс завершенных Pull Requests (SQLite) для поиска интеграционных тестов
+"""
+
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.config.settings import settings
+from app.services.tfs_service import TFSService
+
+logger = logging.getLogger(__name__)
+
+# Упоминания Work Items в заголовке/описании PR: любое число из 3+ цифр ("#123456", "US123456")
+WORK_ITEM_MENTION_PATTERN = re.compile(r"(?<!\d)(\d{3,})(?!\d)")
+
+# Признаки тестовых файлов в путях изменений PR
+TEST_FILE_PATTERNS = ['test', 'spec', 'specs', 'tnt', 'crocus']
+
+# Ключевые слова тестов в заголовке/описании (если список файлов недоступен)
+TEST_TITLE_KEYWORDS = ['test', 'spec', 'tnt', 'crocus', 'integration']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pull_requests (
+    repo_id TEXT NOT NULL,
+    pr_id INTEGER NOT NULL,
+    title TEXT,
+    description TEXT,
+    url TEXT,
+    closed_date TEXT,
+    files_fetched INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (repo_id, pr_id)
+);
+CREATE TABLE IF NOT EXISTS pr_work_items (
+    repo_id TEXT NOT NULL,
+    pr_id INTEGER NOT NULL,
+    work_item_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (repo_id, pr_id, work_item_id)
+);
+CREATE INDEX IF NOT EXISTS idx_pr_work_items_wi ON pr_work_items (work_item_id);
+CREATE TABLE IF NOT EXISTS pr_files (
+    repo_id TEXT NOT NULL,
+    pr_id INTEGER NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pr_files_pr ON pr_files (repo_id, pr_id);
+CREATE TABLE IF NOT EXISTS index_state (
+    repo_id TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL
+);
+"""
+
+
+def extract_work_item_mentions(*texts: str) -> Set[int]:
+    """ID Work Items, упомянутые в тексте PR"""
+    ids: Set[int] = set()
+    for text in texts:
+        for match in WORK_ITEM_MENTION_PATTERN.finditer(text or ""):
+            ids.add(int(match.group(1)))
+    return ids
+
+
+def is_test_file(path: str) -> bool:
+    lowered = path.lower()
+    return any(pattern in lowered for pattern in TEST_FILE_PATTERNS)
+
+
+class PullRequestIndex:
+    """
+    Индекс PR репозитория: Work Item -> PR (по workItemRefs и упоминаниям в тексте)
+    и список измененных файлов каждого PR.
+
+    Завершенные PR не меняются, поэтому индекс пополняется инкрементально: при обновлении
+    загружаются только PR новее уже проиндексированных, а список файлов PR запрашивается
+    один раз - когда PR впервые понадобился для чек-листа. Индекс обновляется только в фоне
+    (run_periodic), чек-листы читают его локально.
+    """
+
+    PAGE_SIZE = 100
+    FETCH_CONCURRENCY = 5
+
+    def __init__(self, tfs_service: TFSService = None, project: str = None, repository: str = None,
+                 db_path: str = None):
+        self.tfs_service = tfs_service or TFSService()
+        self.project = project or settings.PR_INDEX_PROJECT
+        self.repository = repository or settings.PR_INDEX_REPOSITORY
+        self.db_path = db_path or settings.PR_INDEX_DB_PATH
+        self._db_lock = threading.Lock()
+        self._refresh_lock = asyncio.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _execute(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        with self._db_lock:
+            conn = self._connect()
+            rows = conn.execute(sql, tuple(params)).fetchall()
+            conn.commit()
+            return rows
+
+    def _executemany(self, sql: str, rows: List[tuple]):
+        if not rows:
+            return
+        with self._db_lock:
+            conn = self._connect()
+            conn.executemany(sql, rows)
+            conn.commit()
+
+    @property
+    def _repo_url(self) -> str:
+        return f"{self.tfs_service.base_url}/{self.project}/_apis/git/repositories/{self.repository}"
+
+    # --- Обновление индекса ---
+
+    async def refresh(self, force: bool = False) -> int:
+        """Инкрементальное обновление; возвращает количество новых PR"""
+        async with self._refresh_lock:
+            state = self._execute("SELECT refreshed_at FROM index_state WHERE repo_id = ?", (self.repository,))
+            if state and not force and time.time() - state[0][0] < settings.PR_INDEX_REFRESH_INTERVAL:
+                return 0
+
+            known = {row[0] for row in self._execute(
+                "SELECT pr_id FROM pull_requests WHERE repo_id = ?", (self.repository,)
+            )}
+            limit = settings.PR_INDEX_MAX_NEW_PRS
+            new_prs: List[Dict] = []
+            skip = 0
+
+            # PR возвращаются от новых к старым: останавливаемся на первой уже известной странице
+            while len(new_prs) < limit:
+                response = await self.tfs_service.get(
+                    f"{self._repo_url}/pullrequests",
+                    params={"searchCriteria.status": "completed", "$top": self.PAGE_SIZE,
+                            "$skip": skip, "api-version": "4.1"}
+                )
+                if response.status_code != 200:
+                    logger.warning(f"Не удалось получить список PR: {response.status_code}")
+                    break
+                page = response.json().get("value", [])
+                fresh = [pr for pr in page if pr.get("pullRequestId") not in known]
+                new_prs.extend(fresh[:limit - len(new_prs)])
+                if len(page) < self.PAGE_SIZE or len(fresh) < len(page):
+                    break
+                skip += self.PAGE_SIZE
+
+            if new_prs:
+                await self._index_prs(new_prs)
+
+            self._execute(
+                "INSERT OR REPLACE INTO index_state (repo_id, refreshed_at) VALUES (?, ?)",
+                (self.repository, time.time())
+            )
+            logger.info(f"📇 Индекс PR {self.project}/{self.repository}: добавлено {len(new_prs)}, всего {len(known) + len(new_prs)}")
+            return len(new_prs)
+
+    async def _index_prs(self, prs: List[Dict]):
+        semaphore = asyncio.Semaphore(self.FETCH_CONCURRENCY)
+
+        async def _work_item_refs(pr_id: int) -> Set[int]:
+            async with semaphore:
+                try:
+                    response = await self.tfs_service.get(
+                        f"{self._repo_url}/pullrequests/{pr_id}/workitems", params={"api-version": "4.1"}
+                    )
+                    if response.status_code == 200:
+                        return {int(ref["id"]) for ref in response.json().get("value", []) if ref.get("id")}
+                except Exception as e:
+                    logger.debug(f"Не удалось получить workItemRefs PR {pr_id}: {e}")
+                return set()
+
+        refs_list = await asyncio.gather(*[_work_item_refs(pr["pullRequestId"]) for pr in prs])
+
+        pr_rows, link_rows = [], []
+        for pr, refs in zip(prs, refs_list):
+            pr_id = pr["pullRequestId"]
+            title = pr.get("title", "")
+            description = pr.get("description", "")
+            pr_rows.append((self.repository, pr_id, title, description, self._web_url(pr), pr.get("closedDate")))
+            link_rows.extend((self.repository, pr_id, wid, "ref") for wid in refs)
+            link_rows.extend((self.repository, pr_id, wid, "text")
+                             for wid in extract_work_item_mentions(title, description) - refs)
+
+        self._executemany(
+            "INSERT OR REPLACE INTO pull_requests (repo_id, pr_id, title, description, url, closed_date) "
+            "VALUES (?, ?, ?, ?, ?, ?)", pr_rows
+        )
+        self._executemany(
+            "INSERT OR IGNORE INTO pr_work_items (repo_id, pr_id, work_item_id, source) VALUES (?, ?, ?, ?)",
+            link_rows
+        )
+
+    async def run_periodic(self, interval: float = None):
+        """Фоновое обновление индекса (первое - сразу после старта)"""
+        interval = interval or settings.PR_INDEX_REFRESH_INTERVAL
+        while True:
+            try:
+                await self.refresh(force=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Фоновое обновление индекса PR завершилось ошибкой: {e}")
+            await asyncio.sleep(interval)
+
+    def _web_url(self, pr: Dict) -> str:
+        repository = pr.get("repository") or {}
+        repo_name = repository.get("name") or self.repository
+        project_name = (repository.get("project") or {}).get("name") or self.project
+        return f"{settings.TFS_URL.rstrip('/')}/{project_name}/_git/{repo_name}/pullrequest/{pr['pullRequestId']}"
+
+    # --- Файлы PR ---
+
+    async def get_pr_files(self, pr_id: int) -> Optional[List[str]]:
+        """Измененные файлы PR (загружаются один раз); None - если TFS их не вернул"""
+        row = self._execute(
+            "SELECT files_fetched FROM pull_requests WHERE repo_id = ? AND pr_id = ?", (self.repository, pr_id)
+        )
+        if row and row[0][0]:
+            return [r[0] for r in self._execute(
+                "SELECT path FROM pr_files WHERE repo_id = ? AND pr_id = ?", (self.repository, pr_id)
+            )]
+
+        files = await self._fetch_pr_files(pr_id)
+        if files is not None:
+            self._executemany(
+                "INSERT INTO pr_files (repo_id, pr_id, path) VALUES (?, ?, ?)",
+                [(self.repository, pr_id, path) for path in files]
+            )
+            self._execute(
+                "UPDATE pull_requests SET files_fetched = 1 WHERE repo_id = ? AND pr_id = ?",
+                (self.repository, pr_id)
+            )
+        return files
+
+    async def _fetch_pr_files(self, pr_id: int) -> Optional[List[str]]:
+        """Изменения последней итерации PR"""
+        try:
+            response = await self.tfs_service.get(
+                f"{self._repo_url}/pullrequests/{pr_id}/iterations", params={"api-version": "4.1"}
+            )
+            if response.status_code != 200:
+                return None
+            iterations = response.json().get("value", [])
+            if not iterations:
+                return []
+            last_iteration = max(iteration["id"] for iteration in iterations)
+
+            response = await self.tfs_service.get(
+                f"{self._repo_url}/pullrequests/{pr_id}/iterations/{last_iteration}/changes",
+                params={"api-version": "4.1", "$top": 2000, "$compareTo": 0}
+            )
+            if response.status_code != 200:
+                return None
+            return [
+                change.get("item", {}).get("path", "")
+                for change in response.json().get("changeEntries", [])
+                if change.get("item", {}).get("path")
+            ]
+        except Exception as e:
+            logger.debug(f"Не удалось получить изменения PR {pr_id}: {e}")
+            return None
+
+    # --- Поиск ---
+
+    def find_prs(self, work_item_ids: Iterable[int]) -> List[Dict]:
+        """PR, связанные с Work Items (по workItemRefs или упоминанию)"""
+        ids = sorted({int(wid) for wid in work_item_ids})
+        if not ids:
+            return []
+        placeholders = ", ".join("?" for _ in ids)
+        rows = self._execute(
+            f"SELECT DISTINCT p.pr_id, p.title, p.description, p.url FROM pull_requests p "
+            f"JOIN pr_work_items w ON w.repo_id = p.repo_id AND w.pr_id = p.pr_id "
+            f"WHERE p.repo_id = ? AND w.work_item_id IN ({placeholders}) ORDER BY p.pr_id DESC",
+            [self.repository, *ids]
+        )
+        return [{"pr_id": r[0], "title": r[1] or "", "description": r[2] or "", "url": r[3]} for r in rows]
+
+    def find_pr_links(self, work_item_ids: Iterable[int]) -> Dict[str, Set[int]]:
+        """URL PR -> связанные с ним Work Items из переданных"""
+        ids = sorted({int(wid) for wid in work_item_ids})
+        if not ids:
+            return {}
+        placeholders = ", ".join("?" for _ in ids)
+        links: Dict[str, Set[int]] = {}
+        for url, work_item_id in self._execute(
+            f"SELECT p.url, w.work_item_id FROM pull_requests p "
+            f"JOIN pr_work_items w ON w.repo_id = p.repo_id AND w.pr_id = p.pr_id "
+            f"WHERE p.repo_id = ? AND w.work_item_id IN ({placeholders})",
+            [self.repository, *ids]
+        ):
+            links.setdefault(url, set()).add(work_item_id)
+        return links
+
+    async def find_test_prs(self, work_item_ids: Iterable[int]) -> Dict[str, List[str]]:
+        """URL PR с тестовыми файлами -> найденные тестовые файлы (для PR без файлов - по ключевым словам)"""
+        result: Dict[str, List[str]] = {}
+        for pr in self.find_prs(work_item_ids):
+            files = await self.get_pr_files(pr["pr_id"])
+            if files is None:
+                text = f"{pr['title']} {pr['description']}".lower()
+                if any(keyword in text for keyword in TEST_TITLE_KEYWORDS):
+                    result[pr["url"]] = []
+                continue
+            test_files = [path for path in files if is_test_file(path)]
+            if test_files:
+                result[pr["url"]] = test_files
+        return result
+
+
+# Глобальный экземпляр индекса
+pull_request_index = PullRequestIndex()
@@ -0,0 +1,93 @@
+"""
+Объединение одинаковых одновременных запросов (singleflight): один вычисляющий вызов на ключ
+"""
+
+import asyncio
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """Выполняющийся вызов и число присоединившихся к нему ожидающих"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Группа объединяемых вызовов.
+
+    Пока вызов с ключом выполняется, повторные вызовы с тем же ключом не запускают свою
+    операцию, а ждут результат (или исключение) первого. Операция выполняется отдельной
+    задачей: отмена одного из ожидающих (например, при разрыве соединения клиентом) не
+    прерывает ее для остальных. copy_result - функция копирования изменяемого результата
+    для присоединившихся вызовов.
+    """
+
+    def __init__(self, name: str, copy_result: Optional[Callable[[Any], Any]] = None):
+        self.name = name
+        self._copy_result = copy_result
+        self._calls: Dict[Hashable, _Call] = {}
+        self._executions = 0
+        self._coalesced = 0
+        self._max_waiters = 0
+
+    async def do(self, key: Hashable, operation: Callable[[], Awaitable[Any]]) -> Any:
+        """Результат operation() для ключа; одновременные вызовы разделяют одно выполнение"""
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            call = _Call(asyncio.ensure_future(operation()))
+            self._calls[key] = call
+            self._executions += 1
+            call.task.add_done_callback(lambda task, key=key, call=call: self._finish(key, call))
+        else:
+            call.waiters += 1
+            self._coalesced += 1
+            self._max_waiters = max(self._max_waiters, call.waiters)
+            logger.debug(f"🔗 [{self.name}] Запрос {key} присоединен к выполняющемуся ({call.waiters} ожидающих)")
+
+        result = await asyncio.shield(call.task)
+        if leader or self._copy_result is None or result is None:
+            return result
+        return self._copy_result(result)
+
+    def _finish(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Исключение считается полученным, даже если все ожидающие были отменены
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для /api/v1/status"""
+        return {
+            "in_flight": len(self._calls),
+            "waiters": sum(call.waiters for call in self._calls.values()),
+            "executions": self._executions,
+            "coalesced": self._coalesced,
+            "max_waiters": self._max_waiters,
+        }
+
+
+# Группы объединяемых вызовов по операциям
+checklist_flight = SingleFlight("checklists", copy_result=dict)
+work_item_flight = SingleFlight("work_items", copy_result=lambda work_item: work_item.model_copy())
+confluence_article_flight = SingleFlight("confluence_articles", copy_result=lambda article: article.model_copy())
+# Разбор страницы общий, предпросмотр (dict) копируется: сессии и ответы у вызывающих свои
+user_story_preview_flight = SingleFlight(
+    "user_story_previews", copy_result=lambda result: (result[0], copy.deepcopy(result[1]))
+)
+
+
+def singleflight_stats() -> Dict[str, Dict[str, Any]]:
+    """Счетчики всех групп"""
+    return {
+        flight.name: flight.stats()
+        for flight in (checklist_flight, work_item_flight, confluence_article_flight, user_story_preview_flight)
+    }
@@ -0,0 +1,379 @@
+"""
+Локальный индекс тест-планов (SQLite): Work Item -> тест-планы, наборы и тестовые случаи
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.config.settings import settings
+from app.services.tfs_service import TFSService
+
+logger = logging.getLogger(__name__)
+
+# Связь тестового случая с проверяемым требованием ("Tests" / "Тесты")
+TESTS_LINK_TYPE = "Microsoft.VSTS.Common.TestedBy-Reverse"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS test_plans (
+    project TEXT NOT NULL,
+    plan_id INTEGER PRIMARY KEY,
+    name TEXT,
+    revision TEXT
+);
+CREATE TABLE IF NOT EXISTS test_suites (
+    plan_id INTEGER NOT NULL,
+    suite_id INTEGER NOT NULL,
+    name TEXT,
+    requirement_id INTEGER,
+    revision TEXT,
+    PRIMARY KEY (plan_id, suite_id)
+);
+CREATE INDEX IF NOT EXISTS idx_test_suites_req ON test_suites (requirement_id);
+CREATE TABLE IF NOT EXISTS suite_cases (
+    plan_id INTEGER NOT NULL,
+    suite_id INTEGER NOT NULL,
+    case_id INTEGER NOT NULL,
+    PRIMARY KEY (plan_id, suite_id, case_id)
+);
+CREATE INDEX IF NOT EXISTS idx_suite_cases_case ON suite_cases (case_id);
+CREATE TABLE IF NOT EXISTS case_requirements (
+    case_id INTEGER NOT NULL,
+    requirement_id INTEGER NOT NULL,
+    PRIMARY KEY (case_id, requirement_id)
+);
+CREATE INDEX IF NOT EXISTS idx_case_requirements_req ON case_requirements (requirement_id);
+CREATE TABLE IF NOT EXISTS index_state (
+    project TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL,
+    rebuilt_at REAL
+);
+"""
+
+# Столбцы, добавленные после первой версии схемы: (таблица, столбец, тип)
+_ADDED_COLUMNS = [("test_suites", "revision", "TEXT"), ("index_state", "rebuilt_at", "REAL")]
+
+
+def _relation_target_id(url: str) -> Optional[int]:
+    try:
+        return int(url.rstrip('/').rsplit('/', 1)[-1])
+    except (AttributeError, ValueError):
+        return None
+
+
+class TestPlanIndex:
+    """
+    Индекс тест-планов проектов: наборы на основе требований (requirementId) и
+    тестовые случаи со связью "Tests" на требования.
+
+    При обновлении запрашиваются список планов и наборы каждого плана, а тестовые случаи и их
+    связи "Tests" загружаются заново только для новых и измененных наборов (по revision набора:
+    ревизия плана при добавлении наборов и тестовых случаев не меняется). Связи "Tests" у
+    тестовых случаев неизмененных наборов перечитываются при полном перестроении раз в
+    TEST_PLAN_INDEX_FULL_REBUILD_INTERVAL. Обновление выполняется только фоновой задачей,
+    поиск для чек-листа - локальный запрос к SQLite.
+    """
+
+    PAGE_SIZE = 200
+    FETCH_CONCURRENCY = 5
+
+    def __init__(self, tfs_service: TFSService = None, projects: List[str] = None, db_path: str = None):
+        self.tfs_service = tfs_service or TFSService()
+        self.projects = projects or [
+            project.strip() for project in settings.TEST_PLAN_INDEX_PROJECTS.split(",") if project.strip()
+        ]
+        self.db_path = db_path or settings.TEST_PLAN_INDEX_DB_PATH
+        self._db_lock = threading.Lock()
+        self._refresh_lock = asyncio.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+            for table, column, column_type in _ADDED_COLUMNS:
+                columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            self._conn.commit()
+        return self._conn
+
+    def _execute(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        with self._db_lock:
+            conn = self._connect()
+            rows = conn.execute(sql, tuple(params)).fetchall()
+            conn.commit()
+            return rows
+
+    def _executemany(self, sql: str, rows: List[tuple]):
+        if not rows:
+            return
+        with self._db_lock:
+            conn = self._connect()
+            conn.executemany(sql, rows)
+            conn.commit()
+
+    def _test_api_url(self, project: str) -> str:
+        return f"{self.tfs_service.base_url}/{project}/_apis/test"
+
+    # --- Обновление индекса ---
+
+    async def refresh(self, force: bool = False, full: bool = False) -> int:
+        """
+        Инкрементальное обновление всех проектов (full - полное перестроение);
+        возвращает количество планов с изменениями
+        """
+        async with self._refresh_lock:
+            updated = 0
+            for project in self.projects:
+                try:
+                    updated += await self._refresh_project(project, force, full)
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось обновить индекс тест-планов {project}: {e}")
+            return updated
+
+    async def _refresh_project(self, project: str, force: bool, full: bool = False) -> int:
+        state = self._execute("SELECT refreshed_at, rebuilt_at FROM index_state WHERE project = ?", (project,))
+        now = time.time()
+        if state and not force and now - state[0][0] < settings.TEST_PLAN_INDEX_REFRESH_INTERVAL:
+            return 0
+        rebuilt_at = state[0][1] if state else None
+        full = full or not rebuilt_at or now - rebuilt_at >= settings.TEST_PLAN_INDEX_FULL_REBUILD_INTERVAL
+
+        plans = await self._fetch_plans(project)
+        if plans is None:
+            return 0
+
+        known = {row[0] for row in self._execute("SELECT plan_id FROM test_plans WHERE project = ?", (project,))}
+        current = {plan["id"]: str(plan.get("revision") or plan.get("updatedDate") or "") for plan in plans}
+
+        removed = [plan_id for plan_id in known if plan_id not in current]
+        for plan_id in removed:
+            self._delete_plan(plan_id)
+
+        semaphore = asyncio.Semaphore(self.FETCH_CONCURRENCY)
+        case_ids: Set[int] = set()
+        changed_plans = 0
+
+        async def _index(plan: Dict):
+            nonlocal changed_plans
+            async with semaphore:
+                changed_cases = await self._index_plan(project, plan, current[plan["id"]], full)
+            if changed_cases is not None:
+                changed_plans += 1
+                case_ids.update(changed_cases)
+
+        await asyncio.gather(*[_index(plan) for plan in plans])
+
+        if full:
+            # Связи "Tests" могли измениться у любого тестового случая, а не только в измененных наборах
+            case_ids.update(row[0] for row in self._execute(
+                "SELECT DISTINCT c.case_id FROM suite_cases c JOIN test_plans p ON p.plan_id = c.plan_id "
+                "WHERE p.project = ?", (project,)
+            ))
+        await self._index_case_requirements(case_ids)
+        if full:
+            self._execute("DELETE FROM case_requirements WHERE case_id NOT IN (SELECT case_id FROM suite_cases)")
+
+        self._execute(
+            "INSERT OR REPLACE INTO index_state (project, refreshed_at, rebuilt_at) VALUES (?, ?, ?)",
+            (project, now, now if full else rebuilt_at)
+        )
+        logger.info(f"🧪 Индекс тест-планов {project}{' (полное перестроение)' if full else ''}: "
+                    f"планов {len(current)}, с изменениями {changed_plans}, удалено {len(removed)}, "
+                    f"тестовых случаев обновлено {len(case_ids)}")
+        return changed_plans
+
+    async def _fetch_plans(self, project: str) -> Optional[List[Dict]]:
+        plans: List[Dict] = []
+        skip = 0
+        while True:
+            response = await self.tfs_service.get(
+                f"{self._test_api_url(project)}/plans",
+                params={"api-version": "4.1", "$top": self.PAGE_SIZE, "$skip": skip}
+            )
+            if response.status_code != 200:
+                logger.warning(f"Не удалось получить тест-планы {project}: {response.status_code}")
+                return None
+            page = response.json().get("value", [])
+            plans.extend(plan for plan in page if plan.get("id"))
+            if len(page) < self.PAGE_SIZE:
+                return plans
+            skip += self.PAGE_SIZE
+
+    async def _index_plan(self, project: str, plan: Dict, revision: str, full: bool) -> Optional[Set[int]]:
+        """
+        Наборы плана и тестовые случаи новых и измененных наборов (full - всех наборов).
+        Возвращает ID тестовых случаев обновленных наборов или None, если план не изменился
+        """
+        plan_id = plan["id"]
+        response = await self.tfs_service.get(
+            f"{self._test_api_url(project)}/plans/{plan_id}/suites", params={"api-version": "4.1"}
+        )
+        if response.status_code != 200:
+            logger.debug(f"Не удалось получить наборы плана {plan_id}: {response.status_code}")
+            return None
+        suites = [suite for suite in response.json().get("value", []) if suite.get("id")]
+
+        known = {row[0]: row[1] for row in self._execute(
+            "SELECT suite_id, revision FROM test_suites WHERE plan_id = ?", (plan_id,)
+        )}
+        plan_known = self._execute("SELECT revision FROM test_plans WHERE plan_id = ?", (plan_id,))
+        suite_revisions = {
+            suite["id"]: str(suite.get("revision") or suite.get("lastUpdatedDate") or "") for suite in suites
+        }
+        changed = [
+            suite for suite in suites
+            if full or not suite_revisions[suite["id"]] or known.get(suite["id"]) != suite_revisions[suite["id"]]
+        ]
+        removed = [suite_id for suite_id in known if suite_id not in suite_revisions]
+        if not changed and not removed and plan_known and plan_known[0][0] == revision:
+            return None
+
+        # Планы обрабатываются параллельно, наборы внутри плана - последовательно
+        cases_by_suite: Dict[int, List[int]] = {}
+        for suite in changed:
+            cases = await self._fetch_suite_cases(project, plan_id, suite["id"])
+            if cases is None:
+                # Ревизия набора не сохраняется: он будет загружен снова при следующем обновлении
+                suite_revisions[suite["id"]] = known.get(suite["id"])
+                continue
+            cases_by_suite[suite["id"]] = cases
+
+        self._execute(
+            "INSERT OR REPLACE INTO test_plans (project, plan_id, name, revision) VALUES (?, ?, ?, ?)",
+            (project, plan_id, plan.get("name", ""), revision)
+        )
+        for suite_id in removed:
+            self._execute("DELETE FROM test_suites WHERE plan_id = ? AND suite_id = ?", (plan_id, suite_id))
+            self._execute("DELETE FROM suite_cases WHERE plan_id = ? AND suite_id = ?", (plan_id, suite_id))
+        self._executemany(
+            "INSERT OR REPLACE INTO test_suites (plan_id, suite_id, name, requirement_id, revision) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(plan_id, suite["id"], suite.get("name", ""), suite.get("requirementId"), suite_revisions[suite["id"]])
+             for suite in suites]
+        )
+        self._executemany(
+            "DELETE FROM suite_cases WHERE plan_id = ? AND suite_id = ?",
+            [(plan_id, suite_id) for suite_id in cases_by_suite]
+        )
+        self._executemany(
+            "INSERT OR IGNORE INTO suite_cases (plan_id, suite_id, case_id) VALUES (?, ?, ?)",
+            [(plan_id, suite_id, case_id) for suite_id, cases in cases_by_suite.items() for case_id in cases]
+        )
+        return {case_id for cases in cases_by_suite.values() for case_id in cases}
+
+    async def _fetch_suite_cases(self, project: str, plan_id: int, suite_id: int) -> Optional[List[int]]:
+        """ID тестовых случаев набора (None - не удалось получить)"""
+        try:
+            response = await self.tfs_service.get(
+                f"{self._test_api_url(project)}/plans/{plan_id}/suites/{suite_id}/testcases",
+                params={"api-version": "4.1"}
+            )
+            if response.status_code != 200:
+                return None
+            return [
+                int(case["testCase"]["id"])
+                for case in response.json().get("value", [])
+                if case.get("testCase", {}).get("id")
+            ]
+        except Exception as e:
+            logger.debug(f"Не удалось получить тестовые случаи набора {suite_id}: {e}")
+            return None
+
+    async def _index_case_requirements(self, case_ids: Set[int]):
+        """Связи "Tests" тестовых случаев (одним пакетным запросом)"""
+        if not case_ids:
+            return
+        work_items = await self.tfs_service.get_work_items_batch(sorted(case_ids), expand="relations")
+        rows = []
+        for work_item in work_items:
+            for relation in work_item.relations or []:
+                if relation.get("rel") != TESTS_LINK_TYPE:
+                    continue
+                requirement_id = _relation_target_id(relation.get("url", ""))
+                if requirement_id is not None:
+                    rows.append((work_item.id, requirement_id))
+
+        fetched = [(work_item.id,) for work_item in work_items]
+        self._executemany("DELETE FROM case_requirements WHERE case_id = ?", fetched)
+        self._executemany(
+            "INSERT OR IGNORE INTO case_requirements (case_id, requirement_id) VALUES (?, ?)", rows
+        )
+
+    def _delete_plan(self, plan_id: int):
+        for table in ("test_plans", "test_suites", "suite_cases"):
+            self._execute(f"DELETE FROM {table} WHERE plan_id = ?", (plan_id,))
+
+    async def run_periodic(self, interval: float = None):
+        """Фоновое обновление индекса (первое - сразу после старта)"""
+        interval = interval or settings.TEST_PLAN_INDEX_REFRESH_INTERVAL
+        while True:
+            try:
+                await self.refresh(force=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Фоновое обновление индекса тест-планов завершилось ошибкой: {e}")
+            await asyncio.sleep(interval)
+
+    # --- Поиск ---
+
+    def is_built(self) -> bool:
+        return bool(self._execute("SELECT 1 FROM index_state LIMIT 1"))
+
+    def find_tests(self, work_item_ids: Iterable[int]) -> Dict[str, List[Dict]]:
+        """Наборы на основе требований и тестовые случаи со связью "Tests" для Work Items"""
+        ids = sorted({int(wid) for wid in work_item_ids})
+        if not ids:
+            return {"suites": [], "cases": []}
+        placeholders = ", ".join("?" for _ in ids)
+        suites = self._execute(
+            f"SELECT s.plan_id, s.suite_id, s.name, p.name, s.requirement_id FROM test_suites s "
+            f"JOIN test_plans p ON p.plan_id = s.plan_id WHERE s.requirement_id IN ({placeholders}) "
+            f"ORDER BY s.plan_id, s.suite_id", ids
+        )
+        cases = self._execute(
+            f"SELECT DISTINCT case_id, requirement_id FROM case_requirements "
+            f"WHERE requirement_id IN ({placeholders}) ORDER BY case_id", ids
+        )
+        return {
+            "suites": [{"plan_id": r[0], "suite_id": r[1], "suite_name": r[2] or "", "plan_name": r[3] or "",
+                        "requirement_id": r[4]} for r in suites],
+            "cases": [{"case_id": r[0], "requirement_id": r[1]} for r in cases],
+        }
+
+    async def find_test_urls(self, work_item_ids: Iterable[int]) -> Set[str]:
+        """URL тест-планов (с набором) и тестовых случаев"""
+        urls: Set[str] = set()
+        for work_item_urls in (await self.find_test_urls_by_work_item(work_item_ids)).values():
+            urls.update(work_item_urls)
+        return urls
+
+    async def find_test_urls_by_work_item(self, work_item_ids: Iterable[int]) -> Dict[int, Set[str]]:
+        """
+        URL тест-планов и тестовых случаев по каждому Work Item (один запрос на все ID).
+        Пока фоновая задача не построила индекс, результат пустой: загрузка тест-планов
+        в обработке запроса заняла бы минуты
+        """
+        if not self.is_built():
+            logger.debug("Индекс тест-планов еще не построен")
+            return {}
+        found = self.find_tests(work_item_ids)
+        result: Dict[int, Set[str]] = {}
+        for suite in found["suites"]:
+            result.setdefault(suite["requirement_id"], set()).add(
+                f"{settings.TFS_URL}/_testPlans/execute?planId={suite['plan_id']}&suiteId={suite['suite_id']}"
+            )
+        for case in found["cases"]:
+            result.setdefault(case["requirement_id"], set()).add(f"{settings.TFS_URL}/_workitems/edit/{case['case_id']}")
+        return result
+
+
+# Глобальный экземпляр индекса
+test_plan_index = TestPlanIndex()
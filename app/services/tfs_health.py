@@ -0,0 +1,194 @@
+"""
+Состояние подключения к TFS: однократное определение адреса API и фоновая проверка доступности
+"""
+
+import asyncio
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TFSHealthMonitor:
+    """
+    Кэшированный статус подключения к TFS.
+
+    Перебор вариантов адреса (коллекция, версия API) выполняется один раз - при старте или
+    после реального сбоя запроса к TFS. Найденные адрес и версия API сохраняются на диск и
+    используются при следующем запуске. Обработчики запросов читают статус без сетевых вызовов,
+    а фоновая задача периодически проверяет доступность одним легким запросом.
+    """
+
+    def __init__(self, state_path: str = None):
+        self.state_path = state_path or settings.TFS_CONNECTION_STATE_PATH
+        self.connected: Optional[bool] = None
+        self.base_url: Optional[str] = None
+        self.api_version: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.discovered_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.failures = 0
+        self._needs_probe = True
+        self._lock = asyncio.Lock()
+        self._recovery_listeners: List[Callable[[], None]] = []
+        self._load_state()
+
+    def add_recovery_listener(self, listener: Callable[[], None]):
+        """Вызывается после восстановления подключения или смены адреса API"""
+        self._recovery_listeners.append(listener)
+
+    def _notify_recovery(self):
+        for listener in self._recovery_listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка обработчика восстановления подключения TFS: {e}")
+
+    # --- Сохраненное состояние ---
+
+    def _load_state(self):
+        try:
+            path = Path(self.state_path)
+            if not path.exists():
+                return
+            state = json.loads(path.read_text(encoding="utf-8"))
+            # Сохраненный адрес действителен только для того же TFS_URL
+            if state.get("configured_url") != settings.TFS_URL.rstrip('/'):
+                return
+            self.base_url = state.get("base_url")
+            self.api_version = state.get("api_version")
+            self.discovered_at = state.get("discovered_at")
+            logger.info(f"📂 Загружен сохраненный адрес TFS: {self.base_url} (api-version {self.api_version})")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось прочитать состояние подключения TFS: {e}")
+
+    def _save_state(self):
+        try:
+            path = Path(self.state_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps({
+                "configured_url": settings.TFS_URL.rstrip('/'),
+                "base_url": self.base_url,
+                "api_version": self.api_version,
+                "discovered_at": self.discovered_at,
+            }, ensure_ascii=False, indent=2), encoding="utf-8")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить состояние подключения TFS: {e}")
+
+    # --- Проверки ---
+
+    def is_available(self) -> bool:
+        """Последний известный статус (без сетевых запросов)"""
+        return bool(self.connected)
+
+    async def ensure(self, discover: Callable[[], Awaitable[Optional[Dict[str, str]]]],
+                     check: Callable[[str, str], Awaitable[bool]], force: bool = False) -> bool:
+        """
+        Статус подключения; сеть используется только при первом обращении, после сбоя или force.
+
+        discover() перебирает варианты адреса и возвращает {"base_url", "api_version"} или None;
+        check(base_url, api_version) - один легкий запрос к уже известному адресу.
+        """
+        if not force and not self._needs_probe and self.connected is not None:
+            return self.connected
+
+        async with self._lock:
+            if not force and not self._needs_probe and self.connected is not None:
+                return self.connected
+
+            if self.base_url and await self._safe_check(check):
+                self._mark(True)
+                return True
+
+            try:
+                found = await discover()
+            except Exception as e:
+                found = None
+                self.last_error = str(e)
+            if found:
+                address_changed = self.base_url is not None and found["base_url"] != self.base_url
+                self.base_url = found["base_url"]
+                self.api_version = found.get("api_version")
+                self.discovered_at = time.time()
+                self._save_state()
+                self._mark(True)
+                if address_changed:
+                    self._notify_recovery()
+            else:
+                self._mark(False, self.last_error or "All TFS URL formats failed")
+            return bool(self.connected)
+
+    async def refresh(self, check: Callable[[str, str], Awaitable[bool]]) -> bool:
+        """Периодическая проверка известного адреса; при неудаче следующий запрос выполнит полный перебор"""
+        if not self.base_url:
+            return False
+        ok = await self._safe_check(check)
+        if ok:
+            self._mark(True)
+        else:
+            self.report_failure(self.last_error or "health check failed")
+        return ok
+
+    async def _safe_check(self, check: Callable[[str, str], Awaitable[bool]]) -> bool:
+        try:
+            return await check(self.base_url, self.api_version or "4.1")
+        except Exception as e:
+            self.last_error = str(e)
+            return False
+
+    def _mark(self, connected: bool, error: str = None):
+        recovered = connected and self.connected is False
+        if recovered:
+            logger.info("✅ Подключение к TFS восстановлено")
+        self.connected = connected
+        self.checked_at = time.time()
+        self._needs_probe = not connected
+        if connected:
+            self.failures = 0
+            self.last_error = None
+        else:
+            self.failures += 1
+            self.last_error = error
+        if recovered:
+            self._notify_recovery()
+
+    def report_failure(self, error: str):
+        """Сбой реального запроса к TFS: статус сбрасывается, следующая проверка пойдет в сеть"""
+        if not self._needs_probe:
+            logger.warning(f"⚠️ Сбой запроса к TFS, подключение будет перепроверено: {error}")
+        self._needs_probe = True
+        self.failures += 1
+        self.last_error = error
+
+    async def run_periodic(self, check: Callable[[str, str], Awaitable[bool]], interval: float = None):
+        """Фоновая проверка доступности TFS"""
+        interval = interval or settings.TFS_HEALTH_CHECK_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(check)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Фоновая проверка TFS завершилась ошибкой: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        """Статус для /api/v1/status"""
+        return {
+            "connected": self.connected,
+            "base_url": self.base_url,
+            "api_version": self.api_version,
+            "checked_at": self.checked_at,
+            "discovered_at": self.discovered_at,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+# Глобальный экземпляр (общий для всех экземпляров TFSService)
+tfs_health = TFSHealthMonitor()
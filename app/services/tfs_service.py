@@ -1,9 +1,10 @@
-import requests
+import httpx
 import json
 import base64
 import logging
 import asyncio
 from typing import List, Dict, Optional, Any
+from urllib.parse import quote, urlparse
 from datetime import datetime
 from app.config.settings import settings
 from app.models.request_models import UserStoryData, TaskData, ConfluenceArticle
@@ -12,6 +13,10 @@ from app.models.tfs_models import (
     WorkItemUpdateRequest, WorkItemLinkRequest, LinkType
 )
 from app.core.logging_config import log_tfs_operation
+from app.services.work_item_cache import work_item_cache
+from app.services.tfs_health import tfs_health
+from app.services.link_graph import link_graph
+from app.services.singleflight import work_item_flight
 
 logger = logging.getLogger(__name__)
 
@@ -27,18 +32,58 @@ class TFSRetryableError(Exception):
     """Временная ошибка, которую можно повторить"""
     pass
 
+class TFSBatchOutcomeUnknownError(Exception):
+    """
+    Результат $batch неизвестен (таймаут, обрыв соединения, ошибка сервера после отправки):
+    часть запросов могла быть выполнена, поэтому повторять их нельзя.
+    results - известные результаты первых запросов в порядке отправки
+    """
+    def __init__(self, message: str, results: List[Any]):
+        super().__init__(message)
+        self.results = results
+
+# Общий пул соединений для всех экземпляров TFSService
+_http_client: Optional[httpx.AsyncClient] = None
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Ленивое создание общего асинхронного HTTP-клиента с keep-alive"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        limits = httpx.Limits(
+            max_connections=settings.TFS_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.TFS_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.TFS_HTTP_KEEPALIVE_EXPIRY
+        )
+        _http_client = httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(settings.TFS_HTTP_TIMEOUT)
+        )
+    return _http_client
+
+async def close_http_client():
+    """Закрытие общего пула соединений (вызывается при остановке приложения)"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
 class TFSService:
     """Сервис для работы с TFS/Azure DevOps API"""
     
+    # Максимальное количество ID в одном batch-запросе TFS
+    WORK_ITEMS_BATCH_SIZE = 200
+    WORK_ITEMS_FALLBACK_CONCURRENCY = 5
+    # Максимальное количество запросов в одном вызове $batch
+    BATCH_REQUESTS_LIMIT = 200
+    # Ответы, которыми сервер отклоняет $batch целиком (запросы не выполнялись)
+    BATCH_REJECTED_STATUSES = (400, 404, 405)
+    
     def __init__(self):
         self.base_url = settings.TFS_URL.rstrip('/')
         self.pat = settings.TFS_PAT_TOKEN or settings.TFS_PAT or settings.TFS_TOKEN
         self.project = settings.TFS_PROJECT
         self.organization = settings.TFS_ORGANIZATION
         
-        # Создаем сессию с аутентификацией
-        self.session = requests.Session()
-        
         # Логируем информацию о токене для отладки
         logger.info(f"TFS Configuration:")
         logger.info(f"  - Base URL: {self.base_url}")
@@ -53,14 +98,68 @@ class TFSService:
         logger.info(f"  - Auth String: :{self.pat[:10]}...")
         logger.info(f"  - Encoded Auth: {encoded_auth[:20]}...")
         
-        self.session.headers.update({
+        # Общие заголовки без Content-Type: он задается отдельно для каждого запроса,
+        # поэтому параллельные запросы не влияют друг на друга
+        self.headers = {
             'Authorization': f'Basic {encoded_auth}',
-            'Content-Type': 'application/json-patch+json',
             'Accept': 'application/json'
-        })
+        }
+    
+    async def _request(self, method: str, url: str, params: Dict[str, Any] = None, json_body: Any = None,
+                       data: bytes = None, headers: Dict[str, str] = None, timeout: float = None) -> httpx.Response:
+        """Неблокирующий HTTP-запрос к TFS через общий пул соединений"""
+        request_headers = dict(self.headers)
+        if json_body is not None:
+            # Обычный JSON (например, WIQL) - не JSON Patch
+            request_headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            # Тело в виде байтов - JSON Patch документ для изменения Work Items
+            request_headers['Content-Type'] = 'application/json-patch+json'
+        if headers:
+            request_headers.update(headers)
+        
+        kwargs: Dict[str, Any] = {"params": params, "headers": request_headers}
+        if json_body is not None:
+            kwargs["content"] = json.dumps(json_body, ensure_ascii=False).encode('utf-8')
+        elif data is not None:
+            kwargs["content"] = data
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        
+        try:
+            response = await _get_http_client().request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            tfs_health.report_failure(f"{type(e).__name__}: {e}")
+            raise
+        if response.status_code in (502, 503, 504):
+            tfs_health.report_failure(f"HTTP {response.status_code}")
+        return response
     
-    async def test_connection(self) -> bool:
-        """Test connection to TFS/Azure DevOps"""
+    async def get(self, url: str, params: Dict[str, Any] = None, timeout: float = None) -> httpx.Response:
+        """GET-запрос к TFS"""
+        return await self._request("GET", url, params=params, timeout=timeout)
+
+    async def post_json(self, url: str, body: Any, params: Dict[str, Any] = None,
+                        timeout: float = None) -> httpx.Response:
+        """POST с телом application/json (WIQL, workitemsbatch)"""
+        return await self._request("POST", url, params=params, json_body=body, timeout=timeout)
+
+    async def send_json_patch(self, method: str, url: str, patch_document: List[Dict[str, Any]],
+                              params: Dict[str, Any] = None, timeout: float = None) -> httpx.Response:
+        """POST/PATCH с телом application/json-patch+json (создание и изменение Work Items)"""
+        return await self._request(
+            method, url, params=params,
+            data=json.dumps(patch_document, ensure_ascii=False).encode('utf-8'),
+            timeout=timeout
+        )
+
+    async def test_connection(self, force: bool = False) -> bool:
+        """
+        Test connection to TFS/Azure DevOps.
+        
+        Статус кэшируется в tfs_health: перебор вариантов адреса выполняется при первом вызове,
+        после сбоя запроса к TFS или при force=True; в остальных случаях сетевых запросов нет.
+        """
         try:
             # Проверяем, что токен установлен
             if not self.pat:
@@ -68,80 +167,95 @@ class TFSService:
                 logger.error("   Проверьте переменные окружения: TFS_PAT_TOKEN, TFS_PAT или TFS_TOKEN")
                 return False
             
-            logger.info(f"🔑 Используется TFS PAT Token: {self.pat[:10]}...{self.pat[-4:]}")
-            
-            # Clean base URL and determine the correct format
-            base_url_clean = self.base_url.rstrip('/')
-            
-            # Try different URL formats for different TFS versions
-            test_urls = []
-            
-            # If URL already contains DefaultCollection, don't add it again
-            if "/DefaultCollection" in base_url_clean:
-                test_urls.extend([
-                    f"{base_url_clean}/_apis/projects",
-                    f"{base_url_clean}/_apis/projects?api-version=4.1"
-                ])
-            else:
-                # Try different collection formats
-                test_urls.extend([
-                    f"{base_url_clean}/_apis/projects",  # Modern Azure DevOps
-                    f"{base_url_clean}/DefaultCollection/_apis/projects",  # TFS 2017+
-                    f"{base_url_clean}/tfs/DefaultCollection/_apis/projects",  # TFS 2015-2017
-                    f"{base_url_clean}/_apis/projects?api-version=4.1",  # Older API version
-                    f"{base_url_clean}/DefaultCollection/_apis/projects?api-version=4.1",  # TFS with older API
-                    f"{base_url_clean}/tfs/DefaultCollection/_apis/projects?api-version=4.1",  # TFS 2015-2017 with older API
-                ])
-            
-            for url in test_urls:
-                # If URL already has api-version, use it; otherwise try different versions
-                if "api-version=" in url:
-                    params = {}
-                else:
-                    params = {"api-version": "4.1"}  # Start with older version
-                
-                try:
-                    logger.info(f"Testing TFS URL: {url}")
-                    response = self.session.get(url, params=params, timeout=10)
-                    
-                    if response.status_code == 200:
-                        logger.info(f"✅ TFS connection successful with URL: {url}")
-                        # Update base_url to the working format
-                        if "/DefaultCollection/" in url:
-                            self.base_url = url.split("/_apis/projects")[0]
-                        elif "/tfs/DefaultCollection/" in url:
-                            self.base_url = url.split("/_apis/projects")[0]
-                        return True
-                    elif response.status_code == 401:
-                        logger.warning(f"401 Unauthorized for URL: {url}")
-                        logger.warning(f"  Response headers: {dict(response.headers)}")
-                        logger.warning(f"  Response text: {response.text[:200]}...")
-                        continue
-                    elif response.status_code == 404:
-                        logger.warning(f"404 Not Found for URL: {url}")
-                        continue
-                    else:
-                        logger.warning(f"Status {response.status_code} for URL: {url}")
-                        continue
-                        
-                except requests.exceptions.RequestException as e:
-                    logger.warning(f"Request failed for URL {url}: {str(e)}")
-                    continue
-            
-            logger.error("All TFS URL formats failed")
-            return False
+            connected = await tfs_health.ensure(self._discover_connection, self._check_connection, force)
+            if connected and tfs_health.base_url:
+                self.base_url = tfs_health.base_url
+            return connected
             
         except Exception as e:
             logger.error(f"TFS connection test failed: {str(e)}")
             return False
     
+    async def _probe_get(self, url: str, params: Dict[str, Any]) -> httpx.Response:
+        """GET для проверки подключения (сбои не сбрасывают кэшированный статус)"""
+        return await _get_http_client().get(url, params=params, headers=self.headers, timeout=10)
+    
+    async def _check_connection(self, base_url: str, api_version: str) -> bool:
+        """Один легкий запрос к уже найденному адресу TFS"""
+        response = await self._probe_get(f"{base_url}/_apis/projects", {"api-version": api_version, "$top": 1})
+        return response.status_code == 200
+    
+    async def _discover_connection(self) -> Optional[Dict[str, str]]:
+        """Перебор вариантов адреса TFS; возвращает рабочие base_url и api-version"""
+        logger.info(f"🔑 Используется TFS PAT Token: {self.pat[:10]}...{self.pat[-4:]}")
+        
+        # Clean base URL and determine the correct format
+        base_url_clean = self.base_url.rstrip('/')
+        
+        # Try different URL formats for different TFS versions
+        test_urls = []
+        
+        # If URL already contains DefaultCollection, don't add it again
+        if "/DefaultCollection" in base_url_clean:
+            test_urls.extend([
+                f"{base_url_clean}/_apis/projects",
+                f"{base_url_clean}/_apis/projects?api-version=4.1"
+            ])
+        else:
+            # Try different collection formats
+            test_urls.extend([
+                f"{base_url_clean}/_apis/projects",  # Modern Azure DevOps
+                f"{base_url_clean}/DefaultCollection/_apis/projects",  # TFS 2017+
+                f"{base_url_clean}/tfs/DefaultCollection/_apis/projects",  # TFS 2015-2017
+                f"{base_url_clean}/_apis/projects?api-version=4.1",  # Older API version
+                f"{base_url_clean}/DefaultCollection/_apis/projects?api-version=4.1",  # TFS with older API
+                f"{base_url_clean}/tfs/DefaultCollection/_apis/projects?api-version=4.1",  # TFS 2015-2017 with older API
+            ])
+        
+        for url in test_urls:
+            # If URL already has api-version, use it; otherwise try different versions
+            if "api-version=" in url:
+                params = {}
+            else:
+                params = {"api-version": "4.1"}  # Start with older version
+            
+            try:
+                logger.info(f"Testing TFS URL: {url}")
+                response = await self._probe_get(url, params)
+                
+                if response.status_code == 200:
+                    logger.info(f"✅ TFS connection successful with URL: {url}")
+                    # Working base_url format and API version
+                    return {
+                        "base_url": url.split("/_apis/projects")[0],
+                        "api_version": params.get("api-version", "4.1")
+                    }
+                elif response.status_code == 401:
+                    logger.warning(f"401 Unauthorized for URL: {url}")
+                    logger.warning(f"  Response headers: {dict(response.headers)}")
+                    logger.warning(f"  Response text: {response.text[:200]}...")
+                    continue
+                elif response.status_code == 404:
+                    logger.warning(f"404 Not Found for URL: {url}")
+                    continue
+                else:
+                    logger.warning(f"Status {response.status_code} for URL: {url}")
+                    continue
+                    
+            except httpx.HTTPError as e:
+                logger.warning(f"Request failed for URL {url}: {str(e)}")
+                continue
+        
+        logger.error("All TFS URL formats failed")
+        return None
+
     async def get_projects(self) -> List[ProjectInfo]:
         """Получение списка проектов"""
         try:
             url = f"{self.base_url}/_apis/projects"
             params = {"api-version": "4.1"}
             
-            response = self.session.get(url, params=params)
+            response = await self._request("GET", url, params=params)
             response.raise_for_status()
             
             data = response.json()
@@ -160,7 +274,7 @@ class TFSService:
             logger.info(f"Получено {len(projects)} проектов")
             return projects
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при получении проектов: {str(e)}")
             raise TFSConnectionError(f"Ошибка подключения к TFS: {str(e)}")
     
@@ -172,76 +286,14 @@ class TFSService:
         url = f"{self.base_url}/{self.project}/_apis/wit/workitems/$User Story"
         params = {"api-version": "4.1"}
         
-        # Формируем описание User Story в простом формате
-        full_description = self._format_user_story_description(story_data)
-        
-        # Определяем название - используем title (название US)
-        if story_data.title and story_data.title.strip():
-            title = story_data.title.strip()
-        else:
-            title = story_data.user_story_text.strip() if story_data.user_story_text else "User Story"
-        
-        # Определяем область и итерацию - используем проверенные значения
-        if team and team.lower() == 'foxtrot':
-            area_path = "Houston\\Foxtrot"
-            iteration_path = "Houston\\Foxtrot"
-        else:
-            # Используем значения по умолчанию, которые точно существуют в TFS
-            area_path = "Houston\\Foxtrot"  # Проверенное значение
-            iteration_path = "Houston\\Foxtrot"  # Проверенное значение
-        
-        patch_document = [
-            # Основные обязательные поля
-            {"op": "add", "path": "/fields/System.Title", "value": title},
-            {"op": "add", "path": "/fields/System.Description", "value": full_description},
-            {"op": "add", "path": "/fields/System.State", "value": "Новый"},
-            
-            # Область и итерация на основе команды
-            {"op": "add", "path": "/fields/System.AreaPath", "value": area_path},
-            {"op": "add", "path": "/fields/System.IterationPath", "value": iteration_path},
-            
-            # Планирование
-            {"op": "add", "path": "/fields/Microsoft.VSTS.Common.Priority", "value": story_data.priority},
-            {"op": "add", "path": "/fields/Microsoft.VSTS.Scheduling.StoryPoints", "value": story_data.story_points or 5},
-            {"op": "add", "path": "/fields/Microsoft.VSTS.Common.BusinessValue", "value": 20},
-            
-            # Комментарий будет добавлен отдельно через add_comment
-        ]
-
-        # Поле "Проект внедрения" (если задано и не пусто)
-        if story_data.project and str(story_data.project).strip():
-            patch_document.insert(
-                7,  # вставляем после IterationPath/AreaPath блока
-                {"op": "add", "path": "/fields/ST.ImplementationProject", "value": str(story_data.project).strip()}
-            )
-        
-        # Критерии приемки в HTML формате
-        if story_data.acceptance_criteria or story_data.given_conditions:
-            acceptance_html = self._format_acceptance_criteria(story_data)
-            patch_document.append({
-                "op": "add",
-                "path": "/fields/Microsoft.VSTS.Common.AcceptanceCriteria",
-                "value": acceptance_html
-            })
-        
-        # Кастомные поля для команды (если есть в вашей конфигурации TFS)
-        if story_data.tech_lead:
-            patch_document.append({
-                "op": "add",
-                "path": "/fields/System.Tags", 
-                "value": f"tech-lead:{story_data.tech_lead}; " + ("; ".join(story_data.tags) if story_data.tags else "")
-            })
+        title, area_path, iteration_path, patch_document = self._build_user_story_patch(story_data, team)
         
         try:
             logger.info(f"Создание User Story: {story_data.title}")
             logger.info(f"   📍 AreaPath: {area_path}")
             logger.info(f"   📅 IterationPath: {iteration_path}")
             
-            response = self.session.post(
-                url, 
-                params=params,
-                data=json.dumps(patch_document, ensure_ascii=False).encode('utf-8')
-            )
+            response = await self.send_json_patch("POST", url, patch_document, params=params)
             response.raise_for_status()
             
             result = response.json()
@@ -288,15 +340,11 @@ class TFSService:
                     logger.error(f"❌ Ошибка создания связи с родительским тикетом #{story_data.parent_work_item_id}: {str(e)}")
             
             # Добавление комментария о создании
-            if confluence_url and confluence_url.strip() and confluence_url != "не указано":
-                comment = f"Создан автоматически приложением TCA из статьи:<br><a href=\"{confluence_url}\" target=\"_blank\">{confluence_url}</a>"
-            else:
-                comment = "Создан автоматически приложением TCA"
-            await self.add_comment(story_id, comment)
+            await self.add_comment(story_id, self._creation_comment(confluence_url))
             
             return story_id
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при создании User Story: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
                 error_text = e.response.text
@@ -340,11 +388,7 @@ class TFSService:
                             fallback_patch = _without_impl_project(patch_document)
                             logger.info("🔁 Повторная попытка без поля 'Проект внедрения'")
 
-                        response = self.session.post(
-                            url,
-                            params=params,
-                            data=json.dumps(fallback_patch, ensure_ascii=False).encode('utf-8')
-                        )
+                        response = await self.send_json_patch("POST", url, fallback_patch, params=params)
                         response.raise_for_status()
 
                         result = response.json()
@@ -382,11 +426,7 @@ class TFSService:
                         fallback_patch = [item for item in patch_document 
                                         if not (item.get("path") in ["/fields/System.AreaPath", "/fields/System.IterationPath"])]
                         
-                        response = self.session.post(
-                            url, 
-                            params=params,
-                            data=json.dumps(fallback_patch, ensure_ascii=False).encode('utf-8')
-                        )
+                        response = await self.send_json_patch("POST", url, fallback_patch, params=params)
                         response.raise_for_status()
                         
                         result = response.json()
@@ -422,6 +462,209 @@ class TFSService:
             
             raise Exception(f"Ошибка при создании User Story: {str(e)}")
 
+    def _build_user_story_patch(self, story_data: UserStoryData, team: str = None) -> tuple:
+        """JSON Patch документ новой User Story: (заголовок, AreaPath, IterationPath, документ)"""
+        
+        # Формируем описание User Story в простом формате
+        full_description = self._format_user_story_description(story_data)
+        
+        # Определяем название - используем title (название US)
+        if story_data.title and story_data.title.strip():
+            title = story_data.title.strip()
+        else:
+            title = story_data.user_story_text.strip() if story_data.user_story_text else "User Story"
+        
+        # Определяем область и итерацию - используем проверенные значения
+        if team and team.lower() == 'foxtrot':
+            area_path = "Houston\\Foxtrot"
+            iteration_path = "Houston\\Foxtrot"
+        else:
+            # Используем значения по умолчанию, которые точно существуют в TFS
+            area_path = "Houston\\Foxtrot"  # Проверенное значение
+            iteration_path = "Houston\\Foxtrot"  # Проверенное значение
+        
+        patch_document = [
+            # Основные обязательные поля
+            {"op": "add", "path": "/fields/System.Title", "value": title},
+            {"op": "add", "path": "/fields/System.Description", "value": full_description},
+            {"op": "add", "path": "/fields/System.State", "value": "Новый"},
+            
+            # Область и итерация на основе команды
+            {"op": "add", "path": "/fields/System.AreaPath", "value": area_path},
+            {"op": "add", "path": "/fields/System.IterationPath", "value": iteration_path},
+            
+            # Планирование
+            {"op": "add", "path": "/fields/Microsoft.VSTS.Common.Priority", "value": story_data.priority},
+            {"op": "add", "path": "/fields/Microsoft.VSTS.Scheduling.StoryPoints", "value": story_data.story_points or 5},
+            {"op": "add", "path": "/fields/Microsoft.VSTS.Common.BusinessValue", "value": 20},
+            
+            # Комментарий будет добавлен отдельно через add_comment
+        ]
+
+        # Поле "Проект внедрения" (если задано и не пусто)
+        if story_data.project and str(story_data.project).strip():
+            patch_document.insert(
+                7,  # вставляем после IterationPath/AreaPath блока
+                {"op": "add", "path": "/fields/ST.ImplementationProject", "value": str(story_data.project).strip()}
+            )
+        
+        # Критерии приемки в HTML формате
+        if story_data.acceptance_criteria or story_data.given_conditions:
+            acceptance_html = self._format_acceptance_criteria(story_data)
+            patch_document.append({
+                "op": "add",
+                "path": "/fields/Microsoft.VSTS.Common.AcceptanceCriteria",
+                "value": acceptance_html
+            })
+        
+        # Кастомные поля для команды (если есть в вашей конфигурации TFS)
+        if story_data.tech_lead:
+            patch_document.append({
+                "op": "add",
+                "path": "/fields/System.Tags", 
+                "value": f"tech-lead:{story_data.tech_lead}; " + ("; ".join(story_data.tags) if story_data.tags else "")
+            })
+        
+        return title, area_path, iteration_path, patch_document
+
+    def _parent_relation_op(self, parent_id: int) -> Dict[str, Any]:
+        """Операция JSON Patch для связи 'Родитель в backlog'"""
+        return {
+            "op": "add",
+            "path": "/relations/-",
+            "value": {
+                "rel": "ST.Backlog.LinkTypes.Hierarchy-Reverse",  # Родитель в backlog
+                "url": f"{self.base_url}/_apis/wit/workItems/{parent_id}",
+                "attributes": {
+                    "comment": f"Связан с родительским тикетом #{parent_id} из Confluence"
+                }
+            }
+        }
+
+    def _creation_comment(self, confluence_url: str = None) -> str:
+        """Комментарий о создании Work Item из статьи Confluence"""
+        if confluence_url and confluence_url.strip() and confluence_url != "не указано":
+            return f"Создан автоматически приложением TCA из статьи:<br><a href=\"{confluence_url}\" target=\"_blank\">{confluence_url}</a>"
+        return "Создан автоматически приложением TCA"
+
+    def batch_patch_request(self, method: str, url: str, patch_document: List[Dict[str, Any]],
+                            api_version: str = "4.1") -> Dict[str, Any]:
+        """Элемент запроса $batch: JSON Patch к Work Item (url - полный адрес ресурса)"""
+        path = quote(urlparse(url).path, safe="/$")
+        return {
+            "method": method,
+            "uri": f"{path}?api-version={api_version}",
+            "headers": {"Content-Type": "application/json-patch+json"},
+            "body": patch_document
+        }
+
+    async def execute_batch(self, requests: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Выполнение запросов к Work Items одним вызовом $batch (частями по BATCH_REQUESTS_LIMIT).
+        
+        Возвращает ответы в порядке запросов ({"code", "body"}) или None, если сервер отклонил
+        $batch (BATCH_REJECTED_STATUSES) до выполнения первой части - тогда запросы можно выполнить
+        по одному. Запросы независимы: ошибка одного не отменяет остальные.
+        
+        Если результат части неизвестен (таймаут или обрыв после отправки, другая ошибка сервера,
+        неполный ответ), выбрасывается TFSBatchOutcomeUnknownError с уже известными ответами:
+        запросы могли быть выполнены, и их повтор создал бы дубликаты.
+        """
+        url = f"{self.base_url}/_apis/wit/$batch"
+        results: List[Dict[str, Any]] = []
+        for i in range(0, len(requests), self.BATCH_REQUESTS_LIMIT):
+            chunk = requests[i:i + self.BATCH_REQUESTS_LIMIT]
+            try:
+                response = await self.post_json(url, chunk, params={"api-version": "4.1"})
+            except httpx.HTTPError as e:
+                raise TFSBatchOutcomeUnknownError(f"$batch прерван ({type(e).__name__}: {e})", results)
+            if response.status_code in self.BATCH_REJECTED_STATUSES:
+                logger.warning(f"⚠️ $batch отклонен ({response.status_code}): {response.text[:200]}")
+                if not results:
+                    return None
+                # Отклоненная часть не выполнялась - ее запросы не созданы
+                results.extend({"code": response.status_code, "body": None} for _ in chunk)
+                continue
+            if response.status_code != 200:
+                raise TFSBatchOutcomeUnknownError(
+                    f"$batch вернул {response.status_code}: {response.text[:200]}", results
+                )
+            
+            try:
+                values = response.json().get("value", [])
+            except ValueError as e:
+                raise TFSBatchOutcomeUnknownError(f"Некорректный ответ $batch: {e}", results)
+            for item in values[:len(chunk)]:
+                body = item.get("body")
+                if isinstance(body, str):
+                    try:
+                        body = json.loads(body)
+                    except ValueError:
+                        pass
+                results.append({"code": item.get("code"), "body": body})
+            if len(values) < len(chunk):
+                raise TFSBatchOutcomeUnknownError(
+                    f"$batch вернул {len(values)} ответов на {len(chunk)} запросов", results
+                )
+        return results
+
+    async def create_user_stories_batch(self, stories: List[UserStoryData], confluence_url: str = None,
+                                        team: str = None, parent_id: int = None) -> Optional[List[Optional[int]]]:
+        """
+        Создание нескольких User Stories одним $batch-запросом.
+        Связь с родителем и комментарий о создании входят в документ создания каждой User Story.
+        
+        Возвращает ID в порядке stories (None - для не созданных) или None, если $batch недоступен.
+        Если результат части запросов неизвестен - TFSBatchOutcomeUnknownError с ID уже известных.
+        """
+        url = f"{self.base_url}/{self.project}/_apis/wit/workitems/$User Story"
+        comment = self._creation_comment(confluence_url)
+        requests = []
+        for story_data in stories:
+            _, _, _, patch_document = self._build_user_story_patch(story_data, team)
+            if parent_id:
+                patch_document.append(self._parent_relation_op(parent_id))
+            patch_document.append({"op": "add", "path": "/fields/System.History", "value": comment})
+            requests.append(self.batch_patch_request("PATCH", url, patch_document))
+        
+        logger.info(f"📦 Создание {len(stories)} User Stories через $batch")
+        outcome_unknown = None
+        try:
+            results = await self.execute_batch(requests)
+        except TFSBatchOutcomeUnknownError as e:
+            outcome_unknown = e
+            results = e.results
+        if results is None:
+            return None
+        
+        story_ids: List[Optional[int]] = []
+        for story_data, result in zip(stories, results):
+            body = result.get("body")
+            if result.get("code") == 200 and isinstance(body, dict) and body.get("id"):
+                story_id = body["id"]
+                story_ids.append(story_id)
+                log_tfs_operation(
+                    logger=logger,
+                    operation="User Story создана",
+                    work_item_id=story_id,
+                    details={
+                        "title": story_data.title,
+                        "project": story_data.project,
+                        "parent_id": parent_id,
+                        "batch": True
+                    }
+                )
+            else:
+                message = body.get("value", body) if isinstance(body, dict) else body
+                logger.warning(f"⚠️ $batch: User Story '{story_data.title}' не создана ({result.get('code')}): {str(message)[:200]}")
+                story_ids.append(None)
+        
+        if parent_id and (any(story_ids) or outcome_unknown):
+            work_item_cache.invalidate(parent_id)
+        if outcome_unknown:
+            raise TFSBatchOutcomeUnknownError(str(outcome_unknown), story_ids)
+        return story_ids
+
     def _format_user_story_description(self, story_data: UserStoryData) -> str:
         """Форматирование полного описания User Story в HTML"""
         
@@ -494,35 +737,21 @@ class TFSService:
         params = {"api-version": "4.1"}
         
         # Patch для добавления связи с родительским элементом
-        patch_document = [
-            {
-                "op": "add",
-                "path": "/relations/-",
-                "value": {
-                    "rel": "ST.Backlog.LinkTypes.Hierarchy-Reverse",  # Родитель в backlog
-                    "url": f"{self.base_url}/_apis/wit/workItems/{parent_id}",
-                    "attributes": {
-                        "comment": f"Связан с родительским тикетом #{parent_id} из Confluence"
-                    }
-                }
-            }
-        ]
+        patch_document = [self._parent_relation_op(parent_id)]
         
         try:
             logger.info(f"🔗 Создание связи: User Story #{child_id} -> Родитель #{parent_id}")
             logger.info(f"   📋 URL: {url}")
             logger.info(f"   📋 Patch document: {json.dumps(patch_document, ensure_ascii=False, indent=2)}")
             
-            response = self.session.patch(
-                url,
-                params=params,
-                data=json.dumps(patch_document, ensure_ascii=False).encode('utf-8')
-            )
+            response = await self.send_json_patch("PATCH", url, patch_document, params=params)
             response.raise_for_status()
             
+            work_item_cache.invalidate(child_id)
+            work_item_cache.invalidate(parent_id)
             logger.info(f"✅ Связь с родительским тикетом #{parent_id} создана")
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"❌ Ошибка при создании связи с родительским тикетом #{parent_id}: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
                 logger.error(f"   📋 Статус ответа: {e.response.status_code}")
@@ -555,11 +784,7 @@ class TFSService:
                     "value": task_data.estimated_hours
                 })
             
-            response = self.session.post(
-                url,
-                params=params,
-                data=json.dumps(patch_document, ensure_ascii=False).encode('utf-8')
-            )
+            response = await self.send_json_patch("POST", url, patch_document, params=params)
             response.raise_for_status()
             
             result = response.json()
@@ -574,19 +799,116 @@ class TFSService:
                 logger.info(f"   ⏱️ Оценка времени: {task_data.estimated_hours} часов")
             return task_id
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при создании Task: {str(e)}")
             raise Exception(f"Ошибка при создании Task: {str(e)}")
 
+    def _parse_work_item(self, data: Dict[str, Any], work_item_id: int = None) -> WorkItemInfo:
+        """Преобразование JSON-ответа TFS в WorkItemInfo"""
+        fields = data.get("fields", {})
+        relations = data.get("relations", [])
+        
+        # Безопасное извлечение assigned_to
+        assigned_to = None
+        assigned_to_data = fields.get("System.AssignedTo")
+        if isinstance(assigned_to_data, dict):
+            assigned_to = assigned_to_data.get("displayName")
+        elif isinstance(assigned_to_data, str):
+            assigned_to = assigned_to_data
+        
+        # Безопасное извлечение created_by
+        created_by = None
+        created_by_data = fields.get("System.CreatedBy")
+        if isinstance(created_by_data, dict):
+            created_by = created_by_data.get("displayName")
+        elif isinstance(created_by_data, str):
+            created_by = created_by_data
+        
+        # Безопасное извлечение URL
+        url_data = None
+        links = data.get("_links", {})
+        if isinstance(links, dict):
+            html_data = links.get("html", {})
+            if isinstance(html_data, dict):
+                url_data = html_data.get("href")
+        
+        # Извлекаем информацию о проекте
+        project = fields.get("System.TeamProject", "Unknown")
+        
+        work_item = WorkItemInfo(
+            id=data.get("id", work_item_id),
+            work_item_type=fields.get("System.WorkItemType", ""),
+            title=fields.get("System.Title", ""),
+            state=fields.get("System.State", ""),
+            assigned_to=assigned_to,
+            created_by=created_by,
+            created_date=fields.get("System.CreatedDate"),
+            changed_date=fields.get("System.ChangedDate"),
+            url=url_data,
+            fields=fields,
+            relations=relations,
+            project=project
+        )
+        
+        return work_item
+
     async def get_work_item(self, work_item_id: int) -> WorkItemInfo:
-        """Получение информации о Work Item"""
+        """Получение информации о Work Item (через общий кэш с проверкой по System.Rev)"""
+        # Одновременные запросы одного Work Item ждут один запрос к TFS
+        return await work_item_flight.do(
+            (self.base_url, int(work_item_id)), lambda: self._get_work_item(work_item_id)
+        )
+
+    async def _get_work_item(self, work_item_id: int) -> WorkItemInfo:
+        key = work_item_cache.make_key(work_item_id, expand="relations")
+        entry, fresh = work_item_cache.lookup(key)
+        if entry is not None:
+            if fresh:
+                self._remember_links(key, entry.value)
+                return entry.value.model_copy()
+            revisions = await self._fetch_work_item_revisions([int(work_item_id)])
+            rev, changed_date = revisions.get(int(work_item_id), (None, None))
+            cached = work_item_cache.revalidate(key, rev, changed_date)
+            if cached is not None:
+                self._remember_links(key, cached)
+                return cached.model_copy()
+        
+        work_item = await self._fetch_work_item(work_item_id)
+        self._cache_work_item(key, work_item)
+        return work_item
+
+    def _cache_work_item(self, key, work_item: WorkItemInfo):
+        """Сохранение Work Item в общий кэш вместе с ревизией"""
+        fields = work_item.fields or {}
+        work_item_cache.put(key, work_item.model_copy(), fields.get("System.Rev"),
+                            fields.get("System.ChangedDate", work_item.changed_date))
+        self._remember_links(key, work_item)
+
+    def _remember_links(self, key, work_item: WorkItemInfo):
+        """Полный список связей - в граф связей (при той же ревизии запись не перестраивается)"""
+        if key[2] == "relations":
+            link_graph.update_from_item(work_item)
+
+    async def _fetch_work_item_revisions(self, work_item_ids: List[int]) -> Dict[int, tuple]:
+        """Облегченный запрос только System.Rev / System.ChangedDate для проверки кэша"""
+        revisions: Dict[int, tuple] = {}
+        for i in range(0, len(work_item_ids), self.WORK_ITEMS_BATCH_SIZE):
+            chunk = work_item_ids[i:i + self.WORK_ITEMS_BATCH_SIZE]
+            items = await self._fetch_work_items_chunk(chunk, ["System.Rev", "System.ChangedDate"])
+            for item in items or []:
+                fields = item.fields or {}
+                revisions[item.id] = (fields.get("System.Rev"), fields.get("System.ChangedDate"))
+        return revisions
+
+    async def _fetch_work_item(self, work_item_id: int) -> WorkItemInfo:
+        """Запрос Work Item к TFS без кэша"""
         try:
             url = f"{self.base_url}/_apis/wit/workitems/{work_item_id}"
             params = {"api-version": "4.1", "$expand": "relations"}
             
             logger.debug(f"Requesting work item {work_item_id} from URL: {url}")
             
-            response = self.session.get(url, params=params)
+            response = await self._request("GET", url, params=params)
             response.raise_for_status()
             
             # Проверяем content type
@@ -608,54 +930,9 @@ class TFSService:
                 logger.error(f"Data content: {str(data)[:200]}...")
                 raise Exception(f"Некорректный формат данных от TFS API")
             
-            fields = data.get("fields", {})
-            relations = data.get("relations", [])
-            
-            # Безопасное извлечение assigned_to
-            assigned_to = None
-            assigned_to_data = fields.get("System.AssignedTo")
-            if isinstance(assigned_to_data, dict):
-                assigned_to = assigned_to_data.get("displayName")
-            elif isinstance(assigned_to_data, str):
-                assigned_to = assigned_to_data
-            
-            # Безопасное извлечение created_by
-            created_by = None
-            created_by_data = fields.get("System.CreatedBy")
-            if isinstance(created_by_data, dict):
-                created_by = created_by_data.get("displayName")
-            elif isinstance(created_by_data, str):
-                created_by = created_by_data
-            
-            # Безопасное извлечение URL
-            url_data = None
-            links = data.get("_links", {})
-            if isinstance(links, dict):
-                html_data = links.get("html", {})
-                if isinstance(html_data, dict):
-                    url_data = html_data.get("href")
-            
-            # Извлекаем информацию о проекте
-            project = fields.get("System.TeamProject", "Unknown")
-            
-            work_item = WorkItemInfo(
-                id=data.get("id", work_item_id),
-                work_item_type=fields.get("System.WorkItemType", ""),
-                title=fields.get("System.Title", ""),
-                state=fields.get("System.State", ""),
-                assigned_to=assigned_to,
-                created_by=created_by,
-                created_date=fields.get("System.CreatedDate"),
-                changed_date=fields.get("System.ChangedDate"),
-                url=url_data,
-                fields=fields,
-                relations=relations,
-                project=project
-            )
-            
-            return work_item
+            return self._parse_work_item(data, work_item_id)
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при получении Work Item {work_item_id}: {str(e)}")
             raise Exception(f"Ошибка при получении Work Item: {str(e)}")
         except Exception as e:
@@ -666,6 +943,147 @@ class TFSService:
                 logger.error(f"Response data: {str(data)[:200]}...")
             raise Exception(f"Ошибка обработки Work Item: {str(e)}")
 
+    async def get_work_items_batch(self, work_item_ids: List[int], fields: List[str] = None,
+                                   expand: str = "relations", project: str = None) -> List[WorkItemInfo]:
+        """
+        Пакетное получение Work Items (до 200 элементов за запрос)
+        
+        Сначала используется запрос на уровне коллекции, при ошибке (cross-project ограничение
+        старых TFS) - запросы в рамках проектов, для оставшихся ID - индивидуальные запросы.
+        Результат возвращается в порядке запрошенных ID, ненайденные элементы пропускаются.
+        """
+        ordered_ids: List[int] = []
+        seen = set()
+        for wid in work_item_ids:
+            try:
+                wid = int(wid)
+            except (TypeError, ValueError):
+                continue
+            if wid not in seen:
+                seen.add(wid)
+                ordered_ids.append(wid)
+        
+        if not ordered_ids:
+            return []
+        
+        # TFS не позволяет одновременно указывать fields и $expand
+        if fields and expand:
+            fields = None
+        
+        found: Dict[int, WorkItemInfo] = {}
+        
+        # Свежие записи берем из кэша, устаревшие проверяем одним запросом ревизий
+        stale_ids: List[int] = []
+        for wid in ordered_ids:
+            entry, fresh = work_item_cache.lookup(work_item_cache.make_key(wid, fields, expand))
+            if entry is None:
+                continue
+            if fresh:
+                self._remember_links(work_item_cache.make_key(wid, fields, expand), entry.value)
+                found[wid] = entry.value.model_copy()
+            else:
+                stale_ids.append(wid)
+        if stale_ids:
+            revisions = await self._fetch_work_item_revisions(stale_ids)
+            for wid in stale_ids:
+                key = work_item_cache.make_key(wid, fields, expand)
+                cached = work_item_cache.revalidate(key, *revisions.get(wid, (None, None)))
+                if cached is not None:
+                    self._remember_links(key, cached)
+                    found[wid] = cached.model_copy()
+        
+        to_fetch = [wid for wid in ordered_ids if wid not in found]
+        fetched: Dict[int, WorkItemInfo] = {}
+        
+        for i in range(0, len(to_fetch), self.WORK_ITEMS_BATCH_SIZE):
+            chunk = to_fetch[i:i + self.WORK_ITEMS_BATCH_SIZE]
+            items = await self._fetch_work_items_chunk(chunk, fields, expand)
+            
+            if items is None:
+                # Fallback по проектам: batch API не работает для cross-project запросов
+                logger.info(f"Batch-запрос для {len(chunk)} элементов не удался, пробуем в рамках проектов")
+                for candidate_project in self._batch_fallback_projects(project):
+                    missing = [wid for wid in chunk if wid not in fetched]
+                    if not missing:
+                        break
+                    project_items = await self._fetch_work_items_chunk(missing, fields, expand, candidate_project)
+                    for item in project_items or []:
+                        fetched[item.id] = item
+            else:
+                for item in items:
+                    fetched[item.id] = item
+        
+        for wid, item in fetched.items():
+            self._cache_work_item(work_item_cache.make_key(wid, fields, expand), item)
+        found.update(fetched)
+        
+        # Оставшиеся элементы получаем индивидуально с ограничением параллелизма
+        missing = [wid for wid in ordered_ids if wid not in found]
+        if missing:
+            logger.info(f"Индивидуальная загрузка {len(missing)} Work Items после batch-запроса")
+            semaphore = asyncio.Semaphore(self.WORK_ITEMS_FALLBACK_CONCURRENCY)
+            
+            async def _fetch_single(wid: int) -> Optional[WorkItemInfo]:
+                async with semaphore:
+                    try:
+                        return await self.get_work_item(wid)
+                    except Exception as e:
+                        logger.debug(f"Не удалось получить Work Item {wid}: {e}")
+                        return None
+            
+            for item in await asyncio.gather(*[_fetch_single(wid) for wid in missing]):
+                if item is not None:
+                    found[item.id] = item
+        
+        logger.info(f"Пакетно получено {len(found)} из {len(ordered_ids)} Work Items")
+        return [found[wid] for wid in ordered_ids if wid in found]
+
+    def _batch_fallback_projects(self, project: str = None) -> List[str]:
+        """Список проектов для повторного batch-запроса"""
+        projects = []
+        for candidate in [project, self.project, settings.TFS_DEFAULT_PROJECT]:
+            if candidate and candidate not in projects:
+                projects.append(candidate)
+        return projects
+
+    async def _fetch_work_items_chunk(self, work_item_ids: List[int], fields: List[str] = None,
+                                      expand: str = None, project: str = None) -> Optional[List[WorkItemInfo]]:
+        """Один batch-запрос: workitemsbatch, затем workitems?ids=. None - если оба не сработали"""
+        scope = f"{self.base_url}/{project}" if project else self.base_url
+        
+        batch_body: Dict[str, Any] = {"ids": work_item_ids, "errorPolicy": "omit"}
+        if fields:
+            batch_body["fields"] = fields
+        if expand:
+            batch_body["$expand"] = expand
+        
+        try:
+            response = await self._request(
+                "POST", f"{scope}/_apis/wit/workitemsbatch",
+                params={"api-version": "4.1"}, json_body=batch_body
+            )
+            if response.status_code == 200:
+                return [self._parse_work_item(item) for item in response.json().get("value", []) if item]
+            logger.debug(f"workitemsbatch вернул статус {response.status_code}")
+        except httpx.HTTPError as e:
+            logger.debug(f"workitemsbatch недоступен: {e}")
+        
+        params: Dict[str, Any] = {"api-version": "4.1", "ids": ",".join(str(wid) for wid in work_item_ids)}
+        if fields:
+            params["fields"] = ",".join(fields)
+        if expand:
+            params["$expand"] = expand
+        
+        try:
+            response = await self._request("GET", f"{scope}/_apis/wit/workitems", params=params)
+            if response.status_code == 200:
+                return [self._parse_work_item(item) for item in response.json().get("value", []) if item]
+            logger.debug(f"workitems?ids= вернул статус {response.status_code}")
+        except httpx.HTTPError as e:
+            logger.debug(f"workitems?ids= недоступен: {e}")
+        
+        return None
+
     async def link_work_items(self, project_name: str, link_request: WorkItemLinkRequest) -> bool:
         """Связывание Work Items"""
         try:
@@ -686,19 +1104,17 @@ class TFSService:
                 }
             ]
             
-            response = self.session.patch(
-                url,
-                params=params,
-                data=json.dumps(patch_document, ensure_ascii=False).encode('utf-8')
-            )
+            response = await self.send_json_patch("PATCH", url, patch_document, params=params)
             response.raise_for_status()
             
+            work_item_cache.invalidate(link_request.source_work_item_id)
+            work_item_cache.invalidate(link_request.target_work_item_id)
             logger.info(f"✅ Связь создана: {link_request.source_work_item_id} -> {link_request.target_work_item_id}")
             logger.info(f"   🔗 Тип связи: {link_request.link_type.value}")
             logger.info(f"   💬 Комментарий: {link_request.comment or 'Связано автоматически'}")
             return True
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при создании связи: {str(e)}")
             return False
 
@@ -810,17 +1226,14 @@ class TFSService:
             if not patch_document:
                 raise ValueError("Нет полей для обновления")
             
-            response = self.session.patch(
-                url,
-                params=params,
-                data=json.dumps(patch_document, ensure_ascii=False).encode('utf-8')
-            )
+            response = await self.send_json_patch("PATCH", url, patch_document, params=params)
             response.raise_for_status()
             
+            work_item_cache.invalidate(work_item_id)
             logger.info(f"✅ Work Item {work_item_id} обновлен")
             return await self.get_work_item(work_item_id)
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при обновлении Work Item {work_item_id}: {str(e)}")
             raise Exception(f"Ошибка при обновлении Work Item: {str(e)}")
 
@@ -843,41 +1256,47 @@ class TFSService:
             url = f"{self.base_url}/_apis/wit/workitems/{work_item_id}"
             params = {"api-version": "4.1"}
 
-            def _patch(op: str) -> requests.Response:
+            async def _patch(op: str) -> httpx.Response:
                 doc = [{"op": op, "path": field_path, "value": value}]
-                return self.session.patch(
-                    url,
-                    params=params,
-                    data=json.dumps(doc, ensure_ascii=False).encode('utf-8')
-                )
+                return await self.send_json_patch("PATCH", url, doc, params=params)
+
+            work_item_cache.invalidate(work_item_id)
 
             # System.History всегда добавляем как новую запись
             if field_path == "/fields/System.History":
-                resp = _patch("add")
+                resp = await _patch("add")
                 resp.raise_for_status()
                 logger.info(f"✅ Поле {field_path} обновлено у Work Item {work_item_id}")
                 return True
 
             # Сначала пробуем add
-            resp = _patch("add")
+            resp = await _patch("add")
             if resp.status_code >= 200 and resp.status_code < 300:
                 logger.info(f"✅ Поле {field_path} обновлено у Work Item {work_item_id} (add)")
                 return True
 
             # Иначе пробуем replace
-            resp = _patch("replace")
+            resp = await _patch("replace")
             resp.raise_for_status()
             logger.info(f"✅ Поле {field_path} обновлено у Work Item {work_item_id} (replace)")
             return True
 
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"❌ Ошибка обновления поля {field_path} у Work Item {work_item_id}: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
                 logger.error(f"Детали ошибки: {e.response.text}")
             return False
 
     async def search_work_items(self, project_name: str, query: str = None, work_item_types: List[str] = None) -> List[WorkItemInfo]:
-        """Поиск Work Items"""
+        """Поиск Work Items (из локального зеркала, если оно синхронизировано для проекта)"""
+        # Локальный импорт: зеркало само использует TFSService
+        from app.services.work_item_mirror import work_item_mirror
+        if work_item_mirror.is_ready(project_name):
+            ids = work_item_mirror.search_text([query] if query else [], project_name, work_item_types, title_only=True)
+            work_items = work_item_mirror.get_work_items(ids)
+            logger.info(f"Найдено {len(work_items)} Work Items (локальное зеркало)")
+            return work_items
+        
         try:
             # Простой поиск по названию
             url = f"{self.base_url}/{project_name}/_apis/wit/wiql"
@@ -895,20 +1314,17 @@ class TFSService:
             
             data = {"query": wiql_query}
             
-            response = self.session.post(url, params=params, json=data)
+            response = await self._request("POST", url, params=params, json_body=data)
             response.raise_for_status()
             
             result = response.json()
-            work_items = []
-            
-            for item in result.get("workItems", []):
-                work_item = await self.get_work_item(item["id"])
-                work_items.append(work_item)
+            work_item_ids = [item["id"] for item in result.get("workItems", [])]
+            work_items = await self.get_work_items_batch(work_item_ids, project=project_name)
             
             logger.info(f"Найдено {len(work_items)} Work Items")
             return work_items
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка при поиске Work Items: {str(e)}")
             raise Exception(f"Ошибка при поиске Work Items: {str(e)}")
 
@@ -6,9 +6,15 @@ from datetime import datetime
 from bs4 import BeautifulSoup
 import html
 import uuid
+import copy
+import asyncio
 
+from app.config.settings import settings
 from app.services.confluence_service import confluence_service
-from app.services.tfs_service import tfs_service
+from app.services.tfs_service import tfs_service, TFSBatchOutcomeUnknownError
+from app.services.preview_session_store import preview_session_store, PreviewSession
+from app.services.singleflight import user_story_preview_flight
+from app.services.confluence_page_model import ConfluencePageModel, TableInfo, get_page_model, build_cell_matrix
 from app.core.logging_config import log_tfs_operation
 
 logger = logging.getLogger(__name__)
@@ -30,13 +36,16 @@ class UserStoryData:
 class ConfluencePageData:
     """Модель данных страницы Confluence"""
     def __init__(self, title: str, project: str, tfs_number: str, url: str, 
-                 user_stories: List[UserStoryData], team: str = None):
+                 user_stories: List[UserStoryData], team: str = None,
+                 page_id: str = None, version: Optional[int] = None):
         self.title = title
         self.project = project
         self.tfs_number = tfs_number
         self.url = url
         self.user_stories = user_stories
         self.team = team
+        self.page_id = page_id
+        self.version = version
 
 class UserStoryCreatorService:
     """Сервис для создания User Stories из страниц Confluence"""
@@ -46,20 +55,63 @@ class UserStoryCreatorService:
         self.tfs_service = tfs_service
     
     async def create_user_stories_from_confluence(self, confluence_url: str, 
-                                                user_confirmation: str = None) -> Dict[str, Any]:
+                                                user_confirmation: str = None,
+                                                preview_token: str = None) -> Dict[str, Any]:
         """
         Основная функция создания User Stories из страницы Confluence
         
         Args:
             confluence_url: URL страницы Confluence
             user_confirmation: Подтверждение пользователя ("Да"/"Нет")
+            preview_token: Токен сессии предварительного просмотра (из ответа preview);
+                используется только при подтверждении и только один раз (неизвестный или
+                использованный токен - ошибка); предпросмотр всегда создает новую сессию
         
         Returns:
             Результат операции с деталями создания
         """
+        return await self._process_confluence_page(confluence_url, user_confirmation, preview_token)
+
+    async def _parse_page_with_preview(self, confluence_url: str) -> Tuple[ConfluencePageData, Optional[Dict[str, Any]]]:
+        """Разбор страницы и предварительный просмотр (None - на странице нет User Stories)"""
+        page_data = await self._parse_confluence_page(confluence_url)
+        if not page_data.user_stories:
+            return page_data, None
+        logger.info(f"🔍 Создание preview для {len(page_data.user_stories)} User Stories")
+        preview = self._create_preview(page_data)
+        logger.info(f"✅ Preview создан: {preview.get('user_stories_count', 0)} User Stories")
+        return page_data, preview
+
+    async def _process_confluence_page(self, confluence_url: str, user_confirmation: Optional[str],
+                                       preview_token: Optional[str]) -> Dict[str, Any]:
         try:
-            # 1. Парсинг страницы Confluence
-            page_data = await self._parse_confluence_page(confluence_url)
+            # 1. Парсинг страницы Confluence (при подтверждении - данные из сессии предпросмотра)
+            session = None
+            if user_confirmation is not None and preview_token:
+                # Сессия забирается до первого await: параллельное подтверждение тем же токеном
+                # (двойной клик) или повторное подтверждение ее уже не найдет
+                session = preview_session_store.pop(preview_token)
+                if session is None or (confluence_url and session.confluence_url != confluence_url):
+                    return {
+                        "success": False,
+                        "error": "Предварительный просмотр не найден, устарел или уже подтвержден. "
+                                 "Выполните предварительный просмотр заново.",
+                        "preview": None
+                    }
+                if not await self._is_preview_current(session):
+                    session = None
+            
+            # 2. Подготовка предварительного просмотра
+            if session:
+                logger.info(f"♻️ Используем разобранную при предпросмотре страницу (сессия {session.token})")
+                page_data, preview = session.page_data, session.preview
+            elif user_confirmation is None:
+                # Одновременные предпросмотры одной страницы ждут один разбор; сессия у каждого своя
+                page_data, preview = await user_story_preview_flight.do(
+                    confluence_url, lambda: self._parse_page_with_preview(confluence_url)
+                )
+            else:
+                page_data, preview = await self._parse_page_with_preview(confluence_url)
             
             if not page_data.user_stories:
                 return {
@@ -68,18 +120,17 @@ class UserStoryCreatorService:
                     "preview": None
                 }
             
-            # 2. Подготовка предварительного просмотра
-            logger.info(f"🔍 Создание preview для {len(page_data.user_stories)} User Stories")
-            preview = self._create_preview(page_data)
-            logger.info(f"✅ Preview создан: {preview.get('user_stories_count', 0)} User Stories")
-            
             # Если пользователь еще не подтвердил, возвращаем предварительный просмотр
             if user_confirmation is None:
+                session = preview_session_store.create(
+                    confluence_url, page_data.page_id, page_data.version, page_data, preview
+                )
                 logger.info("📋 Возвращаем предварительный просмотр для подтверждения")
                 return {
                     "success": True,
                     "preview": preview,
                     "needs_confirmation": True,
+                    "preview_token": session.token,
                     "page_data": page_data.__dict__
                 }
             
@@ -141,6 +192,17 @@ class UserStoryCreatorService:
                 "preview": None
             }
     
+    async def _is_preview_current(self, session: PreviewSession) -> bool:
+        """Разобранную при предпросмотре страницу можно использовать, только если ее версия в Confluence не изменилась"""
+        if session.version is None:
+            return False
+        current_version = await self.confluence_service.get_page_version(session.page_id)
+        if current_version != session.version:
+            logger.info(f"🔄 Страница {session.page_id} изменилась после предпросмотра "
+                        f"(версия {session.version} -> {current_version}), разбираем заново")
+            return False
+        return True
+    
     async def _parse_confluence_page(self, confluence_url: str) -> ConfluencePageData:
         """Парсинг страницы Confluence и извлечение данных"""
         try:
@@ -157,8 +219,11 @@ class UserStoryCreatorService:
                 "content": article.content
             }
             
+            # HTML разбирается один раз на версию страницы, дальше все шаги читают модель
+            page_model = get_page_model(page_id, article.title, article.content, article.version)
+            
             # Парсинг метаданных
-            metadata = await self._parse_metadata(page_content)
+            metadata = await self._parse_metadata(page_content, page_model)
             logger.info(f"🔍 Извлеченные метаданные: {metadata}")
             
             # Дополнительная отладка для TFS номера
@@ -181,7 +246,7 @@ class UserStoryCreatorService:
                 logger.info(f"✅ TFS номер найден: {metadata.get('tfs_number')}")
             
             # Парсинг User Stories
-            user_stories = self._parse_user_stories(page_content)
+            user_stories = self._parse_user_stories(page_content, page_model)
             
             return ConfluencePageData(
                 title=page_content.get("title", ""),
@@ -189,7 +254,9 @@ class UserStoryCreatorService:
                 tfs_number=metadata.get("tfs_number", ""),
                 url=confluence_url,
                 user_stories=user_stories,
-                team=metadata.get("team", "")
+                team=metadata.get("team", ""),
+                page_id=page_id,
+                version=article.version
             )
             
         except Exception as e:
@@ -212,17 +279,22 @@ class UserStoryCreatorService:
         
         raise ValueError(f"Не удалось извлечь pageId из URL: {confluence_url}")
     
-    async def _parse_metadata(self, page_content: Dict[str, Any]) -> Dict[str, str]:
+    def _get_page_model(self, page_content: Dict[str, Any], page_model: ConfluencePageModel = None) -> ConfluencePageModel:
+        """Модель страницы: переданная или построенная по содержимому"""
+        if page_model is not None:
+            return page_model
+        return get_page_model(page_content.get("id", ""), page_content.get("title", ""),
+                              page_content.get("content", ""))
+    
+    async def _parse_metadata(self, page_content: Dict[str, Any], page_model: ConfluencePageModel = None) -> Dict[str, str]:
         """Парсинг метаданных из страницы"""
-        content = page_content.get("content", "")
-        
-        # Парсинг HTML для поиска таблицы метаданных
-        soup = BeautifulSoup(content, 'html.parser')
+        page_model = self._get_page_model(page_content, page_model)
+        soup = page_model.soup
         
         metadata = {}
         
         # Поиск таблицы с метаданными - более гибкий поиск
-        tables = soup.find_all('table')
+        tables = [info.table for info in page_model.tables]
         logger.info(f"🔍 Найдено {len(tables)} таблиц для поиска метаданных")
         
         # Если таблиц нет, ищем другие структуры с метаданными
@@ -253,7 +325,7 @@ class UserStoryCreatorService:
         # Дополнительный поиск TFS номера в любом месте страницы
         if 'tfs_number' not in metadata:
             logger.info("🔍 Дополнительный поиск TFS номера в тексте страницы")
-            page_text = soup.get_text()
+            page_text = page_model.text
             
             # Нормализуем текст - заменяем переносы строк на пробелы
             normalized_text = re.sub(r'\s+', ' ', page_text)
@@ -365,10 +437,11 @@ class UserStoryCreatorService:
         
         return metadata
     
-    def _parse_user_stories(self, page_content: Dict[str, Any]) -> List[UserStoryData]:
+    def _parse_user_stories(self, page_content: Dict[str, Any], page_model: ConfluencePageModel = None) -> List[UserStoryData]:
         """Парсинг User Stories из содержимого страницы"""
         content = page_content.get("content", "")
-        soup = BeautifulSoup(content, 'html.parser')
+        page_model = self._get_page_model(page_content, page_model)
+        soup = page_model.soup
         
         logger.info(f"🔍 Парсинг User Stories из страницы: {page_content.get('title', 'Без названия')}")
         logger.info(f"📄 Длина контента: {len(content)} символов")
@@ -376,7 +449,7 @@ class UserStoryCreatorService:
         user_stories = []
         
         # Поиск секции с User Stories
-        us_section = self._find_user_stories_section(soup)
+        us_section = self._find_user_stories_section(soup, page_model)
         if not us_section:
             logger.warning("❌ Секция с User Stories не найдена")
             # Попробуем найти User Stories в любом месте страницы
@@ -391,24 +464,21 @@ class UserStoryCreatorService:
             logger.info(f"✅ Найдена секция с User Stories: {us_section.name if hasattr(us_section, 'name') else 'Unknown'}")
         
         # Поиск таблицы с критериями приемки
-        criteria_table = self._find_criteria_table(soup)
+        criteria_table = self._find_criteria_table(soup, page_model)
         if criteria_table:
             logger.info("✅ Найдена таблица с критериями приемки")
         else:
             logger.warning("⚠️ Таблица с критериями приемки не найдена")
         
         # Парсинг каждой User Story
-        us_blocks = self._extract_user_story_blocks(us_section)
+        us_blocks = self._extract_user_story_blocks(us_section, page_model)
         logger.info(f"🔍 Найдено {len(us_blocks)} блоков User Stories для обработки")
         
         for i, block in enumerate(us_blocks, 1):
             logger.info(f"🔍 Обрабатываем блок {i} из {len(us_blocks)}")
             try:
                 # Если блок содержит только ячейку User Story, передаем всю таблицу с критериями
-                if block.find('div', class_='user-story-cell') or block.find('div', class_='user-story-row'):
-                    us_data = self._parse_single_user_story(block, f"US{i}", criteria_table)
-                else:
-                    us_data = self._parse_single_user_story(block, f"US{i}", criteria_table)
+                us_data = self._parse_single_user_story(block, f"US{i}", criteria_table, page_model)
                 
                 if us_data:
                     logger.info(f"✅ User Story {i} успешно обработана: {us_data.title}")
@@ -421,38 +491,39 @@ class UserStoryCreatorService:
         
         return user_stories
     
-    def _find_criteria_table(self, soup: BeautifulSoup) -> Optional[BeautifulSoup]:
-        """Поиск таблицы с критериями приемки"""
+    def _find_criteria_table(self, soup: BeautifulSoup, page_model: ConfluencePageModel = None) -> Optional[BeautifulSoup]:
+        """Поиск таблицы с критериями приемки (по предрассчитанному индексу таблиц)"""
+        if page_model is not None and page_model.soup is soup:
+            tables = page_model.tables
+        else:
+            tables = [TableInfo(table) for table in soup.find_all('table')]
+        
         # Ищем таблицы с заголовками "Дано", "Когда", "Тогда"
-        tables = soup.find_all('table')
-        for table in tables:
-            headers = table.find_all('th')
-            header_texts = [th.get_text(strip=True).lower() for th in headers]
-            if any(keyword in ' '.join(header_texts) for keyword in ['дано', 'когда', 'тогда']):
+        for info in tables:
+            if info.has_criteria_th:
                 logger.info("🔍 Найдена таблица с критериями приемки")
-                return table
+                return info.table
         
         # Если не нашли по заголовкам, ищем по содержимому
-        for table in tables:
-            table_text = table.get_text().lower()
-            if any(keyword in table_text for keyword in ['дано', 'когда', 'тогда', 'критерии приемки']):
+        for info in tables:
+            if any(keyword in info.text_lower for keyword in ['дано', 'когда', 'тогда', 'критерии приемки']):
                 logger.info("🔍 Найдена таблица с критериями приемки по содержимому")
-                return table
+                return info.table
         
         # Если не нашли отдельную таблицу, ищем в той же таблице, что и User Stories
-        for table in tables:
+        for info in tables:
             # Проверяем, есть ли в таблице и User Stories, и критерии
-            table_text = table.get_text().lower()
+            table_text = info.text_lower
             has_user_story = any(keyword in table_text for keyword in ['я, как', 'я как', 'я,как'])
             has_criteria = any(keyword in table_text for keyword in ['дано', 'когда', 'тогда'])
             
             if has_user_story and has_criteria:
                 logger.info("🔍 Найдена таблица с User Stories и критериями приемки")
-                return table
+                return info.table
         
         return None
     
-    def _find_user_stories_section(self, soup: BeautifulSoup) -> Optional[BeautifulSoup]:
+    def _find_user_stories_section(self, soup: BeautifulSoup, page_model: ConfluencePageModel = None) -> Optional[BeautifulSoup]:
         """Поиск секции с User Stories"""
         # Поиск по заголовкам
         headers = soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
@@ -465,7 +536,7 @@ class UserStoryCreatorService:
         # Поиск по таблицам с User Stories
         tables = soup.find_all('table')
         for table in tables:
-            if self._table_contains_user_stories(table):
+            if self._table_contains_user_stories(table, page_model):
                 return table
         
         return None
@@ -592,16 +663,36 @@ class UserStoryCreatorService:
         logger.info(f"🔍 Извлечено {len(us_rows)} строк для User Story")
         return us_rows
     
-    def _table_contains_user_stories(self, table) -> bool:
+    def _table_contains_user_stories(self, table, page_model: ConfluencePageModel = None) -> bool:
         """Проверка, содержит ли таблица User Stories"""
-        text = table.get_text().lower()
+        info = page_model.table_info(table) if page_model else None
+        text = info.text_lower if info else table.get_text().lower()
         has_keywords = any(keyword in text for keyword in ['user story', 'пользовательская история', 'дано', 'когда', 'тогда'])
         logger.info(f"🔍 Проверка таблицы на User Stories: {has_keywords}")
         if has_keywords:
             logger.info(f"🔍 Найденные ключевые слова в таблице: {[kw for kw in ['user story', 'пользовательская история', 'дано', 'когда', 'тогда'] if kw in text]}")
         return has_keywords
     
-    def _extract_user_story_blocks(self, section) -> List[BeautifulSoup]:
+    def _make_block(self, elements: List[Any], wrap_each: bool = False, attrs: Dict[str, str] = None) -> BeautifulSoup:
+        """
+        Отдельный блок User Story из копий элементов страницы.
+        Элементы копируются (без сериализации и повторного разбора HTML), исходный DOM не меняется.
+        """
+        holder = BeautifulSoup("", "html.parser")
+        if wrap_each:
+            # Каждый элемент в своей обертке с классом (user-story-cell / user-story-title / user-story-row)
+            for element, element_class in elements:
+                wrapper = holder.new_tag("div", attrs={"class": element_class, **(attrs or {})})
+                wrapper.append(copy.copy(element))
+                holder.append(wrapper)
+        else:
+            wrapper = holder.new_tag("div")
+            for element in elements:
+                wrapper.append(copy.copy(element))
+            holder.append(wrapper)
+        return holder
+    
+    def _extract_user_story_blocks(self, section, page_model: ConfluencePageModel = None) -> List[BeautifulSoup]:
         """Извлечение блоков User Stories из текста (заголовки h3) и таблицы"""
         blocks = []
         logger.info(f"🔍 Извлечение блоков User Stories из текста и таблицы")
@@ -609,9 +700,9 @@ class UserStoryCreatorService:
         # Проверяем, является ли сама секция таблицей
         if section.name == 'table':
             logger.info("🔍 Секция сама является таблицей")
-            if self._table_contains_user_stories(section):
+            if self._table_contains_user_stories(section, page_model):
                 logger.info("🔍 Таблица содержит User Stories")
-                us_blocks_from_table = self._extract_user_stories_from_table(section)
+                us_blocks_from_table = self._extract_user_stories_from_table(section, page_model)
                 blocks.extend(us_blocks_from_table)
                 logger.info(f"🔍 Извлечено {len(us_blocks_from_table)} User Stories из таблицы")
             else:
@@ -623,11 +714,11 @@ class UserStoryCreatorService:
             for i, table in enumerate(tables):
                 logger.info(f"🔍 Проверяем таблицу {i+1}")
                 # Проверяем, содержит ли таблица User Stories
-                if self._table_contains_user_stories(table):
+                if self._table_contains_user_stories(table, page_model):
                     logger.info("🔍 Найдена таблица с User Stories")
                     
                     # Извлекаем User Stories из таблицы
-                    us_blocks_from_table = self._extract_user_stories_from_table(table)
+                    us_blocks_from_table = self._extract_user_stories_from_table(table, page_model)
                     blocks.extend(us_blocks_from_table)
                     logger.info(f"🔍 Извлечено {len(us_blocks_from_table)} User Stories из таблицы")
                 else:
@@ -644,7 +735,7 @@ class UserStoryCreatorService:
                     logger.info(f"🔍 Найдена User Story в заголовке h3: {text[:100]}...")
                     
                     # Создаем блок с заголовком и следующими параграфами
-                    us_block_html = f"<div>{str(h3)}"
+                    block_elements = [h3]
                     
                     # Добавляем следующие параграфы до следующего заголовка
                     current = h3.next_sibling
@@ -653,11 +744,10 @@ class UserStoryCreatorService:
                             if current.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
                                 break
                             elif current.name == 'p':
-                                us_block_html += str(current)
+                                block_elements.append(current)
                         current = current.next_sibling
                     
-                    us_block_html += "</div>"
-                    us_block = BeautifulSoup(us_block_html, 'html.parser')
+                    us_block = self._make_block(block_elements)
                     blocks.append(us_block)
                     logger.info(f"🔍 Создан блок User Story из заголовка h3")
         
@@ -671,7 +761,7 @@ class UserStoryCreatorService:
                         logger.info(f"🔍 Найдена User Story в заголовке {tag}: {text[:100]}...")
                         
                         # Создаем блок с заголовком и следующими параграфами
-                        us_block_html = f"<div>{str(element)}"
+                        block_elements = [element]
                         
                         # Добавляем следующие параграфы до следующего заголовка
                         current = element.next_sibling
@@ -680,21 +770,21 @@ class UserStoryCreatorService:
                                 if current.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
                                     break
                                 elif current.name == 'p':
-                                    us_block_html += str(current)
+                                    block_elements.append(current)
                             current = current.next_sibling
                         
-                        us_block_html += "</div>"
-                        us_block = BeautifulSoup(us_block_html, 'html.parser')
+                        us_block = self._make_block(block_elements)
                         blocks.append(us_block)
                         logger.info(f"🔍 Создан блок User Story из заголовка {tag}")
         
         logger.info(f"✅ Найдено {len(blocks)} блоков User Stories всего")
         return blocks
     
-    def _extract_user_stories_from_table(self, table: BeautifulSoup) -> List[BeautifulSoup]:
+    def _extract_user_stories_from_table(self, table: BeautifulSoup, page_model: ConfluencePageModel = None) -> List[BeautifulSoup]:
         """Извлечение User Stories из таблицы с критериями приемки"""
         blocks = []
-        rows = table.find_all('tr')
+        info = page_model.table_info(table) if page_model else None
+        rows = info.rows if info else table.find_all('tr')
         logger.info(f"🔍 Анализ таблицы: {len(rows)} строк")
         
         # Сначала ищем User Stories в ячейках с rowspan (приоритет)
@@ -742,11 +832,11 @@ class UserStoryCreatorService:
                         logger.info(f"🔍 Найдена ячейка с названием: {title_cell.get_text(strip=True)[:100]}...")
                     
                     # Создаем блок с ячейкой User Story и названием
-                    us_cell_html = f"<div class='user-story-cell' data-rowspan='true'>{str(cell)}</div>"
+                    block_elements = [(cell, 'user-story-cell')]
                     if title_cell:
-                        us_cell_html += f"<div class='user-story-title' data-rowspan='true'>{str(title_cell)}</div>"
+                        block_elements.append((title_cell, 'user-story-title'))
                     
-                    us_block = BeautifulSoup(us_cell_html, 'html.parser')
+                    us_block = self._make_block(block_elements, wrap_each=True, attrs={'data-rowspan': 'true'})
                     blocks.append(us_block)
                     logger.info(f"🔍 Создан блок User Story из ячейки с rowspan")
         
@@ -783,14 +873,15 @@ class UserStoryCreatorService:
                         break
                 
                 # Создаем блок с полной строкой и добавляем атрибут с индексом строки
-                us_row_html = f"<div class='user-story-row' data-row-index='{us_row_index}'>{str(us_row)}</div>"
-                us_block = BeautifulSoup(us_row_html, 'html.parser')
+                us_block = self._make_block([(us_row, 'user-story-row')], wrap_each=True,
+                                            attrs={'data-row-index': str(us_row_index)})
                 blocks.append(us_block)
                 logger.info(f"🔍 Создан блок User Story {i+1} с полной строкой (индекс: {us_row_index})")
         
         return blocks
     
-    def _parse_single_user_story(self, block: BeautifulSoup, us_number: str, criteria_table: BeautifulSoup = None) -> Optional[UserStoryData]:
+    def _parse_single_user_story(self, block: BeautifulSoup, us_number: str, criteria_table: BeautifulSoup = None,
+                                 page_model: ConfluencePageModel = None) -> Optional[UserStoryData]:
         """Парсинг отдельной User Story"""
         logger.info(f"🔍 _parse_single_user_story вызван для {us_number}")
         logger.info(f"🔍 Блок: {block.name}, содержимое: {str(block)[:200]}...")
@@ -881,7 +972,7 @@ class UserStoryCreatorService:
                     else:
                         us_index_for_filter = us_row_index
                         logger.info(f"🔧 Для таблицы с US используем индекс строки: {us_index_for_filter}")
-                acceptance_criteria, given_conditions, when_actions, then_results = self._extract_acceptance_criteria(table, us_index_for_filter)
+                acceptance_criteria, given_conditions, when_actions, then_results = self._extract_acceptance_criteria(table, us_index_for_filter, page_model)
             else:
                 logger.warning(f"❌ Таблица с критериями не найдена для {us_number}")
                 # Если таблица не найдена, создаем пустые критерии
@@ -1152,7 +1243,8 @@ class UserStoryCreatorService:
         logger.warning(f"⚠️ Паттерн User Story не найден в тексте: {text[:50]}...")
         return ""
     
-    def _extract_acceptance_criteria(self, block: BeautifulSoup, us_row_index: int = None) -> Tuple[List[Dict[str, str]], str, str, str]:
+    def _extract_acceptance_criteria(self, block: BeautifulSoup, us_row_index: int = None,
+                                     page_model: ConfluencePageModel = None) -> Tuple[List[Dict[str, str]], str, str, str]:
         """
         Универсальный парсер критериев приёмки: формирует новую таблицу только с колонками Дано, Когда, Тогда
         """
@@ -1262,46 +1354,13 @@ class UserStoryCreatorService:
                     logger.warning(f"⚠️[{debug_uuid}] Не удалось найти все необходимые колонки даже по частичным совпадениям")
                     return [], '', '', ''
             # 2. Построить полную матрицу значений с учётом rowspan/colspan
-            matrix = []
-            rowspans = {}
-            data_rows = table.find_all('tr')[1:]
-            logger.info(f"🔢[{debug_uuid}] Количество строк данных (без заголовка): {len(data_rows)}")
-            for tr_idx, tr in enumerate(data_rows):
-                row = []
-                cells = tr.find_all(['td', 'th'])
-                logger.info(f"   ➡️[{debug_uuid}] Строка {tr_idx + 1}: всего ячеек = {len(cells)}")
-                col = 0
-                i = 0
-                while col < len(headers):
-                    # Если есть незакрытый rowspan из предыдущих строк
-                    if (tr_idx, col) in rowspans:
-                        value = rowspans[(tr_idx, col)]
-                        row.append(value)
-                        logger.debug(f"      ↪️[{debug_uuid}] Применён rowspan значение '{value}' в колонке {col}")
-                        col += 1
-                        continue
-                    if i >= len(cells):
-                        row.append("")
-                        col += 1
-                        continue
-                    cell = cells[i]
-                    text = cell.get_text(separator=' ', strip=True)
-                    # Очищаем от HTML entities и неразрывных пробелов
-                    text = text.replace('&nbsp;', ' ').replace('\xa0', ' ')
-                    text = re.sub(r'\s+', ' ', text)
-                    rowspan = int(cell.get('rowspan', 1))
-                    colspan = int(cell.get('colspan', 1))
-                    logger.debug(f"      ⬜[{debug_uuid}] Ячейка {i}: text='{text[:50]}...', rowspan={rowspan}, colspan={colspan}, текущая колонка={col}")
-                    for c in range(colspan):
-                        row.append(text)
-                        if rowspan > 1:
-                            for r in range(1, rowspan):
-                                rowspans[(tr_idx + r, col)] = text
-                                logger.debug(f"         ↘️[{debug_uuid}] Сохранён rowspan для строки {tr_idx + r + 1}, колонки {col}")
-                        col += 1
-                    i += 1
-                logger.info(f"   ✅[{debug_uuid}] Строка {tr_idx + 1} после разворачивания: {row}")
-                matrix.append(row)
+            # (для таблиц страницы матрица строится один раз и переиспользуется для всех US)
+            table_info = page_model.table_info(table) if page_model else None
+            if table_info:
+                matrix = table_info.matrix(len(headers))
+            else:
+                matrix = build_cell_matrix(table, len(headers))
+            logger.info(f"🔢[{debug_uuid}] Количество строк данных (без заголовка): {len(matrix)}")
             
             # 3. Собрать только нужные колонки
             logger.info(f"🔢[{debug_uuid}] Матрица построена: {len(matrix)} строк")
@@ -1680,23 +1739,73 @@ class UserStoryCreatorService:
         return "".join(html_parts)
     
     async def _create_user_stories_in_tfs(self, page_data: ConfluencePageData) -> Dict[str, Any]:
-        """Создание User Stories в TFS"""
+        """
+        Создание User Stories в TFS.
+        
+        Родительский тикет запрашивается один раз. Сначала все User Stories отправляются одним
+        $batch-запросом (со связью с родителем в каждом документе); если сервер отклонил $batch
+        или отдельный запрос в нем, User Story создаются по одной с ограниченным параллелизмом.
+        User Story с неизвестным результатом (таймаут или ошибка во время $batch) повторно не
+        создаются, чтобы не получить дубликаты. Порядок результатов совпадает с порядком на странице.
+        """
         created_stories = []
         errors = []
         
-        for us in page_data.user_stories:
+        parent_id = self._parse_tfs_number(page_data.tfs_number)
+        parent_project = await self._get_parent_project(page_data.tfs_number)
+        project = parent_project if parent_project else page_data.project
+        
+        stories = page_data.user_stories
+        story_ids: List[Any] = [None] * len(stories)
+        # Индексы User Stories, которые могли быть созданы прерванным $batch
+        outcome_unknown: set = set()
+        
+        if settings.USER_STORY_CREATE_USE_BATCH and stories:
+            tfs_stories = [self._build_tfs_story_data(us, project, parent_id) for us in stories]
             try:
-                # Создание User Story
-                story_id = await self._create_single_user_story(us, page_data)
-                if story_id:
-                    created_stories.append(story_id)
-                    logger.info(f"✅ User Story {us.title} создана с ID: {story_id}")
-                else:
-                    errors.append(f"Не удалось создать User Story {us.title}")
+                batch_ids = await self.tfs_service.create_user_stories_batch(
+                    tfs_stories,
+                    confluence_url=page_data.url,
+                    parent_id=parent_id
+                )
+                if batch_ids is not None:
+                    story_ids = batch_ids
+            except TFSBatchOutcomeUnknownError as e:
+                logger.error(f"❌ Результат $batch неизвестен, повторное создание не выполняется: {str(e)}")
+                story_ids[:len(e.results)] = e.results
+                outcome_unknown = set(range(len(e.results), len(stories)))
             except Exception as e:
-                error_msg = f"Ошибка при создании User Story {us.title}: {str(e)}"
+                logger.error(f"❌ Ошибка при создании User Stories через $batch: {str(e)}")
+                outcome_unknown = set(range(len(stories)))
+        
+        semaphore = asyncio.Semaphore(max(1, settings.USER_STORY_CREATE_CONCURRENCY))
+        
+        async def _create(us: UserStoryData) -> Optional[int]:
+            async with semaphore:
+                return await self._create_single_user_story(us, page_data, project)
+        
+        pending = [i for i, story_id in enumerate(story_ids) if not story_id and i not in outcome_unknown]
+        if pending:
+            logger.info(f"🔁 Создание {len(pending)} User Stories по одной")
+            outcomes = await asyncio.gather(*[_create(stories[i]) for i in pending], return_exceptions=True)
+            for i, outcome in zip(pending, outcomes):
+                story_ids[i] = outcome
+        
+        for index, (us, outcome) in enumerate(zip(stories, story_ids)):
+            if index in outcome_unknown:
+                error_msg = (f"Результат создания User Story {us.title} неизвестен (запрос $batch прерван): "
+                             f"проверьте дочерние элементы родительского тикета перед повторным запуском")
                 errors.append(error_msg)
                 logger.error(error_msg)
+            elif isinstance(outcome, Exception):
+                error_msg = f"Ошибка при создании User Story {us.title}: {str(outcome)}"
+                errors.append(error_msg)
+                logger.error(error_msg)
+            elif outcome:
+                created_stories.append(outcome)
+                logger.info(f"✅ User Story {us.title} создана с ID: {outcome}")
+            else:
+                errors.append(f"Не удалось создать User Story {us.title}")
         
         if created_stories:
             return {
@@ -1712,33 +1821,46 @@ class UserStoryCreatorService:
                 "errors": errors,
                 "message": "Не удалось создать ни одной User Story"
             }
+    
+    def _parse_tfs_number(self, tfs_number: str) -> Optional[int]:
+        """ID родительского тикета из номера вида '#123456'"""
+        try:
+            return int(str(tfs_number).replace('#', '').strip()) if tfs_number else None
+        except ValueError:
+            return None
+    
+    def _build_tfs_story_data(self, us: UserStoryData, project: str, parent_id: Optional[int]):
+        """Данные User Story для TFS"""
+        # Импортируем правильную модель для TFS
+        from app.models.request_models import UserStoryData as TFSUserStoryData
+        
+        return TFSUserStoryData(
+            title=us.title,
+            description=us.user_story_text,
+            project=project,
+            parent_work_item_id=parent_id,
+            user_story_text=us.user_story_text,
+            given_conditions=us.given_conditions,
+            when_actions=us.when_actions,
+            then_results=us.then_results,
+            acceptance_criteria=us.acceptance_criteria,
+            tags=[]  # Убираем теги
+        )
 
-    async def _create_single_user_story(self, us: UserStoryData, page_data: ConfluencePageData) -> Optional[int]:
-        """Создание одной User Story в TFS"""
+    async def _create_single_user_story(self, us: UserStoryData, page_data: ConfluencePageData,
+                                        project: str = None) -> Optional[int]:
+        """Создание одной User Story в TFS (project - уже определенный проект родительского тикета)"""
         try:
-            # Импортируем правильную модель для TFS
-            from app.models.request_models import UserStoryData as TFSUserStoryData
+            if project is None:
+                # Получаем проект из родительского тикета
+                parent_project = await self._get_parent_project(page_data.tfs_number)
+                project = parent_project if parent_project else page_data.project
             
-            # Получаем проект из родительского тикета
-            parent_project = await self._get_parent_project(page_data.tfs_number)
-            project = parent_project if parent_project else page_data.project
-        
             # Подготовка данных для создания User Story
-            story_data = TFSUserStoryData(
-                title=us.title,
-                description=us.user_story_text,
-                project=project,
-                parent_work_item_id=int(page_data.tfs_number) if page_data.tfs_number else None,
-                user_story_text=us.user_story_text,
-                given_conditions=us.given_conditions,
-                when_actions=us.when_actions,
-                then_results=us.then_results,
-                acceptance_criteria=us.acceptance_criteria,
-                tags=[]  # Убираем теги
-            )
+            parent_tfs_id = self._parse_tfs_number(page_data.tfs_number)
+            story_data = self._build_tfs_story_data(us, project, parent_tfs_id)
             
             # Создание User Story в TFS
-            parent_tfs_id = int(page_data.tfs_number) if page_data.tfs_number else None
             logger.info(f"🔗 Создание User Story с родительским тикетом: {parent_tfs_id}")
             
             story_id = await self.tfs_service.create_user_story(
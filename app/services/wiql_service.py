@@ -0,0 +1,212 @@
+"""
+WIQL-запросы к TFS с однократным определением возможностей сервера
+"""
+
+import asyncio
+import time
+import logging
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from app.config.settings import settings
+from app.services.tfs_service import TFSService
+from app.services.tfs_health import tfs_health
+from app.services.link_graph import link_graph
+
+logger = logging.getLogger(__name__)
+
+# Версии API в порядке предпочтения (TFS 2018 поддерживает только 4.1)
+WIQL_API_VERSIONS = ["4.1", "5.0", "5.1", "6.0"]
+
+
+def escape_wiql(value: Any) -> str:
+    """Экранирование строкового литерала WIQL"""
+    return str(value).replace("'", "''")
+
+
+def wiql_list(values: Iterable[Any]) -> str:
+    """Список литералов для оператора IN"""
+    return ", ".join(f"'{escape_wiql(v)}'" for v in values)
+
+
+@dataclass
+class WiqlCapabilities:
+    """Результат проверки возможностей WIQL на сервере"""
+    api_version: Optional[str] = None
+    work_item_links: bool = False
+    recursive_mode: bool = False
+    probed_at: Optional[float] = None
+
+    @property
+    def available(self) -> bool:
+        return self.api_version is not None
+
+
+class WiqlService:
+    """
+    Выполнение WIQL-запросов с закэшированной версией API.
+
+    При первом обращении (или при старте приложения) определяется версия API, которую
+    принимает сервер, и поддержка запросов по WorkItemLinks с MODE (Recursive). Дальше все
+    запросы отправляются одним POST без перебора версий и вариантов синтаксиса.
+    Неудачная проверка (TFS недоступен) повторяется не чаще раза в WIQL_PROBE_RETRY_INTERVAL;
+    после восстановления подключения или смены адреса API проверка выполняется заново.
+    """
+
+    def __init__(self, tfs_service: TFSService = None):
+        self.tfs_service = tfs_service or TFSService()
+        self._capabilities: Optional[WiqlCapabilities] = None
+        self._probe_lock = asyncio.Lock()
+        tfs_health.add_recovery_listener(self.reset)
+
+    @property
+    def base_url(self) -> str:
+        """Адрес API, найденный при проверке подключения (до нее - из настроек)"""
+        return tfs_health.base_url or self.tfs_service.base_url
+
+    def _needs_probe(self) -> bool:
+        capabilities = self._capabilities
+        if capabilities is None:
+            return True
+        return (not capabilities.available
+                and time.time() - (capabilities.probed_at or 0) > settings.WIQL_PROBE_RETRY_INTERVAL)
+
+    async def get_capabilities(self) -> WiqlCapabilities:
+        """Возможности сервера (успешная проверка - один раз, неудачная - повторяется)"""
+        if self._needs_probe():
+            async with self._probe_lock:
+                if self._needs_probe():
+                    self._capabilities = await self._probe()
+        return self._capabilities
+
+    def reset(self):
+        """Сброс результатов проверки (восстановление подключения, смена адреса API)"""
+        self._capabilities = None
+
+    async def _probe(self) -> WiqlCapabilities:
+        capabilities = WiqlCapabilities(probed_at=time.time())
+        probe_query = "SELECT [System.Id] FROM WorkItems WHERE [System.Id] = 1"
+
+        for api_version in WIQL_API_VERSIONS:
+            if await self._post(probe_query, api_version) is not None:
+                capabilities.api_version = api_version
+                break
+
+        if not capabilities.available:
+            logger.warning("⚠️ WIQL API недоступен ни в одной из версий: " + ", ".join(WIQL_API_VERSIONS))
+            return capabilities
+
+        links_query = (
+            "SELECT [System.Id] FROM WorkItemLinks "
+            "WHERE ([Source].[System.Id] = 1) MODE (MayContain)"
+        )
+        capabilities.work_item_links = await self._post(links_query, capabilities.api_version) is not None
+
+        if capabilities.work_item_links:
+            recursive_query = (
+                "SELECT [System.Id] FROM WorkItemLinks "
+                "WHERE ([Source].[System.Id] = 1) "
+                "AND ([System.Links.LinkType] = 'System.LinkTypes.Hierarchy-Forward') MODE (Recursive)"
+            )
+            capabilities.recursive_mode = await self._post(recursive_query, capabilities.api_version) is not None
+
+        logger.info(f"🧭 WIQL: api-version {capabilities.api_version}, WorkItemLinks: "
+                    f"{'✅' if capabilities.work_item_links else '❌'}, Recursive: "
+                    f"{'✅' if capabilities.recursive_mode else '❌'}")
+        return capabilities
+
+    async def _post(self, wiql: str, api_version: str, top: int = None,
+                    time_precision: bool = False) -> Optional[Dict[str, Any]]:
+        """Один WIQL-запрос; None при ошибке"""
+        params = {"api-version": api_version}
+        if top:
+            params["$top"] = top
+        if time_precision:
+            # Сравнение дат с точностью до времени (по умолчанию - только дата)
+            params["timePrecision"] = "true"
+        try:
+            response = await self.tfs_service._request(
+                "POST", f"{self.base_url}/_apis/wit/wiql",
+                params=params, json_body={"query": wiql}
+            )
+        except httpx.HTTPError as e:
+            logger.debug(f"WIQL (api-version {api_version}) недоступен: {e}")
+            return None
+        if response.status_code != 200:
+            logger.debug(f"WIQL (api-version {api_version}) вернул {response.status_code}: {response.text[:200]}")
+            return None
+        try:
+            data = response.json()
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    async def query(self, wiql: str, top: int = None, time_precision: bool = False) -> Optional[Dict[str, Any]]:
+        """WIQL-запрос с определенной заранее версией API"""
+        capabilities = await self.get_capabilities()
+        if not capabilities.available:
+            return None
+        return await self._post(wiql, capabilities.api_version, top, time_precision)
+
+    async def query_ids(self, wiql: str, top: int = None, time_precision: bool = False) -> Optional[List[int]]:
+        """ID найденных Work Items (для запросов FROM WorkItems); None при ошибке"""
+        data = await self.query(wiql, top, time_precision)
+        if data is None:
+            return None
+        return [item["id"] for item in data.get("workItems", []) if "id" in item]
+
+    async def query_links(self, source_ids: Iterable[int], link_types: Iterable[str] = None,
+                          target_condition: str = None, recursive: bool = False) -> Optional[List[Tuple[Optional[int], int, Optional[str]]]]:
+        """
+        Один запрос FROM WorkItemLinks.
+
+        Возвращает список (source_id, target_id, тип связи); для корневых строк дерева source_id = None.
+        recursive=True строит все дерево (только для иерархических типов связей).
+        None - если сервер не поддерживает запрос.
+        """
+        capabilities = await self.get_capabilities()
+        if not capabilities.work_item_links or (recursive and not capabilities.recursive_mode):
+            return None
+
+        source_ids = [int(sid) for sid in source_ids]
+        if not source_ids:
+            return []
+
+        conditions = [f"([Source].[System.Id] IN ({', '.join(str(sid) for sid in source_ids)}))"]
+        link_types = list(link_types or [])
+        if link_types:
+            conditions.append(f"([System.Links.LinkType] IN ({wiql_list(link_types)}))")
+        if target_condition:
+            conditions.append(f"({target_condition})")
+
+        wiql = (
+            "SELECT [System.Id] FROM WorkItemLinks WHERE "
+            + " AND ".join(conditions)
+            + (" MODE (Recursive)" if recursive else " MODE (MayContain)")
+        )
+        data = await self._post(wiql, capabilities.api_version)
+        if data is None:
+            return None
+
+        links = []
+        for relation in data.get("workItemRelations", []):
+            target = relation.get("target") or {}
+            if "id" not in target:
+                continue
+            source = relation.get("source") or {}
+            rel = relation.get("rel")
+            links.append((source.get("id"), target["id"], rel))
+        link_graph.add_links(links)
+        return links
+
+    def status(self) -> Dict[str, Any]:
+        """Результаты проверки для статуса системы"""
+        if self._capabilities is None:
+            return {"probed": False}
+        return {"probed": True, **asdict(self._capabilities)}
+
+
+# Глобальный экземпляр WIQL-сервиса
+wiql_service = WiqlService()
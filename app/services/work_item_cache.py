@@ -0,0 +1,159 @@
+"""
+Общий кэш Work Items с TTL, LRU-вытеснением и проверкой по System.Rev
+"""
+
+import time
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[int, Optional[Tuple[str, ...]], Optional[str]]
+
+
+@dataclass
+class WorkItemCacheEntry:
+    value: Any
+    rev: Optional[int]
+    changed_date: Optional[str]
+    stored_at: float
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.monotonic() - self.stored_at <= ttl
+
+
+class WorkItemCache:
+    """
+    Процессный кэш Work Items.
+
+    Ключ - (id, fields, expand). Запись старше TTL не удаляется сразу, а считается
+    устаревшей: вызывающая сторона проверяет System.Rev / ChangedDate и либо
+    продлевает запись (revalidate), либо перезаписывает ее новыми данными.
+    """
+
+    def __init__(self, max_size: int = 2000, ttl: float = 60.0, enabled: bool = True):
+        self._entries: "OrderedDict[CacheKey, WorkItemCacheEntry]" = OrderedDict()
+        self._max_size = max_size
+        self._ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._revalidated = 0
+        self._evictions = 0
+        self._invalidation_listeners: List[Callable[[int], None]] = []
+        self._eviction_listeners: List[Callable[[CacheKey], None]] = []
+
+    def add_invalidation_listener(self, listener: Callable[[int], None]) -> None:
+        """Подписка на инвалидацию Work Item (производные индексы сбрасывают свои записи)"""
+        self._invalidation_listeners.append(listener)
+
+    def add_eviction_listener(self, listener: Callable[[CacheKey], None]) -> None:
+        """Подписка на LRU-вытеснение записей (производные индексы ограничены размером кэша)"""
+        self._eviction_listeners.append(listener)
+
+    @staticmethod
+    def make_key(work_item_id: int, fields: List[str] = None, expand: str = None) -> CacheKey:
+        """Нормализованный ключ кэша"""
+        return (int(work_item_id), tuple(sorted(fields)) if fields else None, expand or None)
+
+    def lookup(self, key: CacheKey) -> Tuple[Optional[WorkItemCacheEntry], bool]:
+        """Возвращает (запись, свежая ли она). Промах учитывается только при отсутствии записи"""
+        if not self.enabled:
+            return None, False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            fresh = entry.is_fresh(self._ttl)
+            if fresh:
+                self._hits += 1
+            return entry, fresh
+
+    def is_fresh(self, key: CacheKey) -> bool:
+        """Есть ли свежая (не старше TTL) запись - без учета в статистике"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.is_fresh(self._ttl)
+
+    def put(self, key: CacheKey, value: Any, rev: Optional[int] = None, changed_date: Optional[str] = None) -> None:
+        """Сохранение записи с LRU-вытеснением"""
+        if not self.enabled:
+            return
+        evicted: List[CacheKey] = []
+        with self._lock:
+            self._entries[key] = WorkItemCacheEntry(value, rev, changed_date, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                evicted.append(self._entries.popitem(last=False)[0])
+                self._evictions += 1
+        for evicted_key in evicted:
+            for listener in self._eviction_listeners:
+                listener(evicted_key)
+
+    def revalidate(self, key: CacheKey, rev: Optional[int], changed_date: Optional[str]) -> Optional[Any]:
+        """
+        Проверка устаревшей записи по ревизии.
+        Если ревизия не изменилась - продлевает TTL и возвращает значение, иначе удаляет запись.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            same_rev = entry.rev is not None and rev is not None and entry.rev == rev
+            if entry.rev is None or rev is None:
+                same_rev = entry.changed_date is not None and entry.changed_date == changed_date
+            if same_rev:
+                entry.stored_at = time.monotonic()
+                self._entries.move_to_end(key)
+                self._hits += 1
+                self._revalidated += 1
+                return entry.value
+            del self._entries[key]
+            self._misses += 1
+            return None
+
+    def invalidate(self, work_item_id: int) -> None:
+        """Удаление всех записей Work Item (после изменения полей или связей)"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == int(work_item_id)]:
+                del self._entries[key]
+        for listener in self._invalidation_listeners:
+            listener(int(work_item_id))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для /api/v1/status"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "ttl_seconds": self._ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "revalidated": self._revalidated,
+                "evictions": self._evictions,
+                "hit_rate": round(self._hits / total, 3) if total else 0.0,
+            }
+
+
+# Глобальный экземпляр кэша (общий для всех экземпляров TFSService)
+work_item_cache = WorkItemCache(
+    max_size=settings.WORK_ITEM_CACHE_MAX_SIZE,
+    ttl=settings.WORK_ITEM_CACHE_TTL,
+    enabled=settings.WORK_ITEM_CACHE_ENABLED,
+)
@@ -0,0 +1,422 @@
+"""
+Локальное зеркало Work Items (SQLite FTS5) для текстового поиска и поиска упоминаний ID без TFS
+"""
+
+import asyncio
+import html
+import json
+import re
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from app.config.settings import settings
+from app.models.tfs_models import WorkItemInfo
+from app.services.pull_request_index import extract_work_item_mentions
+from app.services.tfs_service import TFSService
+from app.services.wiql_service import wiql_service, escape_wiql
+
+logger = logging.getLogger(__name__)
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+
+# Значение WORK_ITEM_MIRROR_PROJECTS для зеркала всей коллекции (без фильтра по проекту)
+ALL_PROJECTS = "*"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    id INTEGER PRIMARY KEY,
+    rev INTEGER,
+    work_item_type TEXT,
+    state TEXT,
+    title TEXT,
+    description TEXT,
+    project TEXT,
+    changed_date TEXT,
+    relations TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_work_items_project ON work_items (project, work_item_type);
+CREATE TABLE IF NOT EXISTS mentions (
+    work_item_id INTEGER NOT NULL,
+    mentioned_id INTEGER NOT NULL,
+    PRIMARY KEY (work_item_id, mentioned_id)
+);
+CREATE INDEX IF NOT EXISTS idx_mentions_mentioned ON mentions (mentioned_id);
+CREATE TABLE IF NOT EXISTS sync_state (
+    project TEXT PRIMARY KEY,
+    last_changed TEXT,
+    synced_at REAL NOT NULL
+);
+"""
+
+# Полнотекстовый индекс поверх work_items (external content) и триггеры синхронизации
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS work_items_fts USING fts5(
+    title, description, content='work_items', content_rowid='id', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS work_items_ai AFTER INSERT ON work_items BEGIN
+    INSERT INTO work_items_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS work_items_ad AFTER DELETE ON work_items BEGIN
+    INSERT INTO work_items_fts (work_items_fts, rowid, title, description)
+    VALUES ('delete', old.id, old.title, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS work_items_au AFTER UPDATE ON work_items BEGIN
+    INSERT INTO work_items_fts (work_items_fts, rowid, title, description)
+    VALUES ('delete', old.id, old.title, old.description);
+    INSERT INTO work_items_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+"""
+
+
+def html_to_text(value: Optional[str]) -> str:
+    """Текст описания без HTML-разметки"""
+    if not value:
+        return ""
+    return re.sub(r"\s+", " ", html.unescape(TAG_PATTERN.sub(" ", value))).strip()
+
+
+def fts_phrase(term: str) -> str:
+    """Термин как фраза FTS5 с поиском по префиксу последнего слова"""
+    return '"' + term.replace('"', '""') + '"*'
+
+
+class WorkItemMirror:
+    """
+    Зеркало Work Items проектов: id, тип, состояние, заголовок, описание, проект, связи, ревизия.
+
+    Синхронизация инкрементальная: запрашиваются только элементы с [System.ChangedDate] не раньше
+    последнего синхронизированного, их поля загружаются пакетными запросами. Удаленные в TFS
+    элементы не попадают в выборку по дате, поэтому раз в WORK_ITEM_MIRROR_PURGE_INTERVAL
+    список ID сверяется с TFS и лишние удаляются. Текстовый поиск выполняется по FTS5 (если
+    SQLite собран без FTS5 - через LIKE), упоминания ID - по таблице mentions.
+
+    Зеркало заменяет поиск в TFS, только если покрывает его область: поиск по проекту - если
+    проект синхронизирован, поиск по всей коллекции - только для зеркала всей коллекции
+    (WORK_ITEM_MIRROR_PROJECTS=*). Иначе, как и при устаревшем зеркале, вызывающий код ищет в TFS.
+    """
+
+    SYNC_PAGE_SIZE = 1000
+    # Размер страницы ID при сверке с TFS (ограничение WIQL)
+    PURGE_PAGE_SIZE = 20000
+    # Ограничение числа параметров SQLite в одном запросе
+    SQL_CHUNK_SIZE = 500
+
+    def __init__(self, tfs_service: TFSService = None, projects: List[str] = None, db_path: str = None):
+        self.projects = projects or [
+            project.strip() for project in settings.WORK_ITEM_MIRROR_PROJECTS.split(",") if project.strip()
+        ]
+        self.db_path = db_path or settings.WORK_ITEM_MIRROR_DB_PATH
+        self.tfs_service = tfs_service or TFSService()
+        self.fts_available = False
+        self._db_lock = threading.Lock()
+        self._sync_lock = asyncio.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Время последней сверки с TFS по проектам (после перезапуска - при первой синхронизации)
+        self._purged_at: Dict[str, float] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+            try:
+                self._conn.executescript(_FTS_SCHEMA)
+                self.fts_available = True
+            except sqlite3.OperationalError as e:
+                logger.warning(f"⚠️ FTS5 недоступен, текстовый поиск в зеркале Work Items через LIKE: {e}")
+        return self._conn
+
+    def _execute(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        with self._db_lock:
+            conn = self._connect()
+            rows = conn.execute(sql, tuple(params)).fetchall()
+            conn.commit()
+            return rows
+
+    # --- Синхронизация ---
+
+    async def sync(self) -> int:
+        """Инкрементальная синхронизация всех проектов; возвращает количество обновленных элементов"""
+        async with self._sync_lock:
+            updated = 0
+            for project in self.projects:
+                try:
+                    updated += await self._sync_project(project)
+                    if time.time() - self._purged_at.get(project, 0) >= settings.WORK_ITEM_MIRROR_PURGE_INTERVAL:
+                        await self._purge_deleted(project)
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось синхронизировать зеркало Work Items {project}: {e}")
+            return updated
+
+    def _project_condition(self, project: str) -> str:
+        if project == ALL_PROJECTS:
+            return "[System.Id] > 0"
+        return f"[System.TeamProject] = '{escape_wiql(project)}'"
+
+    async def _sync_project(self, project: str) -> int:
+        state = self._execute("SELECT last_changed FROM sync_state WHERE project = ?", (project,))
+        last_changed = state[0][0] if state else None
+        updated = 0
+
+        while True:
+            condition = self._project_condition(project)
+            if last_changed:
+                condition += f" AND [System.ChangedDate] >= '{escape_wiql(last_changed)}'"
+            wiql = f"SELECT [System.Id] FROM WorkItems WHERE {condition} ORDER BY [System.ChangedDate] ASC"
+            ids = await wiql_service.query_ids(wiql, top=self.SYNC_PAGE_SIZE, time_precision=True)
+            if ids is None:
+                logger.warning(f"Не удалось получить измененные Work Items проекта {project}")
+                return updated
+
+            work_items = await self.tfs_service.get_work_items_batch(ids, expand="relations")
+            updated += self._store(work_items)
+
+            changed_dates = [item.changed_date for item in work_items if item.changed_date]
+            newest = max(changed_dates) if changed_dates else last_changed
+            self._execute(
+                "INSERT OR REPLACE INTO sync_state (project, last_changed, synced_at) VALUES (?, ?, ?)",
+                (project, newest, time.time())
+            )
+            # Следующая страница, пока TFS возвращает полные страницы с продвижением по дате
+            if len(ids) < self.SYNC_PAGE_SIZE or newest == last_changed:
+                break
+            last_changed = newest
+
+        logger.info(f"🪞 Зеркало Work Items {project}: обновлено {updated}")
+        return updated
+
+    async def _purge_deleted(self, project: str) -> int:
+        """Удаление элементов, которых больше нет в TFS (удалены или перенесены в другой проект)"""
+        existing: Set[int] = set()
+        last_id = 0
+        while True:
+            wiql = (
+                f"SELECT [System.Id] FROM WorkItems WHERE {self._project_condition(project)} "
+                f"AND [System.Id] > {last_id} ORDER BY [System.Id] ASC"
+            )
+            ids = await wiql_service.query_ids(wiql, top=self.PURGE_PAGE_SIZE)
+            if ids is None:
+                logger.warning(f"Не удалось сверить зеркало Work Items {project} с TFS")
+                return 0
+            existing.update(ids)
+            if len(ids) < self.PURGE_PAGE_SIZE:
+                break
+            last_id = max(ids)
+
+        if project == ALL_PROJECTS:
+            mirrored = self._execute("SELECT id FROM work_items")
+        else:
+            mirrored = self._execute("SELECT id FROM work_items WHERE project = ?", (project,))
+        deleted = [(row[0],) for row in mirrored if row[0] not in existing]
+        if deleted:
+            with self._db_lock:
+                conn = self._connect()
+                conn.executemany("DELETE FROM work_items WHERE id = ?", deleted)
+                conn.executemany("DELETE FROM mentions WHERE work_item_id = ?", deleted)
+                conn.commit()
+        self._purged_at[project] = time.time()
+        logger.info(f"🪞 Зеркало Work Items {project}: удалено {len(deleted)} элементов, которых нет в TFS")
+        return len(deleted)
+
+    def _store(self, work_items: Sequence[WorkItemInfo]) -> int:
+        """Сохранение элементов, ревизия которых изменилась"""
+        if not work_items:
+            return 0
+        ids = [item.id for item in work_items]
+        known: Dict[int, Optional[int]] = {}
+        for start in range(0, len(ids), self.SQL_CHUNK_SIZE):
+            chunk = ids[start:start + self.SQL_CHUNK_SIZE]
+            known.update(self._execute(
+                f"SELECT id, rev FROM work_items WHERE id IN ({', '.join('?' for _ in chunk)})", chunk
+            ))
+
+        rows, mention_rows, changed_ids = [], [], []
+        for item in work_items:
+            fields = item.fields or {}
+            rev = fields.get("System.Rev")
+            if item.id in known and rev is not None and known[item.id] == rev:
+                continue
+            description = html_to_text(fields.get("System.Description"))
+            relations = [
+                {"rel": relation.get("rel"), "url": relation.get("url")}
+                for relation in item.relations or []
+            ]
+            rows.append((
+                item.id, rev, item.work_item_type, item.state, item.title, description,
+                fields.get("System.TeamProject") or item.project, item.changed_date,
+                json.dumps(relations, ensure_ascii=False)
+            ))
+            changed_ids.append((item.id,))
+            mention_rows.extend(
+                (item.id, mentioned) for mentioned in extract_work_item_mentions(item.title, description)
+                if mentioned != item.id
+            )
+
+        if not rows:
+            return 0
+        with self._db_lock:
+            conn = self._connect()
+            # Замена через DELETE/INSERT: триггеры поддерживают полнотекстовый индекс
+            conn.executemany("DELETE FROM work_items WHERE id = ?", changed_ids)
+            conn.executemany(
+                "INSERT INTO work_items (id, rev, work_item_type, state, title, description, project, "
+                "changed_date, relations) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.executemany("DELETE FROM mentions WHERE work_item_id = ?", changed_ids)
+            conn.executemany("INSERT OR IGNORE INTO mentions (work_item_id, mentioned_id) VALUES (?, ?)", mention_rows)
+            conn.commit()
+        return len(rows)
+
+    async def run_periodic(self, interval: float = None):
+        """Фоновая синхронизация (первая - сразу после старта)"""
+        interval = interval or settings.WORK_ITEM_MIRROR_SYNC_INTERVAL
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Фоновая синхронизация зеркала Work Items завершилась ошибкой: {e}")
+            await asyncio.sleep(interval)
+
+    # --- Поиск ---
+
+    def is_ready(self, project: str = None) -> bool:
+        """
+        Зеркало покрывает поиск и синхронизировано не позже допустимой давности:
+        project - поиск в проекте, без project - поиск по всей коллекции
+        """
+        if not settings.WORK_ITEM_MIRROR_ENABLED:
+            return False
+        if ALL_PROJECTS in self.projects:
+            return self._is_synced([ALL_PROJECTS])
+        if not project or project not in self.projects:
+            return False
+        return self._is_synced([project])
+
+    def _is_synced(self, projects: List[str]) -> bool:
+        if not projects:
+            return False
+        try:
+            placeholders = ", ".join("?" for _ in projects)
+            rows = self._execute(f"SELECT synced_at FROM sync_state WHERE project IN ({placeholders})", projects)
+        except sqlite3.Error:
+            return False
+        max_age = settings.WORK_ITEM_MIRROR_MAX_STALENESS
+        return len(rows) == len(projects) and all(time.time() - row[0] <= max_age for row in rows)
+
+    def _filters(self, project: str = None, work_item_types: Sequence[str] = None) -> Tuple[str, List[Any]]:
+        conditions, params = [], []
+        if project:
+            conditions.append("w.project = ?")
+            params.append(project)
+        if work_item_types:
+            conditions.append(f"w.work_item_type IN ({', '.join('?' for _ in work_item_types)})")
+            params.extend(work_item_types)
+        return "".join(f" AND {condition}" for condition in conditions), params
+
+    def search_text(self, terms: Iterable[str], project: str = None, work_item_types: Sequence[str] = None,
+                    title_only: bool = False, limit: int = None) -> List[int]:
+        """ID элементов, в заголовке (и описании) которых встречается хотя бы один из терминов (без терминов - все)"""
+        terms = [term for term in {str(term).strip() for term in terms} if term]
+        self._connect()
+        where, params = self._filters(project, work_item_types)
+        limit_sql = f" LIMIT {int(limit)}" if limit else ""
+
+        if not terms:
+            sql = f"SELECT w.id FROM work_items w WHERE 1 = 1{where} ORDER BY w.changed_date DESC{limit_sql}"
+            return [row[0] for row in self._execute(sql, params)]
+
+        if self.fts_available:
+            query = " OR ".join(fts_phrase(term) for term in terms)
+            if title_only:
+                query = "title : (" + query + ")"
+            sql = (
+                "SELECT w.id FROM work_items_fts f JOIN work_items w ON w.id = f.rowid "
+                f"WHERE work_items_fts MATCH ?{where} ORDER BY w.changed_date DESC{limit_sql}"
+            )
+            return [row[0] for row in self._execute(sql, [query, *params])]
+
+        columns = ["w.title"] if title_only else ["w.title", "w.description"]
+        like = " OR ".join(f"{column} LIKE ?" for _ in terms for column in columns)
+        like_params = [f"%{term}%" for term in terms for _ in columns]
+        sql = f"SELECT w.id FROM work_items w WHERE ({like}){where} ORDER BY w.changed_date DESC{limit_sql}"
+        return [row[0] for row in self._execute(sql, [*like_params, *params])]
+
+    def search_mentions(self, work_item_ids: Iterable[int], work_item_types: Sequence[str] = None) -> List[int]:
+        """ID элементов, в заголовке или описании которых упомянут один из ID"""
+        ids = sorted({int(wid) for wid in work_item_ids})
+        if not ids:
+            return []
+        where, params = self._filters(None, work_item_types)
+        sql = (
+            "SELECT DISTINCT w.id FROM mentions m JOIN work_items w ON w.id = m.work_item_id "
+            f"WHERE m.mentioned_id IN ({', '.join('?' for _ in ids)}){where} ORDER BY w.id"
+        )
+        return [row[0] for row in self._execute(sql, [*ids, *params])]
+
+    def search(self, terms: Iterable[str], work_item_types: Sequence[str] = None, project: str = None) -> Set[int]:
+        """Поиск для чек-листов: числовые термины - по упоминаниям ID, остальные - полнотекстово"""
+        terms = [str(term).strip() for term in terms if str(term).strip()]
+        id_terms = [int(term) for term in terms if term.isdigit()]
+        text_terms = [term for term in terms if not term.isdigit()]
+        found = set(self.search_mentions(id_terms, work_item_types))
+        # search_text без терминов возвращает все элементы - только числовые термины ищутся по упоминаниям
+        if text_terms:
+            found.update(self.search_text(text_terms, project, work_item_types))
+        return found
+
+    def get_work_items(self, work_item_ids: Sequence[int]) -> List[WorkItemInfo]:
+        """Work Items из зеркала в порядке запрошенных ID"""
+        ids = [int(wid) for wid in work_item_ids]
+        rows = []
+        for start in range(0, len(ids), self.SQL_CHUNK_SIZE):
+            chunk = ids[start:start + self.SQL_CHUNK_SIZE]
+            rows.extend(self._execute(
+                "SELECT id, rev, work_item_type, state, title, description, project, changed_date, relations "
+                f"FROM work_items WHERE id IN ({', '.join('?' for _ in chunk)})", chunk
+            ))
+        by_id = {}
+        for row in rows:
+            by_id[row[0]] = WorkItemInfo(
+                id=row[0],
+                work_item_type=row[2] or "",
+                title=row[4] or "",
+                state=row[3] or "",
+                changed_date=row[7],
+                project=row[6],
+                url=f"{settings.TFS_URL}/_workitems/edit/{row[0]}",
+                fields={
+                    "System.Id": row[0], "System.Rev": row[1], "System.WorkItemType": row[2],
+                    "System.State": row[3], "System.Title": row[4], "System.Description": row[5],
+                    "System.TeamProject": row[6], "System.ChangedDate": row[7],
+                },
+                relations=json.loads(row[8]) if row[8] else []
+            )
+        return [by_id[wid] for wid in ids if wid in by_id]
+
+    def status(self) -> Dict[str, Any]:
+        """Состояние синхронизации для /api/v1/status"""
+        if not settings.WORK_ITEM_MIRROR_ENABLED:
+            return {"enabled": False}
+        try:
+            count = self._execute("SELECT COUNT(*) FROM work_items")[0][0]
+            state = self._execute("SELECT project, last_changed, synced_at FROM sync_state")
+        except sqlite3.Error as e:
+            return {"enabled": True, "error": str(e)}
+        return {
+            "enabled": True,
+            "fts5": self.fts_available,
+            "work_items": count,
+            "projects": {row[0]: {"last_changed": row[1], "synced_at": row[2]} for row in state},
+            "collection_wide": ALL_PROJECTS in self.projects,
+            "ready": self._is_synced(self.projects),
+        }
+
+
+# Глобальный экземпляр зеркала
+work_item_mirror = WorkItemMirror()
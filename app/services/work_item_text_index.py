@@ -0,0 +1,125 @@
+"""
+Инвертированный индекс слов по заголовкам и описаниям Work Items (для текстового поиска без TFS)
+"""
+
+import re
+import bisect
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+DEFAULT_FIELDS = ("title", "description")
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова текста в нижнем регистре"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class WorkItemTextIndex:
+    """
+    Индекс слов по полям снимка Work Items (словари с id / title / description / work_item_type).
+
+    Текст каждого поля приводится к нижнему регистру один раз. Поиск термина берет позиции
+    элементов, в которых есть слова, начинающиеся с каждого слова термина (двоичный поиск по
+    отсортированному словарю), и только для них проверяет вхождение термина подстрокой.
+    Первое слово термина может начинаться внутри слова текста ("test" в "autotest",
+    "210636" в "US210636"), поэтому для него берутся слова словаря, содержащие его.
+    Результат совпадает с "термин in текст".
+    """
+
+    def __init__(self, items: Sequence[Dict[str, Any]], fields: Sequence[str] = DEFAULT_FIELDS):
+        self.items = list(items)
+        self.fields = tuple(fields)
+        self._texts: Dict[str, List[str]] = {field: [] for field in self.fields}
+        self._postings: Dict[str, Dict[str, Set[int]]] = {field: defaultdict(set) for field in self.fields}
+        self._types: Dict[str, Set[int]] = defaultdict(set)
+
+        for position, item in enumerate(self.items):
+            for field in self.fields:
+                text = (item.get(field) or "").lower()
+                self._texts[field].append(text)
+                for token in TOKEN_PATTERN.findall(text):
+                    self._postings[field][token].add(position)
+            self._types[(item.get("work_item_type") or "").lower()].add(position)
+
+        self._vocabulary: Dict[str, List[str]] = {field: sorted(self._postings[field]) for field in self.fields}
+
+    @staticmethod
+    def fingerprint(items: Sequence[Dict[str, Any]]) -> int:
+        """Отпечаток снимка: индекс перестраивается только при изменении элементов"""
+        return hash(tuple(
+            (item.get("id"), item.get("title"), item.get("description"), item.get("work_item_type"))
+            for item in items
+        ))
+
+    def text(self, position: int, field: str) -> str:
+        """Текст поля в нижнем регистре"""
+        return self._texts[field][position]
+
+    def _prefix_postings(self, field: str, prefix: str, memo: Dict[Tuple[str, str], Set[int]]) -> Set[int]:
+        key = (field, prefix)
+        if key not in memo:
+            vocabulary = self._vocabulary[field]
+            postings = self._postings[field]
+            result: Set[int] = set()
+            index = bisect.bisect_left(vocabulary, prefix)
+            while index < len(vocabulary) and vocabulary[index].startswith(prefix):
+                result |= postings[vocabulary[index]]
+                index += 1
+            memo[key] = result
+        return memo[key]
+
+    def _infix_postings(self, field: str, part: str, memo: Dict[Tuple[str, str], Set[int]]) -> Set[int]:
+        key = (field, "*" + part)
+        if key not in memo:
+            postings = self._postings[field]
+            result: Set[int] = set()
+            for word in self._vocabulary[field]:
+                if part in word:
+                    result |= postings[word]
+            memo[key] = result
+        return memo[key]
+
+    def find(self, terms: Iterable[str], fields: Optional[Sequence[str]] = None) -> Set[int]:
+        """Позиции элементов, в полях которых встречается хотя бы один из терминов"""
+        fields = tuple(fields or self.fields)
+        memo: Dict[Tuple[str, str], Set[int]] = {}
+        found: Set[int] = set()
+
+        for term in {term.lower() for term in terms if term}:
+            tokens = tokenize(term)
+            if not tokens:
+                # Термин без слов (знаки препинания) - проверка подстрокой по всем текстам
+                for field in fields:
+                    found.update(position for position, text in enumerate(self._texts[field]) if term in text)
+                continue
+            for field in fields:
+                candidates: Optional[Set[int]] = None
+                for number, token in enumerate(tokens):
+                    # Термин, начинающийся со слова, может начинаться внутри слова текста
+                    if number == 0 and TOKEN_PATTERN.match(term):
+                        postings = self._infix_postings(field, token, memo)
+                    else:
+                        postings = self._prefix_postings(field, token, memo)
+                    candidates = postings if candidates is None else candidates & postings
+                    if not candidates:
+                        break
+                texts = self._texts[field]
+                found.update(position for position in candidates or () if term in texts[position])
+        return found
+
+    def with_types(self, work_item_types: Iterable[str]) -> Set[int]:
+        """Позиции элементов указанных типов (без учета регистра)"""
+        found: Set[int] = set()
+        for work_item_type in work_item_types:
+            found |= self._types.get(work_item_type.lower(), set())
+        return found
+
+    def select(self, positions: Iterable[int]) -> List[Dict[str, Any]]:
+        """Элементы в исходном порядке снимка"""
+        return [self.items[position] for position in sorted(set(positions))]
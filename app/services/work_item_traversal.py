@@ -0,0 +1,141 @@
+"""
+Обход связей Work Items в ширину (по уровням) с batch-загрузкой каждого уровня
+"""
+
+import asyncio
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.config.settings import settings
+from app.models.tfs_models import WorkItemInfo
+from app.services.link_graph import parse_work_item_relations
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TraversalNode:
+    """Найденный при обходе Work Item"""
+    item: WorkItemInfo
+    depth: int
+    parent_id: Optional[int] = None
+    rel_type: Optional[str] = None
+
+
+@dataclass
+class TraversalResult:
+    """Результат обхода: узлы в порядке уровней и признаки досрочной остановки"""
+    nodes: List[TraversalNode] = field(default_factory=list)
+    truncated: bool = False
+    timed_out: bool = False
+    elapsed: float = 0.0
+
+    @property
+    def items(self) -> List[WorkItemInfo]:
+        return [node.item for node in self.nodes]
+
+
+def extract_related_ids(item: WorkItemInfo, link_types: Optional[Set[str]] = None) -> List[tuple]:
+    """Список (id, тип связи) связанных Work Items; ссылки на артефакты и гиперссылки пропускаются"""
+    return [
+        (related_id, rel_type)
+        for rel_type, related_id in parse_work_item_relations(item)
+        if link_types is None or rel_type in link_types
+    ]
+
+
+class WorkItemTraversal:
+    """
+    Обход графа связей Work Items по уровням.
+
+    Каждый уровень (frontier) загружается batch-запросами, которые выполняются параллельно
+    с ограничением через семафор. Посещенные ID не загружаются повторно. Обход прекращается
+    при достижении глубины, лимита элементов или исчерпании бюджета времени - в этом случае
+    возвращается уже собранный результат.
+    """
+
+    def __init__(self, tfs_service, max_depth: int = None, max_fan_out: int = None,
+                 max_items: int = None, concurrency: int = None, time_budget: float = None):
+        self.tfs_service = tfs_service
+        self.max_depth = max_depth if max_depth is not None else settings.CHECKLIST_TRAVERSAL_MAX_DEPTH
+        self.max_fan_out = max_fan_out if max_fan_out is not None else settings.CHECKLIST_TRAVERSAL_MAX_FAN_OUT
+        self.max_items = max_items if max_items is not None else settings.CHECKLIST_TRAVERSAL_MAX_ITEMS
+        self.concurrency = concurrency if concurrency is not None else settings.CHECKLIST_TRAVERSAL_CONCURRENCY
+        self.time_budget = time_budget if time_budget is not None else settings.CHECKLIST_TRAVERSAL_TIME_BUDGET
+
+    async def traverse(self, root_ids: Iterable[int], link_types: Optional[Set[str]] = None,
+                       include_roots: bool = True) -> TraversalResult:
+        """Обход от корневых элементов; link_types ограничивает типы связей (None - все связи)"""
+        started = time.monotonic()
+        deadline = started + self.time_budget
+        result = TraversalResult()
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        visited: Set[int] = set()
+        frontier: Dict[int, tuple] = {}
+        for root_id in root_ids:
+            root_id = int(root_id)
+            if root_id not in frontier:
+                frontier[root_id] = (None, None)
+
+        depth = 0
+        while frontier:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                result.timed_out = True
+                break
+
+            try:
+                items = await asyncio.wait_for(self._fetch_level(list(frontier), semaphore), timeout=remaining)
+            except asyncio.TimeoutError:
+                logger.warning(f"⏱️ Бюджет времени обхода ({self.time_budget} сек) исчерпан на уровне {depth}")
+                result.timed_out = True
+                break
+
+            visited.update(frontier)
+            next_frontier: Dict[int, tuple] = {}
+
+            for item in items:
+                parent_id, rel_type = frontier.get(item.id, (None, None))
+                if depth > 0 or include_roots:
+                    if len(result.nodes) >= self.max_items:
+                        result.truncated = True
+                        break
+                    result.nodes.append(TraversalNode(item, depth, parent_id, rel_type))
+
+                if depth >= self.max_depth:
+                    continue
+
+                related = extract_related_ids(item, link_types)
+                if len(related) > self.max_fan_out:
+                    logger.debug(f"Work Item {item.id}: {len(related)} связей, ограничено до {self.max_fan_out}")
+                    result.truncated = True
+                for rid, rtype in related[:self.max_fan_out]:
+                    if rid not in visited and rid not in next_frontier:
+                        next_frontier[rid] = (item.id, rtype)
+
+            if result.truncated and len(result.nodes) >= self.max_items:
+                break
+            frontier = next_frontier
+            depth += 1
+
+        result.elapsed = time.monotonic() - started
+        logger.info(f"🔎 Обход связей: {len(result.nodes)} элементов, глубина {depth}, "
+                    f"{result.elapsed:.2f} сек{' (по таймауту)' if result.timed_out else ''}")
+        return result
+
+    async def _fetch_level(self, ids: List[int], semaphore: asyncio.Semaphore) -> List[WorkItemInfo]:
+        """Параллельная загрузка уровня пачками размера batch-запроса"""
+        batch_size = self.tfs_service.WORK_ITEMS_BATCH_SIZE
+        chunks = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+        async def _fetch_chunk(chunk: List[int]) -> List[WorkItemInfo]:
+            async with semaphore:
+                return await self.tfs_service.get_work_items_batch(chunk)
+
+        items: List[WorkItemInfo] = []
+        for chunk_items in await asyncio.gather(*[_fetch_chunk(chunk) for chunk in chunks]):
+            items.extend(chunk_items)
+        return items
@@ -9,6 +9,8 @@ class TFSConfluenceApp {
         this.projects = [];
         this.recentActivity = [];
         this.serviceStatus = {};
+        // Token of the User Story preview awaiting this user's confirmation and the API that issued it
+        this.pendingPreview = null;
         
         this.init();
     }
@@ -165,8 +167,13 @@ class TFSConfluenceApp {
             console.log('Processing message:', message);
             console.log('Lower message:', lowerMessage);
             
-            // First check for change chain keywords (higher priority)
-            if (lowerMessage.includes('цепочку') || lowerMessage.includes('связанных тикетов') || lowerMessage.includes('связанных') || lowerMessage.includes('цепочка')) {
+            // Confirmation of this user's own User Story preview
+            if (this.pendingPreview && this.isConfirmationMessage(lowerMessage)) {
+                console.log('Routing to User Story confirmation');
+                response = await this.sendUserStoryConfirmation(message);
+            }
+            // Then check for change chain keywords
+            else if (lowerMessage.includes('цепочку') || lowerMessage.includes('связанных тикетов') || lowerMessage.includes('связанных') || lowerMessage.includes('цепочка')) {
                 console.log('Routing to change chain service');
                 response = await this.sendChangeChainRequest(message);
             }
@@ -175,6 +182,11 @@ class TFSConfluenceApp {
                 console.log('Routing to checklist service');
                 response = await this.sendChecklistRequest(message);
             } 
+            // Article-based User Story requests run the step-by-step pipeline with live progress
+            else if (lowerMessage.includes('по статье') && !lowerMessage.includes('http')) {
+                console.log('Routing to process request stream');
+                response = await this.sendProcessRequestStream(message);
+            }
             // Default to change chain for other requests
             else {
                 console.log('Routing to change chain service (default)');
@@ -206,6 +218,49 @@ class TFSConfluenceApp {
             body: JSON.stringify({ message })
         });
         
+        const data = await response.json();
+        const previewToken = data.data?.preview_token;
+        if (data.needs_confirmation && previewToken) {
+            this.pendingPreview = { token: previewToken, source: 'chat' };
+        }
+        return data;
+    }
+
+    isConfirmationMessage(lowerMessage) {
+        return ['да', 'создать', 'yes', 'create', 'подтвердить', 'подтверждаю',
+                'нет', 'отмена', 'no', 'cancel'].includes(lowerMessage.trim());
+    }
+
+    async sendUserStoryConfirmation(message) {
+        // The server confirms only the preview identified by the token, never the latest one overall
+        const { token, source } = this.pendingPreview;
+        this.pendingPreview = null;
+        
+        if (source === 'process') {
+            const response = await fetch(`${this.apiBaseUrl}/process-request`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    query: message,
+                    request_type: 'create_user_story',
+                    additional_params: { preview_token: token }
+                })
+            });
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            return this.formatProcessingResult(await response.json());
+        }
+        
+        const response = await fetch(`${this.apiBaseUrl}/change-chain-chat`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ message, preview_token: token })
+        });
         return await response.json();
     }
 
@@ -221,6 +276,111 @@ class TFSConfluenceApp {
         return await response.json();
     }
 
+    async sendProcessRequestStream(message) {
+        // EventSource supports only GET, so the SSE stream is read from a POST response body
+        const response = await fetch(`${this.apiBaseUrl}/process-request/stream`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+            },
+            body: JSON.stringify({ query: message, request_type: 'create_user_story' })
+        });
+        
+        if (!response.ok || !response.body) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let result = null;
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const event = this.parseSseEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                if (!event) continue;
+                
+                if (event.type === 'step_started') {
+                    this.updateTypingIndicator(`${event.data.step_name}...`);
+                } else if (event.type === 'step') {
+                    this.addStepProgress(event.data);
+                } else if (event.type === 'result') {
+                    result = event.data;
+                } else if (event.type === 'error') {
+                    throw new Error(event.data.error);
+                }
+            }
+        }
+        
+        if (!result) {
+            throw new Error('Обработка прервалась без результата');
+        }
+        return this.formatProcessingResult(result);
+    }
+
+    parseSseEvent(chunk) {
+        let type = 'message';
+        const dataLines = [];
+        chunk.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        // Comment-only chunks are heartbeats
+        if (dataLines.length === 0) return null;
+        return { type, data: JSON.parse(dataLines.join('\n')) };
+    }
+
+    addStepProgress(step) {
+        const chatMessages = document.getElementById('chatMessages');
+        if (!chatMessages) return;
+        
+        const ok = step.status === 'success';
+        const icon = ok ? 'check text-success' : 'times text-danger';
+        const details = ok ? `${(step.duration_seconds || 0).toFixed(2)} сек` : (step.error_message || 'ошибка');
+        
+        const stepDiv = document.createElement('div');
+        stepDiv.className = 'message system-message';
+        stepDiv.innerHTML = `
+            <div class="message-content small">
+                <i class="fas fa-${icon} me-2"></i>${step.step_name}
+                <span class="text-muted ms-2">${details}</span>
+            </div>
+        `;
+        
+        // Progress lines go above the typing indicator, which stays last until the result arrives
+        const typingIndicator = document.getElementById('typingIndicator');
+        chatMessages.insertBefore(stepDiv, typingIndicator);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
+    formatProcessingResult(result) {
+        const previewToken = result.additional_data?.preview_token;
+        if (previewToken) {
+            // Preview awaiting confirmation: the token goes back in additional_params
+            this.pendingPreview = { token: previewToken, source: 'process' };
+            return { success: result.success, message: (result.message || '').replace(/\n/g, '<br>') };
+        }
+        
+        let message = result.summary || '';
+        (result.created_work_items || []).forEach(item => {
+            message += `<br>📋 ${item.work_item_type}: <a href="${item.url}" target="_blank">${item.id}</a> - ${item.title}`;
+        });
+        if (result.total_duration_seconds) {
+            message += `<br><small class="text-muted">Выполнено за ${result.total_duration_seconds.toFixed(1)} сек</small>`;
+        }
+        return { success: result.success, message };
+    }
+
     addMessageToChat(message, type = 'user') {
         const chatMessages = document.getElementById('chatMessages');
         
@@ -563,7 +723,7 @@ class TFSConfluenceApp {
         typingDiv.innerHTML = `
             <div class="message-content">
                 <i class="fas fa-robot me-2"></i>
-                Обрабатываю запрос
+                <span class="typing-text">Обрабатываю запрос</span>
                 <div class="typing-dots">
                     <span></span>
                     <span></span>
@@ -576,6 +736,13 @@ class TFSConfluenceApp {
         chatMessages.scrollTop = chatMessages.scrollHeight;
     }
 
+    updateTypingIndicator(text) {
+        const typingText = document.querySelector('#typingIndicator .typing-text');
+        if (typingText) {
+            typingText.textContent = text;
+        }
+    }
+
     hideTypingIndicator() {
         const typingIndicator = document.getElementById('typingIndicator');
         if (typingIndicator) {
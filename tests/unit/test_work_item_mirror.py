@@ -0,0 +1,49 @@
+"""
+Тесты поиска по локальному зеркалу Work Items
+"""
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.models.tfs_models import WorkItemInfo
+from app.services.work_item_mirror import WorkItemMirror
+
+
+def _work_item(work_item_id: int, title: str, description: str = "", work_item_type: str = "Test Case") -> WorkItemInfo:
+    return WorkItemInfo(
+        id=work_item_id,
+        work_item_type=work_item_type,
+        title=title,
+        state="Active",
+        project="Houston",
+        changed_date="2024-01-01T00:00:00Z",
+        fields={"System.Rev": 1, "System.Description": description, "System.TeamProject": "Houston"},
+    )
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    mirror = WorkItemMirror(tfs_service=MagicMock(), projects=["Houston"], db_path=str(tmp_path / "mirror.db"))
+    mirror._store([
+        _work_item(10, "Проверка загрузки", "<p>Тест для US #12345</p>"),
+        _work_item(11, "Проверка выгрузки", "<p>Без ссылок</p>"),
+        _work_item(12, "Autotest for backlog"),
+        _work_item(13, "Отчет по долгам"),
+        _work_item(14, "Ошибка в 12345", work_item_type="Bug"),
+    ])
+    yield mirror
+    mirror._conn.close()
+
+
+class TestWorkItemMirrorSearch:
+    """Тесты WorkItemMirror.search"""
+
+    def test_numeric_terms_only_match_mentions(self, mirror):
+        """Только числовые термины - элементы, где упомянут ID, а не все элементы зеркала"""
+        assert mirror.search(["12345"], ["Test Case"]) == {10}
+
+    def test_numeric_terms_without_mentions(self, mirror):
+        assert mirror.search(["99999"], ["Test Case"]) == set()
+
+    def test_mixed_terms(self, mirror):
+        assert mirror.search(["12345", "backlog"], ["Test Case"]) == {10, 12}
@@ -0,0 +1,41 @@
+"""
+Тесты текстового индекса Work Items
+"""
+import pytest
+
+from app.services.work_item_text_index import WorkItemTextIndex
+
+
+ITEMS = [
+    {"id": 1, "title": "Autotest for US210636", "description": "", "work_item_type": "Test Case"},
+    {"id": 2, "title": "Логика расчета", "description": "Связано с #210636 в Backlog", "work_item_type": "Bug"},
+    {"id": 3, "title": "Integration tests", "description": "Проверка выгрузки", "work_item_type": "Test Case"},
+    {"id": 4, "title": "Статический фильтр", "description": "Некорректная работа фильтра", "work_item_type": "Bug"},
+]
+
+
+@pytest.fixture
+def index():
+    return WorkItemTextIndex(ITEMS)
+
+
+class TestWorkItemTextIndexFind:
+    """find() совпадает с проверкой "термин in текст" (без учета регистра)"""
+
+    @pytest.mark.parametrize("term", [
+        "210636", "#210636", "test", "autotest", "backlog", "логика расчета", "расчета",
+        "некорректная работа", "ректная раб", "фильтр", "tests", "us210636", "нет такого", "1", "#",
+    ])
+    def test_matches_substring_semantics(self, index, term):
+        expected = {
+            position for position, item in enumerate(ITEMS)
+            if any(term.lower() in (item[field] or "").lower() for field in ("title", "description"))
+        }
+        assert index.find([term]) == expected
+
+    def test_match_inside_word(self, index):
+        assert index.find(["210636"]) == {0, 1}
+        assert index.find(["test"]) == {0, 2}
+
+    def test_fields(self, index):
+        assert index.find(["210636"], fields=("title",)) == {0}